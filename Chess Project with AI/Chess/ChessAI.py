@@ -1,95 +1,745 @@
+import copy
+import os
+import pickle
+import queue
 import random
-from stockfish import Stockfish
+import threading
+import time
+from concurrent.futures import wait
+from array import array
+from multiprocessing import Pool, shared_memory
+import ChessEngine, ChessUCI, ChessBook, ChessTablebase
 
-stockfish = Stockfish("Chess/stockfish13.exe")
-stockfish._start_new_game()
-
-pieceScore = {'k': 0, 'q': 9, 'r': 5, 'b': 3, 'n': 3, 'p': 1}
-checkmate = 1000
+checkmate = 100000 #scores are in centipawns
 stalemate = 0
-max_depth = 3
-
-ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
-                "5": 3, "6": 2, "7": 1, "8": 0}
-filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3,
-                "e": 4, "f": 5, "g": 6, "h": 7}
-
-def stockfishMove():
-    move = []
-    sf = stockfish.get_best_move()
-    coord = list(sf)
-    startPOS = (ranksToRows[coord[1]], filesToCols[coord[0]])
-    endPOS = (ranksToRows[coord[3]], filesToCols[coord[2]])
-    move.append(startPOS)
-    move.append(endPOS)
-    
-    return move
+mateScore = checkmate - 1000 #scores beyond this are mates: checkmate less the plies from the root to the mate
+max_depth = 32 #deepest iteration the search will start, the time limits normally stop it long before
+thinkTime = 2.0 #seconds per move when the AI is not playing on a clock
+maxPly = 128 #deepest ply the search (including quiescence) can reach
+ttSizeMB = 16 #memory budget of the transposition table
+stockfishPath = None #UCI engine to run, None looks for stockfish (see ChessUCI.findEngine)
+stockfishDepth = 15
+stockfishMoves = [] #moves of the game so far in long algebraic notation, the position stockfish is asked about
+stockfishManager = None
+analysisCachePath = None #SQLite file to keep stockfish's analysis between runs, None keeps it in memory only
+analysisCache = None
+bookPath = None #opening book the AI plays from before it thinks (ChessBook.py builds one), None plays without a book
+bookDepth = 20 #plies into the game the book is asked
+bestBookMove = False #always play the heaviest book move instead of a weighted random one
+openingBook = None
+tablebasePath = None #directory of endgame tables (ChessTablebase.py generates them), None searches without them
+tablebases = None
+tablebasePieces = 0 #most pieces of any table, 0 until the tables are opened or when there are none
+
+def stockfish():
+    #the engine manager, nothing is started until the first question is asked
+    global stockfishManager, analysisCache
+    if stockfishManager is None:
+        analysisCache = ChessUCI.AnalysisCache(path=analysisCachePath)
+        stockfishManager = ChessUCI.EngineManager(stockfishPath, cache=analysisCache)
+    return stockfishManager
+
+def stockfishResult(engineResult, validMoves):
+    #stockfish's answer as a SearchResult with the Move from validMoves, its move is None if that isn't one of them
+    result = SearchResult()
+    for move in validMoves:
+        if move.getLastMovement() == engineResult.bestMove:
+            result.move = move
+            if engineResult.mate is not None: #in plies from the root like the built-in search's mate scores
+                result.score = checkmate - 2 * engineResult.mate + 1 if engineResult.mate > 0 else -checkmate - 2 * engineResult.mate
+            else:
+                result.score = engineResult.score
+            result.depth = engineResult.depth
+            result.nodes = engineResult.nodes
+    return result
+
+def book():
+    #the opening book, mapped the first time it is asked about. None without one
+    global openingBook, bookPath
+    if openingBook is None and bookPath is not None:
+        try:
+            openingBook = ChessBook.OpeningBook(bookPath)
+        except (OSError, ValueError) as error:
+            print('Opening book: ' + str(error))
+            bookPath = None
+    return openingBook
+
+def findBookMove(gs, validMoves):
+    #the Move from validMoves the book suggests, None out of the book or past bookDepth
+    ply = (gs.fullmoveNumber - 1) * 2 + (0 if gs.whiteToMove else 1) #counts for positions set up from a FEN too
+    if ply >= bookDepth or book() is None:
+        return None
+    move = openingBook.pickMove(gs, best=bestBookMove)
+    for validMove in validMoves:
+        if validMove.packed == move:
+            return validMove
+    return None
+
+def endgameTables():
+    #the endgame tables, opened when the first search starts. None without them
+    global tablebases, tablebasePieces
+    if tablebases is None and tablebasePath is not None:
+        tablebases = ChessTablebase.Tablebases(tablebasePath)
+        tablebasePieces = tablebases.pieces
+    return tablebases
+
+def tablebaseScore(result, ply):
+    #an exact result from the tables as a search score, mates closer to the root score higher
+    outcome, plies = result
+    if outcome == 0:
+        return stalemate
+    return outcome * (checkmate - ply - plies)
+
+def findTablebaseMove(gs, validMoves):
+    #(Move, score) of the move the tables rate best: the fastest mate, a draw, or the slowest loss
+    #None when the position or any of its moves isn't in the tables
+    if endgameTables() is None or bin(gs.occupied[0] | gs.occupied[1]).count('1') > tablebasePieces:
+        return None
+    best = None
+    for move in validMoves:
+        gs.makeMove(move)
+        result = tablebases.probe(gs)
+        gs.undoMove()
+        if result is None:
+            return None
+        score = -tablebaseScore(result, 1)
+        if best is None or score > best[1]:
+            best = (move, score)
+    return best
 
 def findRandomMove(validMoves):
     return validMoves[random.randint(0, len(validMoves)-1)]
 
-def findBestMove(gs, validMoves):
-    global nextMove
-    nextMove = None
+class SearchLimits():
+    #how long the AI may think about one move
+    #soft: no new iteration is started after this many seconds, hard: the running iteration is abandoned
+    #workers above 1 search in that many processes sharing one hash table (findBestMoveParallel)
+    def __init__(self, moveTime=None, remaining=None, increment=0.0, movesToGo=30, maxDepth=None, workers=1):
+        if remaining is not None: #playing on a clock: spend a share of what is left plus most of the increment
+            soft = remaining / movesToGo + increment * 0.8
+            hard = min(soft * 4, remaining * 0.25 + increment * 0.8)
+            soft = min(soft, hard)
+        else: #fixed time per move
+            hard = moveTime if moveTime is not None else thinkTime
+            soft = hard / 2 #the next iteration takes several times longer than the last one, so don't start it late
+        self.soft = soft
+        self.hard = hard
+        self.maxDepth = maxDepth if maxDepth is not None else max_depth
+        self.workers = workers
+
+
+class SearchResult():
+    #what a search found: the move (a Move object from validMoves) and some statistics about the search
+    def __init__(self):
+        self.move = None
+        self.packedMove = 0
+        self.score = 0 #from the point of view of the side to move
+        self.depth = 0 #depth of the last completed iteration
+        self.nodes = 0
+        self.elapsed = 0.0 #seconds
+        self.cutoffs = 0 #beta cutoffs below the root
+        self.firstMoveCutoffs = 0 #of those, how many came from the first move searched
+
+    def firstMoveCutoffRate(self):
+        #share of cutoffs found on the first move, a measure of how good the move ordering is
+        return self.firstMoveCutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    def nodesPerSecond(self):
+        return int(self.nodes / self.elapsed) if self.elapsed > 0 else 0
+
+    def __repr__(self):
+        return 'SearchResult(move=' + (self.move.getLastMovement() if self.move else 'None') + ', score=' + str(self.score) + \
+                ', depth=' + str(self.depth) + ', nodes=' + str(self.nodes) + ', elapsed=' + str(round(self.elapsed, 3)) + ')'
+
+
+class SearchTimeout(Exception):
+    pass
+
+searchNodes = 0
+searchCutoffs = 0
+firstMoveCutoffs = 0
+repetitions = 0 #repetitions the search has run into, a draw score from below one depends on the path and isn't hashed
+hardDeadline = 0.0
+searchStop = None #threading.Event that abandons the running search when set, see SearchWorker
+
+def findBestMove(gs, validMoves, limits=None, progress=None):
+    bookMove = findBookMove(gs, validMoves) #known openings need no search
+    if bookMove is not None:
+        result = SearchResult()
+        result.move = bookMove
+        result.packedMove = bookMove.packed
+        return result
+    if limits is not None and limits.workers > 1:
+        return findBestMoveParallel(gs, validMoves, limits, limits.workers, progress)
     random.shuffle(validMoves)
     #findMoveMinMax(gs, validMoves, max_depth, gs.whiteToMove) #old minmax engine
-    findMoveNegaMaxAlphaBeta(gs, validMoves, max_depth, -checkmate, checkmate, 1 if gs.whiteToMove else -1) #current best bestmove algorithm (besides stockfish)
+    return iterativeDeepening(gs, validMoves, limits, progress) #current best bestmove algorithm (besides stockfish)
 
-    return nextMove
+def outOfTime():
+    return time.perf_counter() > hardDeadline or (searchStop is not None and searchStop.is_set())
 
-def findStockfishMove(gs, validMoves, moveList):
-    global nextMove
-    nextMove = None
-    stockfish.set_position(moveList)
-    #for move in validMoves:
-    #    print(move)
+def findStockfishMove(gs, validMoves, moveList, limits=None):
+    #stockfish's move for the position after moveList, the built-in search's if stockfish can't be used
+    setStockfishPosition(moveList)
+    try:
+        result = stockfishResult(stockfish().analyse(stockfishMoves, depth=stockfishDepth).result(), validMoves)
+    except ChessUCI.EngineError as error:
+        print(error)
+        result = SearchResult()
+    if result.move is None and validMoves:
+        result = findBestMove(gs, validMoves, limits)
+    return result
 
-    findMoveNegaMaxAlphaBeta(gs, validMoves, max_depth, -checkmate, checkmate, 1 if gs.whiteToMove else -1)
-    return nextMove
+class SearchWorker():
+    #thinks about the AI's move on a background thread so the GUI keeps drawing and handling events in the meantime
+    #it reports through a queue the event loop reads with poll(): ('progress', SearchResult) after every finished depth
+    #of the built-in search, ('error', message) if stockfish can't be used, and last ('done', SearchResult)
+    #cancel() abandons the search, nothing it posts afterwards reaches the GUI
+    def __init__(self):
+        self.thread = None
+        self.stop = None
+        self.messages = queue.Queue()
+        self.busy = False #from start() until poll() hands out the 'done' message
+
+    def start(self, gs, moveList=(), limits=None, useStockfish=True):
+        self.cancel()
+        self.stop = threading.Event()
+        self.busy = True
+        position = pickle.loads(pickle.dumps(gs)) #the search makes and takes back moves, the GUI keeps drawing gs meanwhile
+        self.thread = threading.Thread(target=self.think, args=(position, list(moveList), limits, useStockfish, self.stop, self.messages),
+                                        name='ai search', daemon=True)
+        self.thread.start()
+
+    def think(self, gs, moveList, limits, useStockfish, stop, messages):
+        global searchStop
+        validMoves = gs.getValidMoves()
+        result = SearchResult()
+        if useStockfish:
+            result.move = findBookMove(gs, validMoves) #stockfish isn't asked about known openings either
+        if result.move is None and useStockfish:
+            try:
+                request = stockfish().analyse(moveList, depth=stockfishDepth)
+                while not request.done(): #wait in short steps so a cancel is noticed
+                    if stop.is_set():
+                        return
+                    wait([request], 0.05)
+                result = stockfishResult(request.result(), validMoves)
+            except Exception as error: #whatever went wrong with stockfish, the built-in search still finds a move
+                messages.put(('error', str(error) or type(error).__name__))
+        if result.move is None and validMoves: #no stockfish, use the built-in search
+            searchStop = stop
+            try:
+                result = findBestMove(gs, validMoves, limits, lambda report: messages.put(('progress', report)))
+            finally:
+                searchStop = None
+        if not stop.is_set():
+            messages.put(('done', result))
+
+    def poll(self):
+        #the messages posted since the last call, without waiting for new ones
+        messages = []
+        while True:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                return messages
+            if message[0] == 'done':
+                self.busy = False
+            messages.append(message)
+
+    def cancel(self):
+        if self.stop is not None:
+            self.stop.set()
+        if self.thread is not None:
+            self.thread.join() #the search notices the stop within a few hundred nodes
+            self.thread = None
+        self.messages = queue.Queue() #drop whatever the abandoned search posted
+        self.busy = False
+
+#parallel search (lazy SMP): every worker process runs the same iterative deepening on the same position, all of them
+#reading and writing one transposition table in shared memory, so each worker skips the parts another one already searched.
+#workers start from differently shuffled root moves so they don't all walk the same tree in lockstep
+searchWorkers = os.cpu_count() or 1
+parallelPool = None
+sharedTable = None
+
+def startParallelSearch(workers=None):
+    global parallelPool, sharedTable, transpositionTable
+    stopParallelSearch()
+    workers = workers or searchWorkers
+    sharedTable = shared_memory.SharedMemory(create=True, size=TranspositionTable.sharedBytes(ttSizeMB))
+    transpositionTable = TranspositionTable(ttSizeMB, buffer=sharedTable.buf)
+    transpositionTable.clear()
+    #the main process searches too, so it needs one helper less than the number of workers
+    parallelPool = Pool(workers - 1, initializer=attachSharedTable, initargs=(sharedTable.name, ttSizeMB, tablebasePath))
+    parallelPool.workers = workers
+
+def stopParallelSearch():
+    global parallelPool, sharedTable, transpositionTable
+    if parallelPool is not None:
+        parallelPool.terminate()
+        parallelPool.join()
+        parallelPool = None
+    if sharedTable is not None:
+        transpositionTable.release()
+        transpositionTable = TranspositionTable(ttSizeMB)
+        sharedTable.close()
+        sharedTable.unlink()
+        sharedTable = None
+
+def attachSharedTable(name, sizeMB, tables=None):
+    global transpositionTable, sharedTable, tablebasePath
+    tablebasePath = tables #the helpers probe the same endgame tables as the main process
+    endgameTables()
+    if sharedTable is not None and sharedTable.name == name: #forked workers inherit the mapping already
+        return
+    sharedTable = shared_memory.SharedMemory(name=name)
+    transpositionTable = TranspositionTable(sizeMB, buffer=sharedTable.buf)
+
+def parallelSearchWorker(gs, limits, seed):
+    #runs in a helper process, gs arrives as the compact pickled GameState
+    validMoves = gs.getValidMoves()
+    random.Random(seed).shuffle(validMoves)
+    result = iterativeDeepening(gs, validMoves, limits, newSearch=False)
+    result.move = None #the caller matches packedMove against its own Move objects
+    return result
+
+def findBestMoveParallel(gs, validMoves, limits=None, workers=None, progress=None):
+    #with one worker (or one core) this is the plain single process search, which is deterministic for a fixed maxDepth
+    workers = workers or searchWorkers
+    if workers <= 1 or len(validMoves) <= 1:
+        return iterativeDeepening(gs, validMoves, limits, progress)
+    if parallelPool is None or parallelPool.workers != workers:
+        startParallelSearch(workers)
+    transpositionTable.newSearch() #once for every process, they all store with the shared age
+    helpers = [parallelPool.apply_async(parallelSearchWorker, (gs, limits, seed)) for seed in range(1, workers)]
+    result = iterativeDeepening(gs, validMoves, limits, progress, newSearch=False)
+    if searchStop is not None and searchStop.is_set(): #cancelled, don't wait for the helpers to use up their time
+        stopParallelSearch()
+        return result
+    for helper in helpers:
+        helperResult = helper.get()
+        result.nodes += helperResult.nodes
+        #a helper that finished a deeper iteration has the better move
+        if helperResult.depth > result.depth:
+            result.packedMove = helperResult.packedMove
+            result.score = helperResult.score
+            result.depth = helperResult.depth
+    for move in validMoves:
+        if move.packed == result.packedMove:
+            result.move = move
+    return result
+
+def iterativeDeepening(gs, validMoves, limits=None, progress=None, newSearch=True):
+    #searches depth 1, 2, 3... until the time runs out and returns the best move of the last finished depth
+    #progress, if given, is called with a copy of the result after every finished depth. newSearch=False leaves the
+    #hash table's age alone, the parallel search ages the shared table once for all its processes
+    global searchNodes, searchCutoffs, firstMoveCutoffs, hardDeadline
+    if limits is None:
+        limits = SearchLimits()
+    start = time.perf_counter()
+    softDeadline = start + limits.soft
+    searchNodes = 0
+    searchCutoffs = 0
+    firstMoveCutoffs = 0
+    result = SearchResult()
+    if newSearch:
+        transpositionTable.newSearch()
+    moveOrderer.newSearch()
+    rootMoves = [move.packed for move in validMoves]
+    if not rootMoves:
+        return result
+    tablebaseMove = findTablebaseMove(gs, validMoves)
+    if tablebaseMove is not None: #the tables know the answer, there is nothing to search
+        result.move, result.score = tablebaseMove
+        result.packedMove = result.move.packed
+        result.elapsed = time.perf_counter() - start
+        return result
+    moveOrderer.orderMoves(gs, rootMoves, 0)
+    historyLength = len(gs.history)
+    turnMultiplier = 1 if gs.whiteToMove else -1
+    for depth in range(1, limits.maxDepth + 1):
+        #depth 1 always finishes so there is a move to play, even with no time left
+        hardDeadline = start + limits.hard if depth > 1 else float('inf')
+        try:
+            score, bestMove = searchRoot(gs, rootMoves, depth, turnMultiplier)
+        except SearchTimeout:
+            while len(gs.history) > historyLength: #take back the moves of the abandoned search
+                gs.undoMove()
+            break
+        result.packedMove = bestMove
+        result.score = score
+        result.depth = depth
+        for move in validMoves: #the search works on packed moves, hand back the matching Move object
+            if move.packed == bestMove:
+                result.move = move
+        if progress is not None:
+            result.nodes = searchNodes
+            result.elapsed = time.perf_counter() - start
+            progress(copy.copy(result))
+        #search the best move first in the next iteration
+        rootMoves.remove(bestMove)
+        rootMoves.insert(0, bestMove)
+        if abs(score) >= mateScore or time.perf_counter() >= softDeadline:
+            break
+    result.nodes = searchNodes
+    result.cutoffs = searchCutoffs
+    result.firstMoveCutoffs = firstMoveCutoffs
+    result.elapsed = time.perf_counter() - start
+    return result
+
+def searchRoot(gs, rootMoves, depth, turnMultiplier):
+    alpha = -checkmate
+    beta = checkmate
+    bestScore = -checkmate - 1
+    bestMove = rootMoves[0]
+    for move in rootMoves:
+        gs.makeMove(move)
+        score = -findMoveNegaMaxAlphaBeta(gs, depth-1, -beta, -alpha, -turnMultiplier, 1)
+        gs.undoMove()
+        if score > bestScore:
+            bestScore = score
+            bestMove = move
+        if bestScore > alpha:
+            alpha = bestScore
+    transpositionTable.store(gs.zobristKey, depth, exactBound, bestScore, bestMove)
+    return bestScore, bestMove
 
 def findBestStockfishMove(movelist):
-    bm = stockfish.get_best_move()
-    print('Best move: ' + bm)
-    evaluation = stockfish.get_evaluation()
-    if evaluation.get('type') == 'mate':
-        print('Mate in ' + str(evaluation.get('value')))
+    try:
+        result = stockfish().analyse(movelist, depth=stockfishDepth).result()
+    except ChessUCI.EngineError as error:
+        print(error)
+        return
+    print('Best move: ' + str(result.bestMove))
+    if result.mate is not None:
+        print('Mate in ' + str(result.mate))
 
 def setStockfishPosition(movelist):
-    stockfish.set_position(movelist)
+    stockfishMoves[:] = movelist
+
+def stockfishDisplay():
+    try:
+        return stockfish().display(stockfishMoves).result()
+    except ChessUCI.EngineError as error:
+        print(error)
+        return []
 
 def outputFEN():
-    print(stockfish.get_fen_position())
+    #the position stockfish was last told about, worked out without asking the engine
+    gs = ChessEngine.GameState()
+    for move in stockfishMoves:
+        ChessUCI.playUCIMove(gs, move)
+    print(gs.toFEN())
 
 def outputBoard():
-    print(stockfish.get_board_visual())
+    for line in stockfishDisplay():
+        if line.startswith('Fen: '):
+            break
+        print(line)
 
 def changeStockfishDifficulty(difficulty):
     if difficulty >= 0 and difficulty <= 20:
-        stockfish.set_skill_level(difficulty)
+        stockfish().setOption('Skill Level', difficulty)
         print('Difficulty set to level ' + str(difficulty))
     else:
         print('Invalid input')
 
-def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
-    global nextMove
+#transposition table bound types
+exactBound, lowerBound, upperBound = 1, 2, 3
+
+class TranspositionTable():
+    #fixed size hash table of search results, each entry is two unsigned 64 bit slots (16 bytes):
+    #the zobrist key xor the data, and the packed data: move (16 bits), depth (8 bits), bound (2 bits), age (6 bits), score (32 bits)
+    #storing key ^ data means an entry half overwritten by another process never matches, so the table can be shared without locks
+    #a shared table keeps the search age in one more slot after the entries, so every process stores with the same age
+    entryBytes = 16
+    scoreOffset = 1 << 31
+
+    def __init__(self, sizeMB=16, replacement='depth', buffer=None):
+        self.size = self.entriesFor(sizeMB)
+        self.mask = self.size - 1
+        #'depth' keeps the deeper entry unless it is from an older search, 'always' overwrites on every store
+        self.replacement = replacement
+        self.slots = None
+        if buffer is None:
+            self.keys = array('Q', bytes(8 * self.size))
+            self.data = array('Q', bytes(8 * self.size))
+            self.ageSlot = array('Q', [0])
+        else: #a shared memory block of at least sharedBytes(sizeMB) bytes, used by the parallel search
+            self.slots = buffer.cast('Q')
+            self.keys = self.slots[:self.size]
+            self.data = self.slots[self.size:2 * self.size]
+            self.ageSlot = self.slots[2 * self.size:2 * self.size + 1]
+        self.resetStats()
+
+    @classmethod
+    def entriesFor(cls, sizeMB):
+        #the number of entries is the largest power of 2 that fits in the budget so the index is just key & mask
+        entries = 1
+        while entries * 2 * cls.entryBytes <= sizeMB * 1024 * 1024:
+            entries *= 2
+        return entries
+
+    @classmethod
+    def sharedBytes(cls, sizeMB):
+        #size of the shared memory block for a table of sizeMB: the entries and the age slot
+        return cls.entriesFor(sizeMB) * cls.entryBytes + 8
+
+    @property
+    def age(self):
+        return self.ageSlot[0]
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0 #probes that found a different position in the slot
+        self.stores = 0
+        self.overwrites = 0 #stores that replaced a different position
+
+    def clear(self):
+        self.keys[:] = array('Q', bytes(8 * self.size))
+        self.data[:] = array('Q', bytes(8 * self.size))
+        self.ageSlot[0] = 0
+
+    def release(self):
+        #lets go of a shared memory buffer so it can be closed
+        if self.slots is not None:
+            self.keys.release()
+            self.data.release()
+            self.ageSlot.release()
+            self.slots.release()
+            self.slots = None
+
+    def newSearch(self):
+        #entries from previous searches become the first to be replaced
+        self.ageSlot[0] = (self.ageSlot[0] + 1) & 63
+
+    def probe(self, key):
+        #returns (depth, bound, score, move) or None
+        self.probes += 1
+        i = key & self.mask
+        data = self.data[i]
+        storedKey = self.keys[i] ^ data
+        if storedKey == key:
+            self.hits += 1
+            return (data >> 16 & 255, data >> 24 & 3, (data >> 32) - self.scoreOffset, data & 65535)
+        self.misses += 1
+        if storedKey != 0:
+            self.collisions += 1
+        return None
+
+    def store(self, key, depth, bound, score, move):
+        i = key & self.mask
+        data = self.data[i]
+        storedKey = self.keys[i] ^ data
+        if storedKey != key and storedKey != 0:
+            if self.replacement == 'depth':
+                if data >> 26 & 63 == self.ageSlot[0] and data >> 16 & 255 > depth:
+                    return #keep the deeper entry from this search
+            self.overwrites += 1
+        elif storedKey == key and move == 0:
+            move = data & 65535 #keep the old best move if this search didn't find one
+        self.stores += 1
+        data = move | depth << 16 | bound << 24 | self.ageSlot[0] << 26 | (score + self.scoreOffset) << 32
+        self.data[i] = data
+        self.keys[i] = key ^ data
+
+    def hashfull(self):
+        #permille of the first 1000 slots that are in use
+        sample = min(1000, self.size)
+        return sum(1 for i in range(sample) if self.keys[i] != 0) * 1000 // sample
+
+    def stats(self):
+        return {'entries': self.size, 'sizeMB': self.size * self.entryBytes / (1024 * 1024), 'probes': self.probes, 'hits': self.hits, 
+                'misses': self.misses, 'collisions': self.collisions, 'stores': self.stores, 'overwrites': self.overwrites, 
+                'hitRate': self.hits / self.probes if self.probes else 0.0, 'hashfull': self.hashfull()}
+
+transpositionTable = TranspositionTable(ttSizeMB)
+
+class MoveOrderer():
+    #sorts moves so the ones most likely to cause a cutoff are searched first: the hash move, then captures
+    #(most valuable victim, least valuable attacker), promotions, the killer moves of the ply, then quiet moves by history
+    #any object with orderMoves, stagedMoves, cutoff and newSearch methods can be plugged in as ChessAI.moveOrderer
+    victimValues = (1, 3, 3, 5, 9, 10) #by piece type: p, n, b, r, q, k
+
+    def __init__(self, maxPly=64):
+        self.killers = [[0, 0] for ply in range(maxPly)] #two quiet moves per ply that recently caused cutoffs
+        self.history = [[0] * 64 for piece in range(12)] #[piece][end square] bonus for quiet moves that caused cutoffs
+        self.movePool = ChessEngine.MovePool(maxPly) #the move list of each ply, reused at every node of that ply
+
+    def newSearch(self):
+        for killers in self.killers:
+            killers[0] = killers[1] = 0
+        for scores in self.history: #older cutoffs count for less
+            for sq in range(64):
+                scores[sq] //= 2
+
+    def orderMoves(self, gs, moves, ply, hashMove=0):
+        mailbox = gs.mailbox
+        killer1, killer2 = self.killers[ply]
+        history = self.history
+        values = self.victimValues
+        def score(move):
+            if move == hashMove:
+                return 1000000
+            captured = mailbox[move >> 6 & 63]
+            flag = move >> 12
+            if captured != ChessEngine.empty:
+                return 100000 + values[captured % 6] * 100 - values[mailbox[move & 63] % 6]
+            if flag == ChessEngine.enpassantMove:
+                return 100000 + 100 - 1
+            if flag >= 4: #promotion, best piece first
+                return 95000 + flag
+            if move == killer1:
+                return 90000
+            if move == killer2:
+                return 89000
+            return history[mailbox[move & 63]][move >> 6 & 63]
+        moves.sort(key=score, reverse=True)
+
+    def stagedMoves(self, gs, ply, hashMove=0, capturesOnly=False):
+        #the engine's lazy move generator in the same order, fed with this ply's killers and the history scores
+        history = self.history
+        mailbox = gs.mailbox
+        def quietOrder(move):
+            return history[mailbox[move & 63]][move >> 6 & 63]
+        return gs.stagedMoves(hashMove, tuple(self.killers[ply]), quietOrder, capturesOnly, self.movePool.get(ply))
+
+    def cutoff(self, gs, move, ply, depth):
+        #called with the move that caused a beta cutoff (before it is taken back)
+        if gs.history[-1][2] != ChessEngine.empty or move >> 12 >= 4: #captures and promotions are already searched early
+            return
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        scores = self.history[gs.history[-1][1]]
+        scores[move >> 6 & 63] = min(scores[move >> 6 & 63] + depth * depth, 80000)
+
+moveOrderer = MoveOrderer(maxPly)
+
+def findMoveNegaMaxAlphaBeta(gs, depth, alpha, beta, turnMultiplier, ply):
+    #moves are generated lazily, stage by stage, so a node that returns from the hash table or cuts off on an early
+    #move never generates the rest of its moves
+    global searchNodes, searchCutoffs, firstMoveCutoffs, repetitions
+    searchNodes += 1
+    if searchNodes & 255 == 0 and outOfTime():
+        raise SearchTimeout()
+    if gs.positionCounts[gs.zobristKey] > 1:
+        repetitions += 1
+        return stalemate
+    if gs.insufficientMaterial() or gs.fiftyMoveDraw(): #whatever the moves below would say
+        return stalemate
+    if tablebasePieces and bin(gs.occupied[0] | gs.occupied[1]).count('1') <= tablebasePieces:
+        result = tablebases.probe(gs)
+        if result is not None:
+            return tablebaseScore(result, ply)
     if depth == 0:
-        return turnMultiplier * scoreboard(gs)
+        return quiescenceSearch(gs, alpha, beta, turnMultiplier, ply)
 
-    #implement move ordering for efficience
+    #positions already searched at least this deep can return (or narrow the window) without searching
+    key = gs.zobristKey
+    entry = transpositionTable.probe(key)
+    hashMove = 0
+    if entry is not None:
+        ttDepth, bound, ttScore, hashMove = entry
+        ttScore = scoreFromTable(ttScore, ply)
+        if ttDepth >= depth:
+            if bound == exactBound:
+                return ttScore
+            elif bound == lowerBound and ttScore >= beta:
+                return ttScore
+            elif bound == upperBound and ttScore <= alpha:
+                return ttScore
+    alphaOrig = alpha
+    repetitionsBefore = repetitions
+
+    moves = moveOrderer.stagedMoves(gs, ply, hashMove)
+    inCheck = gs.inCheck
     maxScore = -checkmate
-    for move in validMoves:
+    bestMove = 0
+    searched = 0
+    for move in moves:
         gs.makeMove(move)
-        nextMoves = gs.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth-1, -beta, -alpha, -turnMultiplier)
+        score = -findMoveNegaMaxAlphaBeta(gs, depth-1, -beta, -alpha, -turnMultiplier, ply + 1)
+        searched += 1
         if score > maxScore:
             maxScore = score
-            if depth == max_depth:
-                nextMove = move
-        gs.undoMove()
+            bestMove = move
         if maxScore > alpha:
             alpha = maxScore
         if alpha >= beta:
+            searchCutoffs += 1
+            if searched == 1:
+                firstMoveCutoffs += 1
+            moveOrderer.cutoff(gs, move, ply, depth)
+            gs.undoMove()
             break
+        gs.undoMove()
+    if searched == 0: #checkmate or stalemate
+        return -checkmate + ply if inCheck else stalemate
+    if maxScore == stalemate and repetitions != repetitionsBefore: #maybe only a draw along this path
+        return maxScore
+
+    if maxScore <= alphaOrig:
+        bound = upperBound
+    elif maxScore >= beta:
+        bound = lowerBound
+    else:
+        bound = exactBound
+    transpositionTable.store(key, depth, bound, scoreToTable(maxScore, ply), bestMove)
+    return maxScore
+
+def scoreToTable(score, ply):
+    #the search scores mates from the root, the table from the position: a mate stored at one ply is found at others
+    if score >= mateScore:
+        return score + ply
+    if score <= -mateScore:
+        return score - ply
+    return score
+
+def scoreFromTable(score, ply):
+    if score >= mateScore:
+        return score - ply
+    if score <= -mateScore:
+        return score + ply
+    return score
+
+def quiescenceSearch(gs, alpha, beta, turnMultiplier, ply):
+    #keeps searching captures past the depth limit so the score isn't taken in the middle of an exchange
+    global searchNodes
+    searchNodes += 1
+    if searchNodes & 255 == 0 and outOfTime():
+        raise SearchTimeout()
+    if ply >= maxPly - 1: #too deep to go on
+        return turnMultiplier * gs.evaluate()
+    #only captures and promotions are generated, unless in check where every evasion is searched
+    moves = moveOrderer.stagedMoves(gs, ply, capturesOnly=True)
+    inCheck = gs.inCheck
+    if inCheck: #no standing pat in check, no moves at all is mate
+        maxScore = -checkmate + ply
+    else:
+        #stand pat: the side to move can usually do at least as well as the static score by not capturing
+        maxScore = turnMultiplier * gs.evaluate()
+        if maxScore >= beta:
+            return maxScore
+        if maxScore > alpha:
+            alpha = maxScore
+    for move in moves:
+        #skip underpromotions and the captures that lose material according to the static exchange evaluation
+        if not inCheck and (4 <= move >> 12 <= 6 or gs.staticExchange(move) < 0):
+            continue
+        gs.makeMove(move)
+        score = -quiescenceSearch(gs, -beta, -alpha, -turnMultiplier, ply + 1)
+        gs.undoMove()
+        if score > maxScore:
+            maxScore = score
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
     return maxScore
 
 def scoreboard(gs):
@@ -101,22 +751,4 @@ def scoreboard(gs):
     elif gs.stalemate:
         return stalemate
 
-    score = 0
-    for row in gs.board:
-        for square in row:
-            if square[0] == 'w':
-                score += pieceScore[square[1]]
-            elif square[0] == 'b':
-                score -= pieceScore[square[1]]
-    return score
-
-def scoreMaterial(board):
-    score = 0
-    for row in board:
-        for square in row:
-            if square[0] == 'w':
-                score += pieceScore[square[1]]
-            elif square[0] == 'b':
-                score -= pieceScore[square[1]]
-    
-    return score
\ No newline at end of file
+    return gs.evaluate() #material and piece-square tables, kept up to date by makeMove/undoMove
\ No newline at end of file
@@ -0,0 +1,320 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import re
+import shlex
+import sys
+import time
+from collections import deque
+from multiprocessing import Pool, current_process
+import ChessEngine, ChessAI, ChessUCI
+
+#analyses many positions in one go: positions stream in from EPD, FEN or PGN files, are spread over a pool of UCI engines
+#or processes running the built-in search, and every result is written out as soon as it is known (JSON lines or CSV)
+#only a few positions per worker are read ahead of the workers, so input of any size runs in constant memory, and results
+#are flushed line by line so an interrupted run can be picked up again with --resume
+outputFields = ['id', 'fen', 'bestmove', 'san', 'score', 'mate', 'depth', 'nodes', 'seconds', 'worker']
+defaultDepths = {'uci': 15, 'builtin': 4} #when neither a depth nor a time is given
+readAhead = 2 #positions waiting per worker
+epdOperations = re.compile(r'([A-Za-z]\w*)((?:\s+(?:"[^"]*"|[^\s;"]+))*)\s*(?:;|$)')
+epdOperands = re.compile(r'"([^"]*)"|(\S+)')
+
+def parseEPD(line):
+    #(FEN, operations) of an EPD line, operations maps each opcode to its list of operands
+    #a FEN line works too: two numbers after the en passant square are the move counters. otherwise the hmvc and fmvn
+    #operations give them
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError('EPD needs at least 4 fields: ' + line.strip())
+    rest = fields[4].strip() if len(fields) > 4 else ''
+    counters = rest.split()
+    if len(counters) == 2 and counters[0].isdigit() and counters[1].isdigit():
+        return ' '.join(fields[:4] + counters), {}
+    operations = {}
+    for match in epdOperations.finditer(rest):
+        operations[match.group(1)] = [quoted or word for quoted, word in epdOperands.findall(match.group(2))]
+    halfmove = operations.get('hmvc', ['0'])[0]
+    fullmove = operations.get('fmvn', ['1'])[0]
+    return ' '.join(fields[:4] + [halfmove, fullmove]), operations
+
+def readPositions(path, inputFormat=None, minPly=0):
+    #yields (id, FEN, EPD operations) for every position of the input, '-' reads stdin
+    #EPD and FEN files give one position per line (the id operation or the line number is the id), PGN files give the
+    #position before every move of every game from ply minPly on, with "game:ply" ids
+    if inputFormat is None:
+        inputFormat = 'pgn' if path.lower().endswith('.pgn') else 'epd'
+    lines = sys.stdin if path == '-' else open(path, encoding='utf-8', errors='replace')
+    try:
+        if inputFormat == 'pgn':
+            for gameNumber, game in enumerate(ChessEngine.readPGN(lines), 1):
+                try:
+                    for gs, move in game.replay():
+                        ply = len(gs.history)
+                        if ply >= minPly:
+                            yield str(gameNumber) + ':' + str(ply), gs.toFEN(), {}
+                except ValueError as error: #the rest of a broken game is skipped
+                    print('game ' + str(gameNumber) + ': ' + str(error), file=sys.stderr)
+        else:
+            for lineNumber, line in enumerate(lines, 1):
+                if not line.strip() or line.startswith('#'):
+                    continue
+                try:
+                    fen, operations = parseEPD(line)
+                    ChessEngine.GameState.fromFEN(fen) #an illegal position is reported here instead of failing in a worker
+                except ValueError as error:
+                    print('line ' + str(lineNumber) + ': ' + str(error), file=sys.stderr)
+                    continue
+                yield operations.get('id', [str(lineNumber)])[0], fen, operations
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+def positionLimits(operations, depth, movetime):
+    #EPD acd (depth) and acs (seconds) operations override the run's limits for that position
+    if 'acd' in operations:
+        return int(operations['acd'][0]), None
+    if 'acs' in operations:
+        return None, float(operations['acs'][0])
+    return depth, movetime
+
+def uciToSAN(gs, uci):
+    for move in gs.generateMoves([]):
+        if gs.buildMove(move).getLastMovement() == uci:
+            return gs.toSAN(move)
+    return None
+
+def analysePosition(task):
+    #the built-in search on one position, runs in a pool process
+    positionId, fen, depth, movetime = task
+    start = time.perf_counter()
+    gs = ChessEngine.GameState.fromFEN(fen)
+    validMoves = gs.getValidMoves()
+    record = {'id': positionId, 'fen': fen, 'bestmove': None, 'san': None, 'score': None, 'mate': None, 'depth': 0, 'nodes': 0}
+    if validMoves: #ChessAI.bookPath stays unset here, a book move comes without the score and depth the record is for
+        limits = ChessAI.SearchLimits(moveTime=movetime if movetime is not None else float('inf'), maxDepth=depth)
+        result = ChessAI.findBestMove(gs, validMoves, limits)
+        record.update(bestmove=result.move.getLastMovement(), san=gs.toSAN(result.move), score=result.score, depth=result.depth,
+                        nodes=result.nodes)
+        if abs(result.score) >= ChessAI.mateScore: #a mate is reported in moves like the engines do, negative when mated
+            moves = (ChessAI.checkmate - abs(result.score) + 1) // 2
+            record.update(score=None, mate=moves if result.score > 0 else -moves)
+    elif gs.inCheck:
+        record['mate'] = 0
+    else:
+        record['score'] = 0
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    record['worker'] = current_process().name
+    return record
+
+def engineRecord(positionId, fen, result, seconds, worker):
+    record = {'id': positionId, 'fen': fen, 'bestmove': result.bestMove, 'san': None, 'score': result.score, 'mate': result.mate,
+                'depth': result.depth, 'nodes': result.nodes, 'seconds': round(seconds, 3), 'worker': worker}
+    if result.bestMove is not None:
+        record['san'] = uciToSAN(ChessEngine.GameState.fromFEN(fen), result.bestMove)
+    return record
+
+
+class AnalysisStats():
+    #positions, nodes and busy seconds by worker
+    def __init__(self):
+        self.workers = {}
+        self.start = time.perf_counter()
+
+    def add(self, record):
+        stats = self.workers.setdefault(record['worker'], [0, 0, 0.0])
+        stats[0] += 1
+        stats[1] += record['nodes'] or 0
+        stats[2] += record['seconds']
+
+    def report(self, out=sys.stderr):
+        elapsed = time.perf_counter() - self.start
+        total = sum(stats[0] for stats in self.workers.values())
+        for worker in sorted(self.workers):
+            positions, nodes, seconds = self.workers[worker]
+            print(worker + ': ' + str(positions) + ' positions, ' + str(round(positions / seconds, 2) if seconds > 0 else 0) +
+                    ' positions/s, ' + str(int(nodes / seconds) if seconds > 0 else 0) + ' nodes/s', file=out)
+        print('Total: ' + str(total) + ' positions in ' + str(round(elapsed, 1)) + 's, ' +
+                str(round(total / elapsed, 2) if elapsed > 0 else 0) + ' positions/s', file=out)
+
+
+class ResultWriter():
+    #writes records as JSON lines or CSV rows, each one flushed right away so nothing is lost when the run is stopped
+    def __init__(self, path, outputFormat=None, append=False):
+        if outputFormat is None:
+            outputFormat = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+        self.format = outputFormat
+        exists = path != '-' and append and os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            dropPartialLine(path)
+        self.file = sys.stdout if path == '-' else open(path, 'a' if append else 'w', newline='', encoding='utf-8')
+        if outputFormat == 'csv':
+            self.csv = csv.DictWriter(self.file, outputFields)
+            if not exists:
+                self.csv.writeheader()
+
+    def write(self, record):
+        if self.format == 'csv':
+            self.csv.writerow(record)
+        else:
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+def dropPartialLine(path):
+    #a run stopped while writing can leave half a line at the end of the file, it is cut off before appending
+    with open(path, 'rb+') as output:
+        end = output.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            step = min(4096, position)
+            output.seek(position - step)
+            newline = output.read(step).rfind(b'\n')
+            if newline >= 0:
+                position += newline + 1 - step
+                break
+            position -= step
+        if position != end:
+            output.truncate(position)
+
+def finishedIds(path, outputFormat=None):
+    #ids already in an output file, the positions --resume skips
+    if path == '-' or not os.path.exists(path):
+        return set()
+    if outputFormat is None:
+        outputFormat = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+    done = set()
+    with open(path, newline='', encoding='utf-8') as lines:
+        if outputFormat == 'csv':
+            for row in csv.DictReader(lines):
+                done.add(row['id'])
+        else:
+            for line in lines:
+                try:
+                    done.add(str(json.loads(line)['id']))
+                except (ValueError, KeyError): #a line cut short when the last run was stopped
+                    pass
+    return done
+
+def analyseBuiltin(positions, workers, write):
+    #the built-in search in a process pool. at most readAhead positions per worker are handed out ahead of the results,
+    #and results come back in input order
+    if workers <= 1:
+        for task in positions:
+            write(analysePosition(task))
+        return
+    pool = Pool(workers)
+    pending = deque()
+    try:
+        for task in positions:
+            pending.append(pool.apply_async(analysePosition, (task,)))
+            if len(pending) >= workers * readAhead:
+                write(pending.popleft().get())
+        while pending:
+            write(pending.popleft().get())
+    finally:
+        pool.terminate()
+        pool.join()
+
+async def analyseWithEngines(positions, command, workers, write, options=None, cache=None):
+    #one engine process per worker, fed from a bounded queue so reading the input waits for the engines to catch up
+    queue = asyncio.Queue(workers * readAhead)
+    if isinstance(command, str) and not os.path.isfile(command): #a command line with arguments
+        command = shlex.split(command)
+    engines = [ChessUCI.UCIEngine(ChessUCI.findEngine(command), options, cache) for i in range(workers)]
+    async def work(number, engine):
+        worker = 'engine ' + str(number)
+        await engine.call(engine.isReady) #an engine that can't even be started stops the run
+        while True:
+            task = await queue.get()
+            if task is None:
+                return
+            positionId, fen, depth, movetime = task
+            start = time.perf_counter()
+            try:
+                result = await engine.analyse((), fen, movetime, depth)
+            except ChessUCI.EngineError as error: #the engine is started again for the next position
+                print(positionId + ': ' + str(error), file=sys.stderr)
+                continue
+            write(engineRecord(positionId, fen, result, time.perf_counter() - start, worker))
+    tasks = [asyncio.ensure_future(work(i + 1, engine)) for i, engine in enumerate(engines)]
+    try:
+        for task in positions:
+            put = asyncio.ensure_future(queue.put(task))
+            await asyncio.wait([put] + tasks, return_when=asyncio.FIRST_COMPLETED)
+            for done in tasks: #a worker that stopped with an error would leave the queue full forever
+                if done.done():
+                    put.cancel()
+                    done.result()
+        for i in range(workers):
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        for engine in engines:
+            await engine.stop()
+
+def runAnalysis(inputPath, outputPath, backend='uci', workers=1, depth=None, movetime=None, resume=False, inputFormat=None,
+                outputFormat=None, minPly=0, command=None, cachePath=None):
+    #analyses every position of the input and returns the AnalysisStats
+    if depth is None and movetime is None:
+        depth = defaultDepths[backend]
+    done = finishedIds(outputPath, outputFormat) if resume else set()
+    writer = ResultWriter(outputPath, outputFormat, append=resume)
+    stats = AnalysisStats()
+    def write(record):
+        writer.write(record)
+        stats.add(record)
+    def tasks():
+        for positionId, fen, operations in readPositions(inputPath, inputFormat, minPly):
+            if positionId not in done:
+                yield (positionId, fen) + positionLimits(operations, depth, movetime)
+    try:
+        if backend == 'builtin':
+            analyseBuiltin(tasks(), workers, write)
+        else:
+            cache = ChessUCI.AnalysisCache(path=cachePath) if cachePath else None
+            try:
+                asyncio.run(analyseWithEngines(tasks(), command, workers, write, cache=cache))
+            finally:
+                if cache is not None:
+                    cache.close()
+    finally:
+        writer.close()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyse every position of an EPD, FEN or PGN file with UCI engines or the built-in search')
+    parser.add_argument('input', help="EPD/FEN file (one position per line) or PGN file, '-' for stdin")
+    parser.add_argument('output', help="results file, .csv for CSV and JSON lines otherwise, '-' for stdout")
+    parser.add_argument('--engine', default='uci', choices=['uci', 'builtin'], help='UCI engines or the built-in search')
+    parser.add_argument('--command', help='UCI engine to run (default: stockfish, see ChessUCI.findEngine)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='engine processes or search processes')
+    parser.add_argument('--depth', type=int, help='search depth per position (EPD acd operations override it)')
+    parser.add_argument('--movetime', type=float, help='seconds per position (EPD acs operations override it)')
+    parser.add_argument('--input-format', choices=['epd', 'pgn'], help='default: by file extension')
+    parser.add_argument('--output-format', choices=['jsonl', 'csv'], help='default: by file extension')
+    parser.add_argument('--min-ply', type=int, default=0, help='PGN input: skip the positions before this ply')
+    parser.add_argument('--resume', action='store_true', help='skip positions already in the output file and append to it')
+    parser.add_argument('--cache', help='SQLite file of engine results to reuse across runs')
+    args = parser.parse_args()
+
+    try:
+        stats = runAnalysis(args.input, args.output, args.engine, args.workers, args.depth, args.movetime, args.resume,
+                            args.input_format, args.output_format, args.min_ply, args.command, args.cache)
+    except ChessUCI.EngineError as error:
+        print(error, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print('Stopped, run again with --resume to analyse the rest', file=sys.stderr)
+        return 1
+    stats.report()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
\ No newline at end of file
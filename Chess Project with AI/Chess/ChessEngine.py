@@ -1,10 +1,245 @@
+import random
+import re
+
+#squares are numbered sq = row*8 + col, so bit 0 of a bitboard is a8 and bit 63 is h1 (same orientation as the board list)
+#pieces are indexed 0-11: white p, n, b, r, q, k then black p, n, b, r, q, k. index 12 is an empty square
+pieceNames = ["wp", "wn", "wb", "wr", "wq", "wk", "bp", "bn", "bb", "br", "bq", "bk", "--"]
+pieceIndex = {name: i for i, name in enumerate(pieceNames)}
+pieceTypes = "pnbrqk"
+fenPieces = {char: i for i, char in enumerate("PNBRQKpnbrqk")}
+pawn, knight, bishop, rook, queen, king = range(6)
+empty = 12
+allSquares = (1 << 64) - 1
+exchangeValues = (100, 320, 330, 500, 900, 20000) #centipawns by piece type, used by the static exchange evaluator
+
+knightDirections = ((-1, 2), (-2, 1), (-2, -1), (-1, -2), (1, -2), (2, -1), (2, 1), (1, 2))
+kingDirections = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, 1), (-1, -1), (1, -1), (1, 1))
+rookDirections = ((0, 1), (-1, 0), (0, -1), (1, 0))
+bishopDirections = ((-1, 1), (-1, -1), (1, -1), (1, 1))
+
+def stepAttacks(sq, directions):
+    attacks = 0
+    r, c = divmod(sq, 8)
+    for d in directions:
+        endRow = r + d[0]
+        endCol = c + d[1]
+        if 0 <= endRow < 8 and 0 <= endCol < 8:
+            attacks |= 1 << (endRow * 8 + endCol)
+    return attacks
+
+def slidingAttacks(sq, occupied, directions):
+    #walks each ray until it leaves the board or hits a blocker (the blocker square is included)
+    attacks = 0
+    r, c = divmod(sq, 8)
+    for d in directions:
+        endRow = r + d[0]
+        endCol = c + d[1]
+        while 0 <= endRow < 8 and 0 <= endCol < 8:
+            bit = 1 << (endRow * 8 + endCol)
+            attacks |= bit
+            if occupied & bit:
+                break
+            endRow += d[0]
+            endCol += d[1]
+    return attacks
+
+def relevantOccupancy(sq, directions):
+    #squares whose occupancy can change a slider's attacks (the last square of every ray never blocks anything)
+    mask = 0
+    r, c = divmod(sq, 8)
+    for d in directions:
+        endRow = r + d[0]
+        endCol = c + d[1]
+        while 0 <= endRow + d[0] < 8 and 0 <= endCol + d[1] < 8:
+            mask |= 1 << (endRow * 8 + endCol)
+            endRow += d[0]
+            endCol += d[1]
+    return mask
+
+def slidingTable(sq, mask, directions):
+    #PEXT-style lookup: the masked occupancy itself is the key, so every blocker subset maps straight to its attack set
+    table = {}
+    subset = 0
+    while True:
+        table[subset] = slidingAttacks(sq, subset, directions)
+        subset = (subset - mask) & mask #carry-rippler trick to enumerate every subset of the mask
+        if subset == 0:
+            break
+    return table
+
+knightAttacks = [stepAttacks(sq, knightDirections) for sq in range(64)]
+kingAttacks = [stepAttacks(sq, kingDirections) for sq in range(64)]
+pawnAttacks = [[stepAttacks(sq, ((-1, -1), (-1, 1))) for sq in range(64)], #white pawns capture towards row 0
+               [stepAttacks(sq, ((1, -1), (1, 1))) for sq in range(64)]]
+fileA = 0x0101010101010101
+fileH = fileA << 7
+lightSquares = sum(1 << sq for sq in range(64) if ((sq >> 3) + (sq & 7)) % 2 == 0) #a8 is a light square
+darkSquares = allSquares ^ lightSquares
+rookMasks = [relevantOccupancy(sq, rookDirections) for sq in range(64)]
+bishopMasks = [relevantOccupancy(sq, bishopDirections) for sq in range(64)]
+rookTable = [slidingTable(sq, rookMasks[sq], rookDirections) for sq in range(64)]
+bishopTable = [slidingTable(sq, bishopMasks[sq], bishopDirections) for sq in range(64)]
+
+def rookAttacks(sq, occupied):
+    return rookTable[sq][occupied & rookMasks[sq]]
+
+def bishopAttacks(sq, occupied):
+    return bishopTable[sq][occupied & bishopMasks[sq]]
+
+def queenAttacks(sq, occupied):
+    return rookTable[sq][occupied & rookMasks[sq]] | bishopTable[sq][occupied & bishopMasks[sq]]
+
+def pieceAttacks(pieceType, sq, occupied):
+    #squares a knight, bishop, rook, queen or king on sq attacks, which are also the squares it could reach sq from
+    if pieceType == knight:
+        return knightAttacks[sq]
+    if pieceType == bishop:
+        return bishopAttacks(sq, occupied)
+    if pieceType == rook:
+        return rookAttacks(sq, occupied)
+    if pieceType == queen:
+        return queenAttacks(sq, occupied)
+    return kingAttacks[sq]
+
+#between[a][b] holds the squares strictly between two aligned squares, line[a][b] the whole line through them
+between = [[0] * 64 for sq in range(64)]
+line = [[0] * 64 for sq in range(64)]
+for sq1 in range(64):
+    for sq2 in range(64):
+        if sq1 == sq2:
+            continue
+        bit2 = 1 << sq2
+        if rookAttacks(sq1, 0) & bit2:
+            between[sq1][sq2] = rookAttacks(sq1, bit2) & rookAttacks(sq2, 1 << sq1)
+            line[sq1][sq2] = (rookAttacks(sq1, 0) & rookAttacks(sq2, 0)) | (1 << sq1) | bit2
+        elif bishopAttacks(sq1, 0) & bit2:
+            between[sq1][sq2] = bishopAttacks(sq1, bit2) & bishopAttacks(sq2, 1 << sq1)
+            line[sq1][sq2] = (bishopAttacks(sq1, 0) & bishopAttacks(sq2, 0)) | (1 << sq1) | bit2
+
+def squareOf(bb):
+    return bb.bit_length() - 1
+
+#zobrist keys: a position's key is the xor of the random numbers for every piece on its square, the side to move,
+#the castling rights and the en passant file (only when a pawn can actually capture en passant)
+zobristRandom = random.Random(20220618) #fixed seed so keys are the same in every process and every run
+zobristPieces = [[zobristRandom.getrandbits(64) for sq in range(64)] for piece in range(12)]
+zobristCastle = [zobristRandom.getrandbits(64) for rights in range(16)]
+zobristEnpassant = [zobristRandom.getrandbits(64) for col in range(8)]
+zobristBlackToMove = zobristRandom.getrandbits(64)
+
+#evaluation: material plus piece-square tables, with separate middlegame and endgame scores that are blended by the 
+#game phase (the non-pawn material left on the board). tables are from white's point of view with row 0 = the 8th rank
+middlegameValues = (82, 337, 365, 477, 1025, 0)
+endgameValues = (94, 281, 297, 512, 936, 0)
+phaseValues = (0, 1, 1, 2, 4, 0)
+maxPhase = 24 #all the pieces on the board
+pawnSquareTable = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     10,  10,  20,  30,  30,  20,  10,  10,
+      5,   5,  10,  25,  25,  10,   5,   5,
+      0,   0,   0,  20,  20,   0,   0,   0,
+      5,  -5, -10,   0,   0, -10,  -5,   5,
+      5,  10,  10, -20, -20,  10,  10,   5,
+      0,   0,   0,   0,   0,   0,   0,   0)
+pawnEndgameSquareTable = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+     80,  80,  80,  80,  80,  80,  80,  80,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     30,  30,  30,  30,  30,  30,  30,  30,
+     20,  20,  20,  20,  20,  20,  20,  20,
+     10,  10,  10,  10,  10,  10,  10,  10,
+      0,   0,   0,   0,   0,   0,   0,   0,
+      0,   0,   0,   0,   0,   0,   0,   0)
+knightSquareTable = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50)
+bishopSquareTable = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20)
+rookSquareTable = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0)
+queenSquareTable = (
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20)
+kingSquareTable = (
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20)
+kingEndgameSquareTable = (
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50)
+middlegameTables = (pawnSquareTable, knightSquareTable, bishopSquareTable, rookSquareTable, queenSquareTable, kingSquareTable)
+endgameTables = (pawnEndgameSquareTable, knightSquareTable, bishopSquareTable, rookSquareTable, queenSquareTable, kingEndgameSquareTable)
+#per piece index and square, material included and signed so white is positive. black uses the table mirrored top to bottom
+middlegameScores = [[middlegameValues[p] + middlegameTables[p][sq] for sq in range(64)] for p in range(6)] + \
+                    [[-middlegameValues[p] - middlegameTables[p][sq ^ 56] for sq in range(64)] for p in range(6)]
+endgameScores = [[endgameValues[p] + endgameTables[p][sq] for sq in range(64)] for p in range(6)] + \
+                    [[-endgameValues[p] - endgameTables[p][sq ^ 56] for sq in range(64)] for p in range(6)]
+piecePhases = phaseValues * 2
+
+
+#moves inside the engine are packed ints: bits 0-5 start square, bits 6-11 end square, bits 12-15 a flag
+#flags 4-7 are promotions and flag - 3 is the piece type promoted to (knight, bishop, rook, queen)
+normalMove, doublePush, castleMove, enpassantMove = range(4)
+promotionFlags = (7, 6, 5, 4) #queen first so the GUI's autopromotion picks it
+#kinds of moves to generate: everything, captures and promotions (including en passant), or the remaining quiet moves
+allMoves, captureMoves, quietMoves = range(3)
+
+#castling rights are a 4 bit int, castleMask[sq] clears the rights lost when a piece leaves or lands on sq
+wks, wqs, bks, bqs = 1, 2, 4, 8
+castleMask = [15] * 64
+castleMask[0] = 15 ^ bqs
+castleMask[4] = 15 ^ (bks | bqs)
+castleMask[7] = 15 ^ bks
+castleMask[56] = 15 ^ wqs
+castleMask[60] = 15 ^ (wks | wqs)
+castleMask[63] = 15 ^ wks
+
+
 class GameState():
-    def __init__(self):
-        #the board is an 8x8 2d list, each element of the list has 2 characters:
-        #the first character represents the color of the piece: 'b' or 'w'
-        #the second character represents the type of piece: 'k', 'q', 'r', 'b', 'n', or 'p'
-        #'--' represents an empty space with no piece
-        self.board = [
+    def __init__(self, fen=None):
+        #the start position, or the position of a FEN string (see loadFEN)
+        #the position is stored as bitboards: one 64 bit int per piece, plus the occupancy of each color
+        #self.mailbox mirrors the bitboards square by square so the piece on a square is a single lookup
+        #self.board is only built (and cached) when something like the GUI asks for it
+        startBoard = [
             ["br", "bn", "bb", "bq", "bk", "bb", "bn", "br"],
             ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
             ["--", "--", "--", "--", "--", "--", "--", "--"],
@@ -17,169 +252,479 @@ class GameState():
                                 'b': self.getBishopMoves, 'q': self.getQueenMoves, 'k': self.getKingMoves}
 
         self.whiteToMove = True
-        self.moveLog = []
-        self.whiteKingLocation = (7, 4)
-        self.blackKingLocation = (0, 4)
+        self.history = [] #(move, piece moved, piece captured, castling rights, en passant square) for every move made
+        self.keyLog = [] #zobrist key of the position before every move made, parallel to the history
+        self.attackLog = [] #attack maps of the position before every move made, parallel to the history
+        self.debugHashing = False #if true every move checks the incremental zobrist key against a full recomputation
         self.inCheck = False
         self.pins = []
         self.checks = []
+        self.pinned = 0 #bitboard of our pieces pinned to our king
+        self.checkMask = allSquares #squares a non-king move has to land on (all of them unless in check)
+        self.targetMask = allSquares #squares the kind of move being generated can land on
+        self.moveKind = allMoves
         self.checkmate = False
         self.stalemate = False
-        self.insufficientMaterial = False
-        self.enpassantPossible = () #coordinates for the square where enpassant capture is possible
-        self.enpassantPossibleLog = [self.enpassantPossible]
-        self.currentCastlingRight = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks, 
-                                            self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)]
+        self.epSquare = -1 #square where enpassant capture is possible, -1 if there is none
+        self.castleRights = wks | wqs | bks | bqs
+        self.halfmoveClock = 0 #plies since the last capture or pawn move
+        self.fullmoveNumber = 1 #goes up after every black move
+        self.clockLog = [] #halfmove clock before every move made, parallel to the history
+        self.positionCounts = {} #zobrist key -> how often the position has occurred in the game, including now
+        self.startFEN = None #FEN the game was set up from, None for the start position
+        if fen is None:
+            self.board = startBoard
+        else:
+            self.loadFEN(fen)
 
-    def makeMove(self, move):
-        self.board[move.startRow][move.startCol] = "--"
-        self.board[move.endRow][move.endCol] = move.pieceMoved
-        self.moveLog.append(move) #logs the move
-        self.whiteToMove = not self.whiteToMove #turn indicator
-        #update the king's location if moved
-        if move.pieceMoved == 'wk':
-            self.whiteKingLocation = (move.endRow, move.endCol)
-        elif move.pieceMoved == 'bk':
-            self.blackKingLocation = (move.endRow, move.endCol)
+    @classmethod
+    def fromFEN(cls, fen):
+        return cls(fen)
 
-        #pawn promotion
-        if move.pawnPromotion:
-            promotedPiece = 'q' #input("Promote to q, r, b, n: ") #autopromote for now later implement choice in UI
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + promotedPiece
+    @property
+    def board(self):
+        if self.boardCache is None:
+            names = pieceNames
+            mailbox = self.mailbox
+            self.boardCache = [[names[piece] for piece in mailbox[i:i+8]] for i in range(0, 64, 8)]
+        return self.boardCache
 
-        #en passant
-        if move.enPassant:
-            self.board[move.startRow][move.endCol] = '--' #update board to capture pawn
-        
-        #update enpassantPossible variable
-        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2: #only on 2 square pawn advances
-            self.enpassantPossible = ((move.startRow + move.endRow)//2, move.startCol)
+    @board.setter
+    def board(self, board):
+        #loads an 8x8 list of piece strings into the bitboards
+        self.setMailbox([pieceIndex[piece] for row in board for piece in row])
+
+    def setMailbox(self, mailbox):
+        #loads 64 piece indices into the bitboards. the side to move, castling rights and en passant square have to be
+        #set first, they are part of the zobrist key
+        self.bitboards = [0] * 12
+        self.occupied = [0, 0] #white pieces, black pieces
+        self.mailbox = [empty] * 64
+        self.boardCache = None
+        self.statusCache = None #(position, legal Move objects, GameStatus) of the last position asked about, see gameStatus
+        self.attackCache = [None, None] #attack maps of the current position by color, see attackMap
+        self.zobristKey = 0
+        self.pieceCounts = [0] * 12
+        self.middlegameScore = 0 #white minus black, kept up to date as pieces move
+        self.endgameScore = 0
+        self.phase = 0
+        for sq in range(64):
+            if mailbox[sq] != empty:
+                self.addPiece(mailbox[sq], sq) #also xors the piece into the zobrist key
+        self.whiteKingLocation = divmod(squareOf(self.bitboards[5]), 8)
+        self.blackKingLocation = divmod(squareOf(self.bitboards[11]), 8)
+        self.zobristKey ^= zobristCastle[self.castleRights] ^ self.enpassantKey()
+        if not self.whiteToMove:
+            self.zobristKey ^= zobristBlackToMove
+        self.positionCounts = {self.zobristKey: 1}
+
+    def loadFEN(self, fen):
+        #sets up the position of a FEN string. EPD lines work too: the move counters are optional (0 and 1 when missing)
+        #and whatever follows the en passant square that isn't a counter is ignored. castling rights without the king and
+        #rook on their squares, and an en passant square no pawn could have skipped, are dropped
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError('FEN needs at least 4 fields: ' + fen)
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError('FEN needs 8 ranks: ' + fen)
+        mailbox = []
+        for rank in ranks:
+            squares = len(mailbox)
+            for char in rank:
+                if char in fenPieces:
+                    mailbox.append(fenPieces[char])
+                elif '1' <= char <= '8':
+                    mailbox += [empty] * int(char)
+                else:
+                    raise ValueError('unknown piece ' + char + ' in FEN: ' + fen)
+            if len(mailbox) - squares != 8:
+                raise ValueError('FEN rank ' + rank + ' is not 8 squares: ' + fen)
+        if mailbox.count(king) != 1 or mailbox.count(6 + king) != 1:
+            raise ValueError('FEN needs one king of each color: ' + fen)
+        if pawn in mailbox[:8] + mailbox[56:] or 6 + pawn in mailbox[:8] + mailbox[56:]:
+            raise ValueError('FEN has a pawn on the first or last rank: ' + fen)
+        if fields[1] not in ('w', 'b'):
+            raise ValueError('side to move must be w or b in FEN: ' + fen)
+        self.whiteToMove = fields[1] == 'w'
+        self.castleRights = 0
+        if fields[2] != '-':
+            for char in fields[2]:
+                if char not in 'KQkq':
+                    raise ValueError('unknown castling right ' + char + ' in FEN: ' + fen)
+            homes = ((wks, 'K', 60, 63, king), (wqs, 'Q', 60, 56, king), (bks, 'k', 4, 7, 6 + king), (bqs, 'q', 4, 0, 6 + king))
+            for right, char, kingSq, rookSq, kingPiece in homes:
+                if char in fields[2] and mailbox[kingSq] == kingPiece and mailbox[rookSq] == kingPiece - 2:
+                    self.castleRights |= right
+        self.epSquare = -1
+        if fields[3] != '-':
+            if len(fields[3]) != 2 or fields[3][0] not in Move.filesToCols or fields[3][1] not in Move.ranksToRows:
+                raise ValueError('bad en passant square ' + fields[3] + ' in FEN: ' + fen)
+            epSq = Move.ranksToRows[fields[3][1]] * 8 + Move.filesToCols[fields[3][0]]
+            #the pawn that just moved two squares stands in front of the square, the square behind it is empty
+            pawnSq, fromSq, theirPawn = (epSq + 8, epSq - 8, 6 + pawn) if self.whiteToMove else (epSq - 8, epSq + 8, pawn)
+            if (epSq >> 3) == (2 if self.whiteToMove else 5) and mailbox[pawnSq] == theirPawn and mailbox[epSq] == empty and \
+                    mailbox[fromSq] == empty:
+                self.epSquare = epSq
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0
+        self.fullmoveNumber = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+        self.history = []
+        self.keyLog = []
+        self.attackLog = []
+        self.clockLog = []
+        self.setMailbox(mailbox)
+        them = 1 if self.whiteToMove else 0
+        if self.attackersTo(mailbox.index(them * 6 + king), 1 - them): #their king could be taken
+            raise ValueError('the side not to move is in check in FEN: ' + fen)
+        self.startFEN = self.toFEN()
+
+    def enpassantKey(self):
+        #the en passant file only counts when a pawn of the side to move could capture on it
+        epSq = self.epSquare
+        if epSq >= 0:
+            us = 0 if self.whiteToMove else 1
+            if pawnAttacks[1 - us][epSq] & self.bitboards[us*6 + pawn]:
+                return zobristEnpassant[epSq & 7]
+        return 0
+
+    def computeZobristKey(self):
+        #builds the key from scratch, makeMove and undoMove keep it up to date incrementally
+        key = zobristCastle[self.castleRights] ^ self.enpassantKey()
+        if not self.whiteToMove:
+            key ^= zobristBlackToMove
+        for sq in range(64):
+            if self.mailbox[sq] != empty:
+                key ^= zobristPieces[self.mailbox[sq]][sq]
+        return key
+
+    def verifyZobristKey(self):
+        if self.zobristKey != self.computeZobristKey():
+            raise RuntimeError('incremental zobrist key ' + hex(self.zobristKey) + ' does not match the position (' + hex(self.computeZobristKey()) + ')')
+
+    def toFEN(self, halfmove=None, fullmove=None):
+        #Forsyth-Edwards Notation of the position, with the move counters kept by makeMove unless others are given
+        rows = []
+        for r in range(8):
+            row = ''
+            emptySquares = 0
+            for piece in self.mailbox[r*8:r*8 + 8]:
+                if piece == empty:
+                    emptySquares += 1
+                    continue
+                if emptySquares:
+                    row += str(emptySquares)
+                    emptySquares = 0
+                row += pieceTypes[piece % 6].upper() if piece < 6 else pieceTypes[piece % 6]
+            if emptySquares:
+                row += str(emptySquares)
+            rows.append(row)
+        rights = ''.join(char for char, right in zip('KQkq', (wks, wqs, bks, bqs)) if self.castleRights & right)
+        if self.epSquare >= 0:
+            epSquare = Move.colsToFiles[self.epSquare & 7] + Move.rowsToRanks[self.epSquare >> 3]
         else:
-            self.enpassantPossible = () #enpassant can only happen the next move after a pawn advances 2 squares
-        
-        #update enpassant log
-        self.enpassantPossibleLog.append(self.enpassantPossible)
+            epSquare = '-'
+        if halfmove is None:
+            halfmove = self.halfmoveClock
+        if fullmove is None:
+            fullmove = self.fullmoveNumber
+        return '/'.join(rows) + (' w ' if self.whiteToMove else ' b ') + (rights or '-') + ' ' + epSquare + ' ' + \
+                str(halfmove) + ' ' + str(fullmove)
 
-        #castle move
-        if move.castle:
-            if move.endCol - move.startCol == 2: #kingside castle
-                self.board[move.endRow][move.endCol-1] = self.board[move.endRow][move.endCol+1] #moves the rook
-                self.board[move.endRow][move.endCol+1] = '--' #erase old rook
+    def __getstate__(self):
+        #compact form used to hand positions to other processes (pickle, multiprocessing): the mailbox as 64 bytes
+        #plus what isn't on the board. the move history stays behind, only its position keys come along
+        return (bytes(self.mailbox), self.whiteToMove, self.castleRights, self.epSquare, tuple(self.keyLog), self.halfmoveClock,
+                self.fullmoveNumber)
+
+    def __setstate__(self, state):
+        mailbox, whiteToMove, castleRights, epSquare, keyLog, halfmoveClock, fullmoveNumber = state
+        self.__init__()
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
+        self.whiteToMove = whiteToMove
+        self.castleRights = castleRights
+        self.epSquare = epSquare
+        self.setMailbox(list(mailbox))
+        self.keyLog = list(keyLog)
+        for key in self.keyLog:
+            self.positionCounts[key] = self.positionCounts.get(key, 0) + 1
+
+    @property
+    def moveLog(self):
+        #Move objects are only built when something (the GUI, notation) asks for them
+        return [Move.fromPacked(move, pieceMoved, pieceCaptured) for move, pieceMoved, pieceCaptured, rights, ep in self.history]
+
+    @property
+    def enpassantPossible(self):
+        #coordinates for the square where enpassant capture is possible
+        return divmod(self.epSquare, 8) if self.epSquare >= 0 else ()
+
+    @property
+    def currentCastlingRight(self):
+        rights = self.castleRights
+        return CastleRights(wks=bool(rights & wks), wqs=bool(rights & wqs), bks=bool(rights & bks), bqs=bool(rights & bqs))
+
+    def addPiece(self, piece, sq):
+        bit = 1 << sq
+        self.bitboards[piece] |= bit
+        self.occupied[piece // 6] |= bit
+        self.mailbox[sq] = piece
+        self.boardCache = None
+        self.zobristKey ^= zobristPieces[piece][sq]
+        self.pieceCounts[piece] += 1
+        self.middlegameScore += middlegameScores[piece][sq]
+        self.endgameScore += endgameScores[piece][sq]
+        self.phase += piecePhases[piece]
+
+    def removePiece(self, sq):
+        piece = self.mailbox[sq]
+        bit = 1 << sq
+        self.bitboards[piece] ^= bit
+        self.occupied[piece // 6] ^= bit
+        self.mailbox[sq] = empty
+        self.boardCache = None
+        self.zobristKey ^= zobristPieces[piece][sq]
+        self.pieceCounts[piece] -= 1
+        self.middlegameScore -= middlegameScores[piece][sq]
+        self.endgameScore -= endgameScores[piece][sq]
+        self.phase -= piecePhases[piece]
+        return piece
+
+    def movePiece(self, fromSq, toSq):
+        piece = self.mailbox[fromSq]
+        bits = (1 << fromSq) | (1 << toSq)
+        self.bitboards[piece] ^= bits
+        self.occupied[piece // 6] ^= bits
+        self.mailbox[fromSq] = empty
+        self.mailbox[toSq] = piece
+        self.boardCache = None
+        self.zobristKey ^= zobristPieces[piece][fromSq] ^ zobristPieces[piece][toSq]
+        self.middlegameScore += middlegameScores[piece][toSq] - middlegameScores[piece][fromSq]
+        self.endgameScore += endgameScores[piece][toSq] - endgameScores[piece][fromSq]
+
+    def evaluate(self):
+        #static score in centipawns from white's point of view, tapered from the middlegame to the endgame score
+        phase = min(self.phase, maxPhase) #early promotions can push the phase over the maximum
+        return (self.middlegameScore * phase + self.endgameScore * (maxPhase - phase)) // maxPhase
+
+    def makeMove(self, move):
+        if isinstance(move, Move):
+            move = move.packed
+        startSq = move & 63
+        endSq = move >> 6 & 63
+        flag = move >> 12
+        piece = self.mailbox[startSq]
+        capturedSq = (startSq & 56) | (endSq & 7) if flag == enpassantMove else endSq #en passant captures the pawn beside the moving pawn
+        captured = self.mailbox[capturedSq]
+        self.history.append((move, piece, captured, self.castleRights, self.epSquare)) #logs the move
+        self.keyLog.append(self.zobristKey)
+        self.attackLog.append(self.attackCache)
+        self.clockLog.append(self.halfmoveClock)
+        self.attackCache = [None, None]
+        self.halfmoveClock = 0 if piece == pawn or piece == 6 + pawn or captured != empty else self.halfmoveClock + 1
+        if piece >= 6: #black moved
+            self.fullmoveNumber += 1
+        self.zobristKey ^= self.enpassantKey() ^ zobristCastle[self.castleRights] ^ zobristBlackToMove #take out the old rights and flip the side to move
+        if captured != empty:
+            self.removePiece(capturedSq)
+        self.movePiece(startSq, endSq)
+        self.whiteToMove = not self.whiteToMove #turn indicator
+        #update the king's location if moved
+        if piece == king:
+            self.whiteKingLocation = divmod(endSq, 8)
+        elif piece == 6 + king:
+            self.blackKingLocation = divmod(endSq, 8)
+
+        if flag >= 4: #pawn promotion
+            self.removePiece(endSq)
+            self.addPiece(piece + flag - 3, endSq)
+        elif flag == castleMove:
+            if endSq > startSq: #kingside castle
+                self.movePiece(endSq+1, endSq-1) #moves the rook
             else: #queenside castle
-                self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-2] #moves the rook
-                self.board[move.endRow][move.endCol-2] = '--' #erase old rook
+                self.movePiece(endSq-2, endSq+1) #moves the rook
 
-        #update castling rights whenever it is a rook or king move
-        self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks, 
-                                            self.currentCastlingRight.wqs, self.currentCastlingRight.bqs))
+        #enpassant can only happen the next move after a pawn advances 2 squares
+        self.epSquare = (startSq + endSq) // 2 if flag == doublePush else -1
+        #moving the king or a rook, or capturing a rook, forfeits castling rights
+        self.castleRights &= castleMask[startSq] & castleMask[endSq]
+        self.zobristKey ^= zobristCastle[self.castleRights] ^ self.enpassantKey()
+        self.positionCounts[self.zobristKey] = self.positionCounts.get(self.zobristKey, 0) + 1
+        if self.debugHashing:
+            self.verifyZobristKey()
 
     def undoMove(self):
-        if len(self.moveLog) != 0: #makes sure there is a move to undo
-            move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+        if len(self.history) != 0: #makes sure there is a move to undo
+            move, piece, captured, self.castleRights, self.epSquare = self.history.pop()
+            count = self.positionCounts[self.zobristKey] - 1
+            if count:
+                self.positionCounts[self.zobristKey] = count
+            else:
+                del self.positionCounts[self.zobristKey]
+            startSq = move & 63
+            endSq = move >> 6 & 63
+            flag = move >> 12
+            if flag >= 4: #turn the promoted piece back into a pawn
+                self.removePiece(endSq)
+                self.addPiece(piece, endSq)
+            elif flag == castleMove:
+                if endSq > startSq: #kingside castle
+                    self.movePiece(endSq-1, endSq+1)
+                else: #queenside castle
+                    self.movePiece(endSq+1, endSq-2)
+            self.movePiece(endSq, startSq)
+            if captured != empty:
+                capturedSq = (startSq & 56) | (endSq & 7) if flag == enpassantMove else endSq
+                self.addPiece(captured, capturedSq)
             self.whiteToMove = not self.whiteToMove #switch turns back
             #update the king's position if needed
-            if move.pieceMoved == 'wk':
-                self.whiteKingLocation = (move.startRow, move.startCol)
-            elif move.pieceMoved == 'bk':
-                self.blackKingLocation = (move.startRow, move.startCol)
-            #undo en passant
-            if move.enPassant:
-                self.board[move.endRow][move.endCol] = '--' #removes the pawn that was added in the wrong square
-                self.board[move.startRow][move.endCol] = move.pieceCaptured #puts the pawn back on the correct square it was captured from
-            self.enpassantPossibleLog.pop()
-            self.enpassantPossible = self.enpassantPossibleLog[-1]
-            #undo castling rights
-            self.castleRightsLog.pop() #get rid of the new castle rights from the move we are undoing
-            newRights = self.castleRightsLog[-1]
-            self.currentCastlingRight = CastleRights(newRights.wks, newRights.bks, newRights.wqs, newRights.bqs) #set the current castling rights to the last one in the list
-            #undo castle move
-            if move.castle:
-                if move.endCol - move.startCol == 2: #kingside castle
-                    self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-1]
-                    self.board[move.endRow][move.endCol-1] = '--'
-                else: #queenside castle
-                    self.board[move.endRow][move.endCol-2] = self.board[move.endRow][move.endCol+1]
-                    self.board[move.endRow][move.endCol+1] = '--'
+            if piece == king:
+                self.whiteKingLocation = divmod(startSq, 8)
+            elif piece == 6 + king:
+                self.blackKingLocation = divmod(startSq, 8)
+            self.zobristKey = self.keyLog.pop()
+            self.attackCache = self.attackLog.pop()
+            self.halfmoveClock = self.clockLog.pop()
+            if piece >= 6:
+                self.fullmoveNumber -= 1
+            if self.debugHashing:
+                self.verifyZobristKey()
             self.checkmate = False
             self.stalemate = False
 
-    def updateCastleRights(self, move):
-        #king moves forfeit both castling rights
-        if move.pieceMoved == 'wk':
-            self.currentCastlingRight.wks = False
-            self.currentCastlingRight.wqs = False
-        elif move.pieceMoved == 'bk':
-            self.currentCastlingRight.bks = False
-            self.currentCastlingRight.bqs = False
-        #rook moves forfeit one castling right
-        elif move.pieceMoved == 'wr':
-            if move.startRow == 7:
-                if move.startCol == 0: #queenside white rook
-                    self.currentCastlingRight.wqs = False
-                elif move.startCol == 7: #kingside white rook
-                    self.currentCastlingRight.wks = False
-        elif move.pieceMoved == 'br':
-            if move.startRow == 0:
-                if move.startCol == 0: #queenside black rook
-                    self.currentCastlingRight.bqs = False
-                elif move.startCol == 7: #kingside black rook
-                    self.currentCastlingRight.bks = False
-        #if a rook is captured you cannot castle to that side
-        if move.pieceCaptured == 'wR':
-            if move.endRow == 7:
-                if move.endCol == 0:
-                    self.currentCastlingRight.wqs = False
-                elif move.endCol == 7:
-                    self.currentCastlingRight.wks = False
-        elif move.pieceCaptured == 'bR':
-            if move.endRow == 0:
-                if move.endCol == 0:
-                    self.currentCastlingRight.bqs = False
-                elif move.endCol == 7:
-                    self.currentCastlingRight.bks = False
+    def buildMove(self, move):
+        #turns a packed move into a Move object for the current position
+        flag = move >> 12
+        piece = self.mailbox[move & 63]
+        if flag == enpassantMove:
+            captured = (piece + 6) % 12 #the opposite colored pawn
+        else:
+            captured = self.mailbox[move >> 6 & 63]
+        return Move.fromPacked(move, piece, captured)
 
-    #all moves considering checks
-    def getValidMoves(self):
-        moves = []
-        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
-        if self.whiteToMove:
-            kingRow = self.whiteKingLocation[0]
-            kingCol = self.whiteKingLocation[1]
+    def toSAN(self, move, masks=None, suffix=True):
+        #Standard Algebraic Notation of a legal move in this position, with + or # when it gives check or mate. the file
+        #and/or rank of the moving piece is only added when another piece of the same kind could legally go to the same
+        #square, so only the moves of those rivals are generated. masks are the position's legalityMasks if already known
+        #suffix=False leaves out the + or #, for callers that make the move and know the next position's status anyway
+        if isinstance(move, Move):
+            move = move.packed
+        if masks is None:
+            masks = self.legalityMasks()
+        startSq = move & 63
+        endSq = move >> 6 & 63
+        flag = move >> 12
+        piece = self.mailbox[startSq]
+        pieceType = piece % 6
+        target = Move.colsToFiles[endSq & 7] + Move.rowsToRanks[endSq >> 3]
+        capture = self.mailbox[endSq] != empty or flag == enpassantMove
+        if flag == castleMove:
+            san = 'O-O' if endSq > startSq else 'O-O-O'
+        elif pieceType == pawn:
+            san = Move.colsToFiles[startSq & 7] + 'x' + target if capture else target
+            if flag >= 4:
+                san += '=' + pieceTypes[flag - 3].upper()
         else:
-            kingRow = self.blackKingLocation[0]
-            kingCol = self.blackKingLocation[1]
-        if self.inCheck:
-            if len(self.checks) == 1: #only 1 check block check or move king
-                moves = self.getAllPossibleMoves()
-                #to block a check you must move a piece into one of the squares between the enemy piece and the king
-                check = self.checks[0] #check information
-                checkRow = check[0]
-                checkCol = check[1]
-                pieceChecking = self.board[checkRow][checkCol] #enemy piece causing check
-                validSquares = [] #squares that pieces can move to
-                #if knight is checking, you must capture knight or move king, other pieces can be blocked
-                if pieceChecking[1] == 'n':
-                    validSquares = [(checkRow, checkCol)]
+            rivals = []
+            others = self.bitboards[piece] & pieceAttacks(pieceType, endSq, self.occupied[0] | self.occupied[1]) & ~(1 << startSq)
+            while others:
+                bit = others & -others
+                others ^= bit
+                sq = squareOf(bit)
+                if self.isLegal(sq | endSq << 6, masks):
+                    rivals.append(sq)
+            fromSquare = ''
+            if rivals:
+                if all(sq & 7 != startSq & 7 for sq in rivals): #the file tells them apart
+                    fromSquare = Move.colsToFiles[startSq & 7]
+                elif all(sq >> 3 != startSq >> 3 for sq in rivals): #the rank does
+                    fromSquare = Move.rowsToRanks[startSq >> 3]
                 else:
-                    for i in range(1, 8):
-                        validSquare = (kingRow + check[2] * i, kingCol + check[3] * i) #check[2] and check[3] are check directions
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol: #once you get to piece end checks
-                            break
-                #get rid of any moves that don't block check or move king
-                for i in range(len(moves) -1, -1, -1): #go through backwards when you are removing from a list as iterating
-                    if moves[i].pieceMoved[1] != 'k': #move doesn't move king so it must block or capture
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
-            else: #double check, king has to move
-                self.getKingMoves(kingRow, kingCol, moves)
-        else: #not in check so all moves are fine
-            moves = self.getAllPossibleMoves()
-        
+                    fromSquare = Move.colsToFiles[startSq & 7] + Move.rowsToRanks[startSq >> 3]
+            san = pieceTypes[pieceType].upper() + fromSquare + ('x' if capture else '') + target
+        if not suffix:
+            return san
+        #check or mate, the moves of the next position are only generated when it is check
+        inCheck, pins, checks = self.inCheck, self.pins, self.checks
+        self.makeMove(move)
+        childMasks = self.legalityMasks()
+        if childMasks[1]:
+            san += '+' if self.addLegalMoves([], childMasks) else '#'
+        self.undoMove()
+        self.inCheck, self.pins, self.checks = inCheck, pins, checks
+        return san
+
+    def parseSAN(self, san, masks=None):
+        #the packed legal move a SAN string stands for. takes the usual variants: 0-0 castling, a missing x, e8Q or e8(Q)
+        #promotions and trailing + # ! ?. a promotion without a piece is a queen. raises ValueError if no legal move,
+        #or more than one, fits
+        if masks is None:
+            masks = self.legalityMasks()
+        text = san.rstrip('+#!?')
+        kingSq = masks[0]
+        if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+            endSq = kingSq + 2 if len(text) == 3 else kingSq - 2
+            for move in self.addLegalMoves([], masks, allMoves, kingSq):
+                if move >> 12 == castleMove and move >> 6 & 63 == endSq:
+                    return move
+            raise ValueError('illegal move ' + san + ' in ' + self.toFEN())
+        match = sanPattern.match(text)
+        if match is None:
+            raise ValueError('not a SAN move: ' + san)
+        pieceLetter, fromFile, fromRank, target, promotion = match.groups()
+        endSq = Move.ranksToRows[target[1]] * 8 + Move.filesToCols[target[0]]
+        us = 0 if self.whiteToMove else 1
+        if pieceLetter is not None:
+            pieceType = pieceTypes.index(pieceLetter.lower())
+            sources = self.bitboards[us*6 + pieceType] & pieceAttacks(pieceType, endSq, self.occupied[0] | self.occupied[1])
+        else: #pawns on the file (the target's, or the one given for a capture) one or two rows behind the target
+            pieceType = pawn
+            row = endSq >> 3
+            behind = (row + 1, row + 2) if us == 0 else (row - 1, row - 2)
+            rows = sum(255 << (r * 8) for r in behind if 0 <= r < 8)
+            col = Move.filesToCols[fromFile] if fromFile is not None else endSq & 7
+            sources = self.bitboards[us*6 + pawn] & (fileA << col) & rows
+            fromFile = None
+        if fromFile is not None:
+            sources &= fileA << Move.filesToCols[fromFile]
+        if fromRank is not None:
+            sources &= 255 << (Move.ranksToRows[fromRank] * 8)
+        flag = pieceTypes.index(promotion.lower()) + 3 if promotion is not None else None
+        found = []
+        while sources:
+            bit = sources & -sources
+            sources ^= bit
+            for move in self.addLegalMoves([], masks, allMoves, squareOf(bit)):
+                if move >> 6 & 63 != endSq or (pieceType == king and move >> 12 == castleMove):
+                    continue
+                if move >> 12 >= 4 and move >> 12 != (flag or queen + 3):
+                    continue
+                found.append(move)
+        if len(found) != 1:
+            raise ValueError(('ambiguous move ' if found else 'illegal move ') + san + ' in ' + self.toFEN())
+        return found[0]
+
+    #all moves considering checks
+    def getValidMoves(self):
+        self.gameStatus()
+        return list(self.statusCache[1]) #a copy, callers like the AI shuffle their list
+
+    def gameStatus(self):
+        #check, checkmate, stalemate and draws by rule of the current position. the legal moves are generated once per
+        #position and kept with the status, so the GUI, the notation and the end of game text all share one generation
+        position = (self.zobristKey, len(self.history), self.positionCounts[self.zobristKey], self.halfmoveClock)
+        if self.statusCache is None or self.statusCache[0] != position:
+            validMoves = [self.buildMove(move) for move in self.generateMoves([])]
+            status = GameStatus(self.inCheck, self.checkmate, self.stalemate, self.whiteToMove, self.drawReason())
+            self.statusCache = (position, validMoves, status)
+        status = self.statusCache[2]
+        self.checkmate = status.checkmate
+        self.stalemate = status.stalemate
+        return status
+
+    #all moves considering checks as packed ints, appended to moves (perft passes its reusable per ply lists)
+    def generateMoves(self, moves):
+        self.addLegalMoves(moves, self.legalityMasks())
         if len(moves) == 0:
             if self.inCheck:
                 self.checkmate = True
@@ -188,295 +733,420 @@ class GameState():
         else:
             self.checkmate = False
             self.stalemate = False
+        return moves
 
+    def legalityMasks(self):
+        #what move generation needs to know about checks and pins, worked out once per position
+        #(king square, in check, pinned pieces, check mask, double check)
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
         if self.whiteToMove:
-            self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
+            kingRow = self.whiteKingLocation[0]
+            kingCol = self.whiteKingLocation[1]
         else:
-            self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
+            kingRow = self.blackKingLocation[0]
+            kingCol = self.blackKingLocation[1]
+        kingSq = kingRow*8 + kingCol
+        pinned = 0
+        for pin in self.pins:
+            pinned |= 1 << (pin[0]*8 + pin[1])
+        checkMask = allSquares
+        if len(self.checks) == 1: #only 1 check block check or move king
+            #to block a check you must move a piece into one of the squares between the enemy piece and the king
+            #knights and pawns have no squares in between, so they have to be captured
+            check = self.checks[0] #check information
+            checkSq = check[0]*8 + check[1]
+            checkMask = between[kingSq][checkSq] | (1 << checkSq)
+        return kingSq, self.inCheck, pinned, checkMask, len(self.checks) > 1
+
+    def addLegalMoves(self, moves, masks, kind=allMoves, sq=-1):
+        #appends the legal moves of one kind, only the ones of the piece on sq if it is given (it has to be ours)
+        kingSq, inCheck, pinned, checkMask, doubleCheck = masks
+        self.pinned = pinned
+        self.checkMask = checkMask
+        self.moveKind = kind
+        if kind == captureMoves:
+            self.targetMask = self.occupied[1 if self.whiteToMove else 0]
+        elif kind == quietMoves:
+            self.targetMask = allSquares ^ (self.occupied[0] | self.occupied[1])
+        if doubleCheck: #double check, king has to move
+            if sq < 0 or sq == kingSq:
+                self.getKingMoves(kingSq, moves)
+        elif sq >= 0:
+            self.moveFunctions[pieceTypes[self.mailbox[sq] % 6]](sq, moves)
+            if sq == kingSq and not inCheck and kind != captureMoves:
+                self.getCastleMoves(kingSq, moves)
+        else:
+            self.getAllPossibleMoves(moves)
+            if not inCheck and kind != captureMoves: #castling is only possible when not in check
+                self.getCastleMoves(kingSq, moves)
+        #the masks only apply to this position
+        self.pinned = 0
+        self.checkMask = allSquares
+        self.targetMask = allSquares
+        self.moveKind = allMoves
         return moves
 
-    def squareUnderAttack(self, r, c):
-        self.whiteToMove = not self.whiteToMove #switch to next turn
-        oppMoves = self.getAllPossibleMoves() #find possible moves of opponent
-        self.whiteToMove = not self.whiteToMove #switch turns back
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c: #square is under attack
-                return True
-        return False
+    def isLegal(self, move, masks=None, kind=allMoves):
+        #whether a packed move from somewhere else (the hash table, a killer slot) is legal in this position
+        if masks is None:
+            masks = self.legalityMasks()
+        sq = move & 63
+        piece = self.mailbox[sq]
+        if piece == empty or piece // 6 != (0 if self.whiteToMove else 1):
+            return False
+        return move in self.addLegalMoves([], masks, kind, sq)
+
+    def captureOrder(self, move):
+        #sort key for captures: most valuable victim first, then least valuable attacker. promotions add the new piece
+        flag = move >> 12
+        captured = self.mailbox[move >> 6 & 63]
+        value = exchangeValues[captured % 6] if captured != empty or flag == enpassantMove else 0 #empty % 6 is a pawn
+        if flag >= 4:
+            value += exchangeValues[flag - 3]
+        return value * 8 - self.mailbox[move & 63] % 6
+
+    def stagedMoves(self, hashMove=0, killers=(), quietOrder=None, capturesOnly=False, moves=None):
+        #legal moves for the search, one stage at a time: the hash move, captures and promotions, the killer moves, then
+        #the quiet moves sorted by quietOrder. a stage is only generated once the search asks for its first move, so a 
+        #cutoff on an early move never pays for the rest. capturesOnly (quiescence search) stops after the captures 
+        #unless the king is in check. checks and pins are worked out right away, so self.inCheck is valid on return
+        #moves is an empty list the stages are generated into (the search passes its MovePool list for the ply)
+        masks = self.legalityMasks()
+        return self.pickMoves(masks, hashMove, killers, quietOrder, capturesOnly and not masks[1], [] if moves is None else moves)
+
+    def pickMoves(self, masks, hashMove, killers, quietOrder, capturesOnly, moves):
+        if hashMove and self.isLegal(hashMove, masks):
+            yield hashMove
+        captures = self.addLegalMoves(moves, masks, captureMoves)
+        captures.sort(key=self.captureOrder, reverse=True)
+        for move in captures:
+            if move != hashMove:
+                yield move
+        if capturesOnly:
+            return
+        for killer in killers:
+            if killer and killer != hashMove and self.isLegal(killer, masks, quietMoves):
+                yield killer
+        del moves[:] #the captures are all handed out, the quiet moves reuse the list
+        quiets = self.addLegalMoves(moves, masks, quietMoves)
+        if quietOrder is not None:
+            quiets.sort(key=quietOrder, reverse=True)
+        for move in quiets:
+            if move != hashMove and move not in killers:
+                yield move
+
+    def attackersTo(self, sq, color, occupied=None):
+        #bitboard of the pieces of one color (0 white, 1 black) that attack a square
+        if occupied is None:
+            occupied = self.occupied[0] | self.occupied[1]
+        bitboards = self.bitboards
+        e = color * 6
+        return (pawnAttacks[1 - color][sq] & bitboards[e + pawn]) | \
+                (knightAttacks[sq] & bitboards[e + knight]) | \
+                (kingAttacks[sq] & bitboards[e + king]) | \
+                (rookAttacks(sq, occupied) & (bitboards[e + rook] | bitboards[e + queen])) | \
+                (bishopAttacks(sq, occupied) & (bitboards[e + bishop] | bitboards[e + queen]))
+
+    def attackMap(self, color):
+        #(squares attacked by one color, squares it attacks at least twice) as bitboards. built at most once per position
+        #and kept on the attack log, so undoMove gets the previous position's maps back without recomputing them
+        #the other side's king is left out of the occupancy: a king stepping back along a checking line is still in check
+        attacks = self.attackCache[color]
+        if attacks is None:
+            bitboards = self.bitboards
+            e = color * 6
+            occupied = (self.occupied[0] | self.occupied[1]) ^ bitboards[6 - e + king]
+            pawns = bitboards[e + pawn]
+            if color == 0:
+                left = pawns >> 9 & ~fileH
+                right = pawns >> 7 & ~fileA
+            else:
+                left = pawns << 7 & ~fileH & allSquares
+                right = pawns << 9 & ~fileA & allSquares
+            attacked = left | right
+            twice = left & right
+            for pieces, table in ((bitboards[e + knight], knightAttacks), (bitboards[e + king], kingAttacks)):
+                while pieces:
+                    bit = pieces & -pieces
+                    pieces ^= bit
+                    targets = table[squareOf(bit)]
+                    twice |= attacked & targets
+                    attacked |= targets
+            for pieces, attackFunction in ((bitboards[e + bishop] | bitboards[e + queen], bishopAttacks),
+                                            (bitboards[e + rook] | bitboards[e + queen], rookAttacks)):
+                while pieces:
+                    bit = pieces & -pieces
+                    pieces ^= bit
+                    targets = attackFunction(squareOf(bit), occupied)
+                    twice |= attacked & targets
+                    attacked |= targets
+            attacks = self.attackCache[color] = (attacked, twice)
+        return attacks
+
+    def staticExchange(self, move):
+        #static exchange evaluation: the material (in centipawns, for the side making the move) that the move wins if both 
+        #sides then keep recapturing on the end square with their least valuable attacker, each stopping when that is better
+        startSq = move & 63
+        endSq = move >> 6 & 63
+        flag = move >> 12
+        bitboards = self.bitboards
+        occupied = (self.occupied[0] | self.occupied[1]) ^ (1 << startSq)
+        piece = self.mailbox[startSq]
+        onSquare = exchangeValues[piece % 6] #value of the piece that can be captured next
+        if flag == enpassantMove:
+            gain = [exchangeValues[pawn]]
+            occupied ^= 1 << ((startSq & 56) | (endSq & 7))
+        else:
+            captured = self.mailbox[endSq]
+            gain = [exchangeValues[captured % 6] if captured != empty else 0]
+        if flag >= 4: #promotions also win the difference between the new piece and the pawn
+            gain[0] += exchangeValues[flag - 3] - exchangeValues[pawn]
+            onSquare = exchangeValues[flag - 3]
+        side = piece // 6
+        e = 6 - side*6
+        #nothing can recapture if the opponent does not attack the square and no slider of theirs waits behind the moving piece
+        if flag != enpassantMove and not self.attackMap(1 - side)[0] >> endSq & 1 and \
+                not line[startSq][endSq] & (bitboards[e + bishop] | bitboards[e + rook] | bitboards[e + queen]):
+            return gain[0]
+        while True:
+            side ^= 1
+            #recomputed every time so sliders behind a piece that just captured join in (x-rays)
+            attackers = self.attackersTo(endSq, side, occupied) & occupied
+            if not attackers:
+                break
+            for type in range(6):
+                candidates = attackers & bitboards[side*6 + type]
+                if candidates:
+                    break
+            gain.append(onSquare - gain[-1]) #material for this side if the exchange stops after its capture
+            onSquare = exchangeValues[type]
+            occupied ^= candidates & -candidates
+        #each side only captures if it does better than stopping
+        for i in range(len(gain) - 1, 0, -1):
+            gain[i-1] = min(gain[i-1], -gain[i])
+        return gain[0]
 
     #all moves without considering checks
-    def getAllPossibleMoves(self):
-        moves = []
-        for r in range(len(self.board)): #number of rows
-            for c in range(len(self.board[r])): #number of cols per given row
-                turn = self.board[r][c][0]
-                if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
-                    piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r, c, moves) #calls the appropriate function based on piece type
+    def getAllPossibleMoves(self, moves=None):
+        if moves is None:
+            moves = []
+        first = 0 if self.whiteToMove else 6
+        for piece in range(first, first + 6):
+            pieces = self.bitboards[piece]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                self.moveFunctions[pieceTypes[piece - first]](squareOf(bit), moves) #calls the appropriate function based on piece type
         return moves
 
-    def getPawnMoves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) -1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
+    def addMoves(self, sq, targets, moves):
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            moves.append(sq | squareOf(bit) << 6)
 
+    def pinAllowed(self, sq):
+        #a pinned piece may only move along the line between its king and the pinning piece
+        if self.pinned >> sq & 1:
+            kingSq = squareOf(self.bitboards[king if self.whiteToMove else 6 + king])
+            return self.checkMask & line[kingSq][sq]
+        return self.checkMask
+
+    def getPawnMoves(self, sq, moves):
+        allowed = self.pinAllowed(sq)
         if self.whiteToMove:
-            moveAmount = -1
+            forward = -8
             startRow = 6
             backRow = 0
-            enemyColor = 'b'
+            us = 0
         else:
-            moveAmount = 1
+            forward = 8
             startRow = 1
             backRow = 7
-            enemyColor = 'w'
-        pawnPromotion = False
-
-        if self.board[r+moveAmount][c] == "--": #1 square forward
-            if not piecePinned or pinDirection == (moveAmount, 0):
-                if r+moveAmount == backRow: #if piece gets to the back rank, then it is a pawn promotion
-                    pawnPromotion = True
-                moves.append(Move((r, c), (r+moveAmount, c), self.board, pawnPromotion=pawnPromotion))
-                if r == startRow and self.board[r+2*moveAmount][c] == "--": #2 squares forward
-                    moves.append(Move((r, c), (r+2*moveAmount, c), self.board))
-        #captures
-        if c-1 >= 0: #capture left
-            if not piecePinned or pinDirection == (moveAmount, -1):
-                if self.board[r+moveAmount][c-1][0] == enemyColor: #enemy piece to capture
-                    if r + moveAmount == backRow:
-                        pawnPromotion = True
-                    moves.append(Move((r, c), (r+moveAmount, c-1), self.board, pawnPromotion=pawnPromotion))
-                if (r+moveAmount, c-1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r+moveAmount, c-1), self.board, enPassant=True))
-        if c+1 <= 7: #capture right
-            if not piecePinned or pinDirection == (moveAmount, 1):
-                if self.board[r+moveAmount][c+1][0] == enemyColor: #enemy piece to capture
-                    if r + moveAmount == backRow:
-                        pawnPromotion = True
-                    moves.append(Move((r, c), (r+moveAmount, c+1), self.board, pawnPromotion=pawnPromotion))
-                if (r+moveAmount, c+1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r+moveAmount, c+1), self.board, enPassant=True))
-
-    def getRookMoves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) -1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                if self.board[r][c][1] != 'q': #can't remove queen from pin on rook moves, only remove it on bishop moves
-                    self.pins.remove(self.pins[i])
-                break
-        directions = ((0, 1), (-1, 0), (0, -1), (1, 0)) #right, up, left, down
-        enemyColor = 'b' if self.whiteToMove else 'w'
-        for d in directions:
-            for i in range(1,8):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8: #on board
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--": #empty is valid move
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemyColor: #enemy piece valid
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                            break
-                        else: #friendly piece invalid
-                            break
-                else: # off board
-                    break       
-
-    def getKnightMoves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) -1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        knightMoves = ((-1, 2), (-2, 1), (-2, -1), (-1, -2), (1, -2), (2, -1), (2, 1), (1, 2)) #8 moves (order is 0 to 2pi unit circle)
-        allyColor = 'w' if self.whiteToMove else 'b'
-        for m in knightMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8: #on board
-                if not piecePinned:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != allyColor: #not ally piece (empty or enemy)
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-
-    def getBishopMoves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) -1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        directions = ((-1, 1), (-1, -1), (1, -1), (1, 1)) #NE, NW, SW, SE
-        enemyColor = 'b' if self.whiteToMove else 'w'
-        for d in directions:
-            for i in range(1,8):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8: #on board
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--": #empty is valid move
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemyColor: #enemy piece valid
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                            break
-                        else: #friendly piece invalid
-                            break
-                else: # off board
-                    break
+            us = 1
+        occupied = self.occupied[0] | self.occupied[1]
+        targets = pawnAttacks[us][sq] & self.occupied[1 - us] & allowed #captures
+        endSq = sq + forward
+        if not occupied >> endSq & 1: #1 square forward
+            if allowed >> endSq & 1:
+                targets |= 1 << endSq
+            if sq >> 3 == startRow and not occupied >> (endSq + forward) & 1 and (allowed & self.targetMask) >> (endSq + forward) & 1: #2 squares forward
+                moves.append(sq | (endSq + forward) << 6 | doublePush << 12)
+        if endSq >> 3 == backRow: #if piece gets to the back rank, then it is a pawn promotion
+            if self.moveKind == quietMoves: #promotions are generated with the captures
+                targets = 0
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                for flag in promotionFlags:
+                    moves.append(sq | squareOf(bit) << 6 | flag << 12)
+        else:
+            self.addMoves(sq, targets & self.targetMask, moves)
+        epSq = self.epSquare
+        if epSq >= 0 and self.moveKind != quietMoves and pawnAttacks[us][sq] >> epSq & 1 and self.enpassantLegal(sq, epSq):
+            moves.append(sq | epSq << 6 | enpassantMove << 12)
+
+    def enpassantLegal(self, sq, epSq):
+        #en passant removes two pawns from the same rank at once, so it is checked by playing it out on the occupancy
+        us = 0 if self.whiteToMove else 1
+        e = 6 - us*6
+        bitboards = self.bitboards
+        capturedSq = (sq & 56) | (epSq & 7)
+        kingSq = squareOf(bitboards[us*6 + king])
+        occupied = ((self.occupied[0] | self.occupied[1]) ^ (1 << sq) ^ (1 << capturedSq)) | (1 << epSq)
+        return not ((rookAttacks(kingSq, occupied) & (bitboards[e + rook] | bitboards[e + queen])) or
+                    (bishopAttacks(kingSq, occupied) & (bitboards[e + bishop] | bitboards[e + queen])) or
+                    (knightAttacks[kingSq] & bitboards[e + knight]) or
+                    (pawnAttacks[us][kingSq] & bitboards[e + pawn] & ~(1 << capturedSq)))
+
+    def getRookMoves(self, sq, moves):
+        own = self.occupied[0 if self.whiteToMove else 1]
+        targets = rookAttacks(sq, self.occupied[0] | self.occupied[1]) & ~own & self.pinAllowed(sq) & self.targetMask
+        self.addMoves(sq, targets, moves)
+
+    def getKnightMoves(self, sq, moves):
+        if self.pinned >> sq & 1: #a pinned knight can never move
+            return
+        own = self.occupied[0 if self.whiteToMove else 1]
+        self.addMoves(sq, knightAttacks[sq] & ~own & self.checkMask & self.targetMask, moves)
+
+    def getBishopMoves(self, sq, moves):
+        own = self.occupied[0 if self.whiteToMove else 1]
+        targets = bishopAttacks(sq, self.occupied[0] | self.occupied[1]) & ~own & self.pinAllowed(sq) & self.targetMask
+        self.addMoves(sq, targets, moves)
+
+    def getQueenMoves(self, sq, moves):
+        self.getRookMoves(sq, moves)
+        self.getBishopMoves(sq, moves)
+
+    def getKingMoves(self, sq, moves):
+        us = 0 if self.whiteToMove else 1
+        targets = kingAttacks[sq] & ~self.occupied[us] & self.targetMask
+        if targets: #the king can go to any square the enemy does not attack
+            self.addMoves(sq, targets & ~self.attackMap(1 - us)[0], moves)
+
+    def getCastleMoves(self, sq, moves):
+        if self.castleRights & (wks if self.whiteToMove else bks):
+            self.getKingsideCastleMoves(sq, moves)
+        if self.castleRights & (wqs if self.whiteToMove else bqs):
+            self.getQueensideCastleMoves(sq, moves)
+
+    def getKingsideCastleMoves(self, sq, moves):
+        #the two squares next to the king have to be empty and not attacked
+        path = 3 << (sq+1)
+        if not (self.occupied[0] | self.occupied[1]) & path and not self.attackMap(1 if self.whiteToMove else 0)[0] & path:
+            moves.append(sq | (sq+2) << 6 | castleMove << 12)
 
-    def getQueenMoves(self, r, c, moves):
-        self.getRookMoves(r, c, moves)
-        self.getBishopMoves(r, c, moves)
-
-    def getKingMoves(self, r, c, moves):
-        kingMoves = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, 1), (-1, -1), (1, -1), (1, 1)) #up, left, down, right, NE, NW, SW, SE
-        allyColor = 'w' if self.whiteToMove else 'b'
-        for i in range(8):
-            endRow = r + kingMoves[i][0]
-            endCol = c + kingMoves[i][1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8: #on board
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor: #not ally piece
-                    #place king on end square and check for checks
-                    if allyColor == 'w':
-                        self.whiteKingLocation = (endRow, endCol)
-                    else:
-                        self.blackKingLocation = (endRow, endCol)
-                    inCheck, pins, checks = self.checkForPinsAndChecks()
-                    if not inCheck:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    #place king back in original location
-                    if allyColor == 'w':
-                        self.whiteKingLocation = (r, c)
-                    else:
-                        self.blackKingLocation = (r, c)
-
-    def getCastleMoves(self, r, c, moves):
-        inCheck = self.squareUnderAttack(r, c)
-        if inCheck:
-            return #can't castle while we are in check
-        if (self.whiteToMove and self.currentCastlingRight.wks) or (not self.whiteToMove and self.currentCastlingRight.bks):
-            self.getKingsideCastleMoves(r, c, moves)
-        if (self.whiteToMove and self.currentCastlingRight.wqs) or (not self.whiteToMove and self.currentCastlingRight.bqs):
-            self.getQueensideCastleMoves(r, c, moves)
-
-    def getKingsideCastleMoves(self, r, c, moves):
-        if self.board[r][c+1] == '--' and self.board[r][c+2] == '--':
-            if not self.squareUnderAttack(r, c+1) and not self.squareUnderAttack(r, c+2):
-                moves.append(Move((r, c), (r, c+2), self.board, castle=True))
-
-    def getQueensideCastleMoves(self, r, c, moves):
-        if self.board[r][c-1] == '--' and self.board[r][c-2] == '--' and self.board[r][c-3] == '--':
-            if not self.squareUnderAttack(r, c-1) and not self.squareUnderAttack(r, c-2):
-                moves.append(Move((r, c), (r, c-2), self.board, castle=True))
+    def getQueensideCastleMoves(self, sq, moves):
+        #the three squares next to the king have to be empty, only the two the king crosses have to be safe
+        if not (self.occupied[0] | self.occupied[1]) & (7 << (sq-3)) and not self.attackMap(1 if self.whiteToMove else 0)[0] & (3 << (sq-2)):
+            moves.append(sq | (sq-2) << 6 | castleMove << 12)
 
     def checkForPinsAndChecks(self):
         pins = [] #squares where the allied pinned piece is and direction pinned from
         checks = [] #squares where enemy is applying a check
-        inCheck = False
         if self.whiteToMove:
-            enemyColor = 'b'
-            allyColor = 'w'
+            us = 0
             startRow = self.whiteKingLocation[0]
             startCol = self.whiteKingLocation[1]
         else:
-            enemyColor = 'w'
-            allyColor = 'b'
+            us = 1
             startRow = self.blackKingLocation[0]
             startCol = self.blackKingLocation[1]
-        #check outward from king for pins and checks, keep track of pins
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, 1), (-1, -1), (1, -1), (1, 1)) #up, left, down, right, NE, NW, SW, SE
-        for j in range(len(directions)):
-            d = directions[j]
-            possiblePin = () #reset possible pins
-            for i in range(1, 8):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor and endPiece[1] != 'k':
-                        if possiblePin == (): #1st allied piece could be pinned
-                            possiblePin = (endRow, endCol, d[0], d[1])
-                        else: #2nd allied piece, so no pin or check possible in this direction
-                            break
-                    elif endPiece[0] == enemyColor:
-                        type = endPiece[1]
-                        #5 possibilites:
-                        #1. orthogonally away from king and piece is rook
-                        #2. diagonally away from king and piece is bishop
-                        #3. 1 square away diagonally from king and piece is a pawn
-                        #4. any direction and piece is queen
-                        #5. any direction 1 square away and piece is a king
-                        if (0 <= j <= 3 and type == 'r') or \
-                                (4 <= j <= 7 and type == 'b') or \
-                                (i == 1 and type == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor == 'b' and 4 <= j <= 5))) or \
-                                (type == 'q') or (i == 1 and type == 'k'):
-                            if possiblePin == (): #no piece blocking, so check
-                                inCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
-                            else: #piece is blocking, so pin
-                                pins.append(possiblePin)
-                                break
-                        else: #enemy piece not applying check
-                            break
-                else: #off board
-                    break
-        #check for knight checks
-        knightMoves = ((-1, 2), (-2, 1), (-2, -1), (-1, -2), (1, -2), (2, -1), (2, 1), (1, 2)) #8 moves (order is 0 to 2pi unit circle)
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == 'n': #enemy knight atacking king
-                    inCheck = True
-                    checks.append((endRow, endCol, m[0], m[1]))
+        kingSq = startRow*8 + startCol
+        e = 6 - us*6
+        bitboards = self.bitboards
+        enemyPieces = self.occupied[1 - us]
+        attacks = self.attackCache[1 - us]
+        if attacks is not None: #a lookup when the attack map is already built, otherwise only the king square is checked
+            inCheck = bool(attacks[0] >> kingSq & 1)
+        else:
+            inCheck = self.attackersTo(kingSq, 1 - us) != 0
+        occupied = (self.occupied[0] | self.occupied[1]) & ~bitboards[us*6 + king] #our king never blocks an attack on itself
+        #look at the enemy sliders with only enemy pieces as blockers: with nothing of ours in between
+        #the slider gives check, with exactly one of our pieces in between that piece is pinned
+        snipers = (rookAttacks(kingSq, enemyPieces) & (bitboards[e + rook] | bitboards[e + queen])) | \
+                    (bishopAttacks(kingSq, enemyPieces) & (bitboards[e + bishop] | bitboards[e + queen]))
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            endRow, endCol = divmod(squareOf(bit), 8)
+            d = ((endRow > startRow) - (endRow < startRow), (endCol > startCol) - (endCol < startCol))
+            blockers = between[kingSq][squareOf(bit)] & occupied
+            if blockers == 0: #no piece blocking, so check
+                checks.append((endRow, endCol, d[0], d[1]))
+            elif blockers & (blockers - 1) == 0: #exactly one of our pieces is blocking, so pin
+                pinRow, pinCol = divmod(squareOf(blockers), 8)
+                pins.append((pinRow, pinCol, d[0], d[1]))
+        #check for pawn and knight checks, only needed if the attack map says the king is attacked at all
+        attackers = ((pawnAttacks[us][kingSq] & bitboards[e + pawn]) | (knightAttacks[kingSq] & bitboards[e + knight])) if inCheck else 0
+        while attackers:
+            bit = attackers & -attackers
+            attackers ^= bit
+            endRow, endCol = divmod(squareOf(bit), 8)
+            checks.append((endRow, endCol, endRow - startRow, endCol - startCol))
         return inCheck, pins, checks
 
-    def opponentCheckOrMate(self):
-        inCheck = False
-        inMate = False
-        oppMoves = self.getValidMoves() #checks all of opponent's next possible moves
-        self.whiteToMove = not self.whiteToMove #switches back to your turn
-        validMoves = self.getValidMoves() #checks all of your next possible moves
-        for move in validMoves:
-            endPiece = move.pieceCaptured[1]
-            if endPiece == 'k': #can the king be taken?
-                inCheck = True
-                break
-        self.whiteToMove = not self.whiteToMove #switch turns back
-        if inCheck and not oppMoves:
-            inMate = True
-            inCheck = False
-        return inCheck, inMate
-
     def insufficientMaterial(self):
-        board = self.board
-        print(board)
-        '''
-        pieces = 0
-        for piece in self.board:
-            if piece != "--":
-                pieces += 1
-        if self.pieceCaptured != "--":
-        if len(pieces) <= 4:
-        '''
+        #neither side can ever mate: bare kings, a single knight or bishop, or only bishops that all stand on squares of
+        #one color. positions where mate is possible but can't be forced (like two knights) play on
+        counts = self.pieceCounts
+        if counts[pawn] or counts[rook] or counts[queen] or counts[6 + pawn] or counts[6 + rook] or counts[6 + queen]:
+            return False
+        if counts[knight] + counts[bishop] + counts[6 + knight] + counts[6 + bishop] <= 1:
+            return True
+        if counts[knight] or counts[6 + knight]:
+            return False
+        bishops = self.bitboards[bishop] | self.bitboards[6 + bishop]
+        return not bishops & lightSquares or not bishops & darkSquares
+
+    def isDraw(self):
+        #draw by rule (fifty moves, any repetition, insufficient material), cheap enough for every search node. the search
+        #scores the first repetition as a draw: if repeating was good once it is good again
+        return self.positionCounts[self.zobristKey] > 1 or self.insufficientMaterial() or self.fiftyMoveDraw()
+
+    def fiftyMoveDraw(self):
+        #a hundred plies without a capture or pawn move, unless the last of them mated: checkmate comes first. the moves
+        #are only generated once the clock gets there
+        return self.halfmoveClock >= 100 and len(self.generateMoves([])) > 0
+
+    def drawReason(self):
+        #why the game is drawn by rule, '' if it isn't. stalemate comes from the move generation
+        if self.positionCounts[self.zobristKey] >= 3:
+            return 'threefold repetition'
+        if self.fiftyMoveDraw():
+            return 'fifty-move rule'
+        if self.insufficientMaterial():
+            return 'insufficient material'
+        return ''
+
+
+class MovePool():
+    #one reusable move list per search ply, so the search does not allocate a new list at every node
+    def __init__(self, maxPly=64):
+        self.buffers = [[] for ply in range(maxPly)]
+
+    def get(self, ply):
+        moves = self.buffers[ply]
+        del moves[:]
+        return moves
+
+
+class GameStatus():
+    def __init__(self, inCheck, checkmate, stalemate, whiteToMove, drawReason=''):
+        self.inCheck = inCheck
+        self.checkmate = checkmate
+        self.stalemate = stalemate
+        self.draw = stalemate or (bool(drawReason) and not checkmate) #mate on the hundredth ply still wins
+        self.gameOver = checkmate or self.draw
+        self.reason = 'checkmate' if checkmate else 'stalemate' if stalemate else drawReason
+        #PGN result tag: 1-0, 0-1, 1/2-1/2, or * while the game goes on
+        if checkmate:
+            self.result = '0-1' if whiteToMove else '1-0'
+        elif self.draw:
+            self.result = '1/2-1/2'
+        else:
+            self.result = '*'
 
 
 class CastleRights():
@@ -496,15 +1166,20 @@ class Move():
                     "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, enPassant=False, pawnPromotion=False, castle=False):
+    def __init__(self, startSq, endSq, board, enPassant=False, pawnPromotion=False, castle=False, promotion='q'):
         self.startRow = startSq[0]
         self.startCol = startSq[1]
         self.endRow = endSq[0]
         self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
+        if board is not None:
+            self.pieceMoved = board[self.startRow][self.startCol]
+            self.pieceCaptured = board[self.endRow][self.endCol]
+        else: #built from a packed move, fromPacked fills in the pieces
+            self.pieceMoved = '--'
+            self.pieceCaptured = '--'
         #pawn promotion
         self.pawnPromotion = pawnPromotion
+        self.promotion = promotion #piece type the pawn promotes to
         #en passant
         self.enPassant = enPassant
         if enPassant:
@@ -512,9 +1187,38 @@ class Move():
         #castle move
         self.castle = castle
 
+        #packed int form of the move used by the engine
+        startIndex = self.startRow*8 + self.startCol
+        endIndex = self.endRow*8 + self.endCol
+        if pawnPromotion:
+            flag = pieceTypes.index(promotion) + 3
+        elif castle:
+            flag = castleMove
+        elif enPassant:
+            flag = enpassantMove
+        elif self.pieceMoved[1] == 'p' and abs(self.startRow - self.endRow) == 2:
+            flag = doublePush
+        else:
+            flag = normalMove
+        self.packed = startIndex | endIndex << 6 | flag << 12
+
+        #underpromotions get their own id, queen promotions share the plain id so a clicked move matches them
         self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        if pawnPromotion and promotion != 'q':
+            self.moveID += 10000 * pieceTypes.index(promotion)
         #print(self.moveID) #prints possible moveID's
 
+    @classmethod
+    def fromPacked(cls, packed, pieceMoved, pieceCaptured):
+        #builds a Move from a packed move and the piece indexes it moved and captured
+        flag = packed >> 12
+        move = cls(divmod(packed & 63, 8), divmod(packed >> 6 & 63, 8), None, enPassant=flag == enpassantMove, 
+                    pawnPromotion=flag >= 4, castle=flag == castleMove, promotion=pieceTypes[flag - 3] if flag >= 4 else 'q')
+        move.pieceMoved = pieceNames[pieceMoved]
+        move.pieceCaptured = pieceNames[pieceCaptured]
+        move.packed = packed
+        return move
+
     def __eq__(self, other):
         if isinstance(other, Move):
             return self.moveID == other.moveID
@@ -537,11 +1241,11 @@ class Move():
                 else: #pawn movement
                     s1 = ''
                 if self.endRow == 0 or self.endRow == 7: #pawn promotion
-                    s4 = '=Q' #add other promotions
+                    s4 = '=' + self.promotion.upper()
             else: #other pieces
                 s1 = self.pieceMoved[1].capitalize()
-            #ADD AMBIGUITY RULES HERE
-            
+            #no ambiguity rules, a Move doesn't know the other pieces. GameState.toSAN has them
+
             #capture
             if self.pieceCaptured != '--': #piece was captured
                 s2 = 'x'
@@ -576,10 +1280,152 @@ class Move():
     def getLastMovement(self):
         #this will be used for the python stockfish api
         if self.pieceMoved[1] == 'p' and (self.endRow == 0 or self.endRow == 7):
-               return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol) + 'q'
+               return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol) + self.promotion
 
         else:
             return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
 
     def getRankFile(self, r, c):
-        return self.colsToFiles[c] + self.rowsToRanks[r]
\ No newline at end of file
+        return self.colsToFiles[c] + self.rowsToRanks[r]
+
+
+#PGN: games are read one at a time from any iterable of lines, so a database of any size is streamed with the memory
+#of a single game. only the main line is kept, comments, variations and NAGs are skipped
+sanPattern = re.compile(r'([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?\(?([NBRQnbrq])\)?)?$')
+pgnTagPattern = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+pgnTokenPattern = re.compile(r'\{[^}]*\}?|;[^\n]*|\$\d+|1-0|0-1|1/2-1/2|\*|\d+\.+|[()]|[^\s{}();$]+')
+pgnResults = ('1-0', '0-1', '1/2-1/2', '*')
+sevenTagRoster = (('Event', '?'), ('Site', '?'), ('Date', '????.??.??'), ('Round', '?'), ('White', '?'), ('Black', '?'), ('Result', '*'))
+
+class PGNGame():
+    #one game: its tag pairs (a dict in file order) and its moves in SAN
+    def __init__(self, tags=None, moves=None, result=None):
+        self.tags = tags if tags is not None else {}
+        self.moves = moves if moves is not None else []
+        self.result = result or self.tags.get('Result', '*')
+
+    @classmethod
+    def fromGameState(cls, gs, tags=None, result=None):
+        #the game played on gs from its start position (or the FEN it was set up from). the result defaults to the
+        #position's, * while the game goes on
+        tags = dict(tags or {})
+        start = GameState(gs.startFEN)
+        if gs.startFEN is not None:
+            tags['SetUp'] = '1'
+            tags['FEN'] = gs.startFEN
+        moves = []
+        for move, piece, captured, rights, epSquare in gs.history:
+            san = start.toSAN(move, suffix=False)
+            start.makeMove(move)
+            status = start.gameStatus()
+            moves.append(san + ('#' if status.checkmate else '+' if status.inCheck else ''))
+        return cls(tags, moves, result or gs.gameStatus().result)
+
+    def startPosition(self):
+        fen = self.tags.get('FEN')
+        return GameState.fromFEN(fen) if fen else GameState()
+
+    def replay(self):
+        #yields (position, packed move) for every move, before the move is made. it is the same GameState every time, 
+        #moved along the game, so copy anything that has to be kept. raises ValueError at an illegal or ambiguous move
+        gs = self.startPosition()
+        for san in self.moves:
+            move = gs.parseSAN(san)
+            yield gs, move
+            gs.makeMove(move)
+
+    def play(self):
+        #the GameState at the end of the game
+        gs = self.startPosition()
+        for san in self.moves:
+            gs.makeMove(gs.parseSAN(san))
+        return gs
+
+    def toPGN(self):
+        tags = dict(sevenTagRoster)
+        tags.update(self.tags)
+        tags['Result'] = self.result
+        lines = ['[' + name + ' "' + value.replace('\\', '\\\\').replace('"', '\\"') + '"]' for name, value in tags.items()]
+        lines.append('')
+        #move numbers carry on from the FEN's, a game starting with black to move starts with "n..."
+        fields = self.tags.get('FEN', '').split()
+        number = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+        white = fields[1] != 'b' if len(fields) > 1 else True
+        tokens = []
+        for i, san in enumerate(self.moves):
+            if white:
+                tokens.append(str(number) + '. ' + san) #a move number stays on the line of its move
+            elif i == 0:
+                tokens.append(str(number) + '... ' + san)
+            else:
+                tokens.append(san)
+            if not white:
+                number += 1
+            white = not white
+        tokens.append(self.result)
+        line = ''
+        for token in tokens: #movetext lines are kept under 80 characters
+            if line and len(line) + 1 + len(token) > 79:
+                lines.append(line)
+                line = token
+            else:
+                line = line + ' ' + token if line else token
+        lines.append(line)
+        return '\n'.join(lines) + '\n'
+
+    def __repr__(self):
+        return 'PGNGame(' + self.tags.get('White', '?') + ' - ' + self.tags.get('Black', '?') + ' ' + self.result + ', ' + \
+                str(len(self.moves)) + ' moves)'
+
+def readPGN(source):
+    #yields the games of a PGN file one by one as PGNGame objects. source is a path or anything that yields lines
+    if isinstance(source, str):
+        with open(source, encoding='utf-8', errors='replace') as lines:
+            yield from readPGN(lines)
+        return
+    tags = {}
+    movetext = []
+    inComment = False
+    for line in source:
+        if not inComment:
+            if line.startswith('['): #a tag after moves starts the next game
+                if movetext:
+                    yield parseMovetext(tags, movetext)
+                    tags = {}
+                    movetext = []
+                match = pgnTagPattern.match(line)
+                if match is not None:
+                    tags[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+                continue
+            if line.startswith('%'): #escaped line
+                continue
+        movetext.append(line)
+        if inComment or '{' in line: #a {comment} can run over several lines, a [ inside it is no tag
+            for char in line:
+                if char == '{':
+                    inComment = True
+                elif char == '}':
+                    inComment = False
+    if movetext or tags:
+        yield parseMovetext(tags, movetext)
+
+def parseMovetext(tags, lines):
+    moves = []
+    result = None
+    depth = 0 #of nested variations
+    #lines from a file keep their line ends and lines from splitlines() don't, either way a ; comment ends with its line
+    for token in pgnTokenPattern.findall('\n'.join(line.rstrip('\r\n') for line in lines)):
+        first = token[0]
+        if first == '(':
+            depth += 1
+        elif first == ')':
+            depth -= 1
+        elif depth or first in '{;$':
+            continue
+        elif token in pgnResults:
+            result = token
+        elif token[-1] == '.': #move number
+            continue
+        else:
+            moves.append(token)
+    return PGNGame(tags, moves, result)
\ No newline at end of file
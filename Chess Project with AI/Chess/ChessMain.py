@@ -9,6 +9,11 @@ cir_a = int(sq_size // 7.1)
 cir_c = int(sq_size // 6.4)
 max_fps = 15
 images = {}
+boardSurface = None #the empty board, drawn once by loadSurfaces
+highlights = {} #highlight surfaces, made once by loadSurfaces
+endGameFont = None
+drawnSquares = [None] * (dimension * dimension) #what each square showed when it was last drawn
+drawnText = None #end game text on the screen
 
 def loadImages():
     pieces = ["wp", "wr", "wn", "wb", "wq", "wk", "bp", "br", "bn", "bb", "bq", "bk"]
@@ -30,11 +35,11 @@ def main():
     moveMade = False #flag variable for when a move is made
     animate = False #flag variable for when a move is animated
     loadImages()
+    loadSurfaces()
     running = True
     sqSelected = () #initialize selected square
     playerClicks = [] #initialize player clicks list
     rightClicks = []
-    PGN = [] #initialize PGN list
     moveList = [] #initialize list of moves for stockfish
     autoPromote = True #flag variable for pawn promotions to automatically turn to queens
     showLegalMoves = True #flag variable for showing all legal moves for the selected piece
@@ -43,12 +48,19 @@ def main():
     flipBoard = False #flips board across the horizontal axis if true (False = white on bottom//True = black on bottom)
     playerW = True #if a human is playing white, set true. If AI, then false
     playerB = True #if a human is playing black, set true. If AI, then false
+    aiUsesStockfish = True #the AI asks stockfish, or uses the built-in search if there is no engine (or this is False)
+    aiWorker = ChessAI.SearchWorker() #the AI thinks on a background thread, the board keeps drawing in the meantime
+    hintPending = False #the worker is looking for a move to suggest to the human, not one to play
+    aiLimits = ChessAI.SearchLimits() #the built-in search's time and processes, W switches the parallel search on and off
+    ChessAI.tablebasePath = "Chess/tablebases" #endgame tables for the built-in search (ChessTablebase.py build --directory Chess/tablebases)
 
     while running:
         humanTurn = (gs.whiteToMove and playerW) or (not gs.whiteToMove and playerB)
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
+            elif e.type == p.VIDEOEXPOSE: #the window was covered, draw all of it again
+                forgetBoard()
             #mouse handlers
             elif e.type == p.MOUSEBUTTONDOWN:
                 if e.button == 1 or e.button == 2: #left or middle click
@@ -67,10 +79,11 @@ def main():
                             move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
                             for i in range(len(validMoves)):
                                 if move == validMoves[i]:
+                                    if hintPending: #the hint was for the position before this move
+                                        aiWorker.cancel()
+                                        hintPending = False
+                                        p.display.set_caption('Chess') #the caption shows the search's progress, a cancelled search leaves none
                                     gs.makeMove(validMoves[i])
-                                    '''
-                                    gs.insufficientMaterial()
-                                    '''
                                     if soundOn:
                                         if move.pieceCaptured == '--':
                                             p.mixer.Sound.play(soundMov)
@@ -81,17 +94,10 @@ def main():
                                     animate = True
                                     moveList.append(move.getLastMovement()) #adds last move to the moveList to be understood by stockfish api
                                     ChessAI.setStockfishPosition(moveList) #sends the movelist to Stockfish
-                                    inCheck, inMate = gs.opponentCheckOrMate() #checks if the last move ended in a check or mate
-                                    if inCheck:
-                                        PGN.append(move.getChessNotation(check=True)) #adds last move to the PGN list with check
-                                    elif inMate:
-                                        PGN.append(move.getChessNotation(mate=True)) #adds last move to the PGN list with mate
-                                    else:
-                                        PGN.append(move.getChessNotation()) #adds last move to the PGN list
                                     #print(moveList)
-                                    #print(PGN)
                                     sqSelected = () #resets user clicks
                                     playerClicks = []
+                                    break
                             if not moveMade:
                                 playerClicks = [sqSelected]
                 if e.button == 3: #right click
@@ -111,21 +117,25 @@ def main():
                     running = False
 
                 if e.key == p.K_h: #Pressing the "H" key will give you a list of key commands
-                    print('KEY COMMANDS:\n1: Toggles the controller of WHITE between Human/Computer\n2: Toggles the controller of BLACK between Human/Computer\nQ: Auto-Promote to Queen (WIP)\nL: Show Legal Moves\nB: Print Board State\nS: Best Move from Stockfish\nP: Print PGN (WIP)\nF: Print FEN\nM: Toggle Sound\nZ: Undo Move (Works best with 2 human players)\nR: New Game\nEsc: Exit Game\n\nFor help press "H"')
+                    print('KEY COMMANDS:\n1: Toggles the controller of WHITE between Human/Computer\n2: Toggles the controller of BLACK between Human/Computer\nQ: Auto-Promote to Queen (WIP)\nL: Show Legal Moves\nB: Print Board State\nS: Best Move from Stockfish\nP: Print PGN\nF: Print FEN\nM: Toggle Sound\nW: Toggle Parallel Search\nZ: Undo Move (Works best with 2 human players)\nR: New Game\nEsc: Exit Game\n\nFor help press "H"')
 
                 if e.key == p.K_z: #Pressing the "Z" key will undo your last move
+                    aiWorker.cancel() #the position the AI was thinking about is gone
+                    hintPending = False
+                    p.display.set_caption('Chess')
                     if playerW and playerB: #in a 2-player game Z undoes 1 move
                         gs.undoMove()
                         rightClicks = []
                         moveMade = True
                         animate = False
                         gameOver = False
-                        if PGN: #make sure there is a move to delete
-                            del PGN[-1] #remove last move from the PGN list when a move is undone
                         if moveList: #make sure there is a move to delete
                             del moveList[-1] #remove last move from the PGN list when a move is undone
 
                 if e.key == p.K_r: #reset the board when the 'R' key is pressed
+                    aiWorker.cancel()
+                    hintPending = False
+                    p.display.set_caption('Chess')
                     gs = ChessEngine.GameState()
                     validMoves = gs.getValidMoves()
                     sqSelected = ()
@@ -134,25 +144,24 @@ def main():
                     moveMade = False
                     animate = False
                     gameOver = False
-                    gs.moveLog = []
-                    PGN = []
                     moveList = []
 
                 if e.key == p.K_s: #Pressing the "S" key will find the best move using stockfish
-                    if not gameOver:
-                        ChessAI.findBestStockfishMove(moveList)
+                    if not gameOver and humanTurn and not aiWorker.busy: #asked on the worker so the window keeps running
+                        aiWorker.start(gs, moveList, aiLimits, useStockfish=aiUsesStockfish)
+                        hintPending = True
 
                 if e.key == p.K_b: #Pressing the "B" key will output an ASCII board state
                     ChessAI.outputBoard()
                 
                 if e.key == p.K_p: #Pressing the "P" key will output the Portable Game Notation (PGN)
-                    if PGN:
+                    if gs.history:
                         print('PGN:')
-                        print(PGN)
+                        print(ChessEngine.PGNGame.fromGameState(gs).toPGN()) #the moves in SAN are worked out from the game
                 
                 if e.key == p.K_f: #Pressing the "F" key will output the Forsyth-Edwards Notation (FEN)
                     print('FEN:')
-                    ChessAI.outputFEN()
+                    print(gs.toFEN())
                 
                 if e.key == p.K_m: #Pressing the "M" key will toggle SFX
                     soundOn = not soundOn
@@ -162,6 +171,9 @@ def main():
                         print('Sound: OFF')
 
                 if e.key == p.K_1: #Pressing the "1" key will toggle the controller of White's pieces between human/AI
+                    aiWorker.cancel()
+                    hintPending = False
+                    p.display.set_caption('Chess')
                     playerW = not playerW
                     if playerW:
                         print('White is now a HUMAN player')
@@ -169,6 +181,9 @@ def main():
                         print('White is now a COMPUTER player')
 
                 if e.key == p.K_2: #Pressing the "2" key will toggle the controller of Black's pieces between human/AI
+                    aiWorker.cancel()
+                    hintPending = False
+                    p.display.set_caption('Chess')
                     playerB = not playerB
                     if playerB:
                         print('Black is now a HUMAN player')
@@ -198,27 +213,37 @@ def main():
                     flipBoard = not flipBoard
                     print('Board flipped! WIP')
 
+                if e.key == p.K_w: #Pressing the "W" key will toggle the built-in search between one and all the cores
+                    aiLimits.workers = ChessAI.searchWorkers if aiLimits.workers == 1 else 1
+                    print('The built-in search now uses ' + str(aiLimits.workers) + ' process' + ('es' if aiLimits.workers > 1 else ''))
+
 
         #AI move finder
-        if not gameOver and not humanTurn:
-            #AIMove = ChessAI.findBestMove(gs, validMoves)
-            #AIMove = ChessAI.findStockfishMove(gs, validMoves, moveList) #stockfish implementation WIP
-            sf = ChessAI.stockfishMove()
-            AIMove = ChessEngine.Move(sf[0], sf[1], gs.board)
-            for i in range(len(validMoves)):
-                if AIMove == validMoves[i]:
-                    gs.makeMove(validMoves[i])
-            if AIMove is None: #I think this should be 'if not AIMove:' because we are looking for an empty list
-                print('no stockfish move found')
-                AIMove = ChessAI.findRandomMove(validMoves)
-                gs.makeMove(AIMove)
-            inCheck, inMate = gs.opponentCheckOrMate() #checks if the last move ended in a check or mate
-            if inCheck:
-                PGN.append(AIMove.getChessNotation(check=True)) #adds last move to the PGN list with check
-            elif inMate:
-                PGN.append(AIMove.getChessNotation(mate=True)) #adds last move to the PGN list with mate
-            else:
-                PGN.append(AIMove.getChessNotation()) #adds last move to the PGN list
+        if not gameOver and not humanTurn and not aiWorker.busy:
+            aiWorker.start(gs, moveList, aiLimits, useStockfish=aiUsesStockfish)
+        AIMove = None
+        for message, info in aiWorker.poll(): #what the AI posted since the last frame
+            if message == 'progress':
+                p.display.set_caption('Chess - thinking: depth ' + str(info.depth) + ', ' + info.move.getLastMovement() + 
+                                        ', ' + str(info.nodesPerSecond()) + ' nodes/s')
+            elif message == 'error':
+                print(info + ', the AI uses the built-in search from now on')
+                aiUsesStockfish = False
+            elif message == 'done':
+                p.display.set_caption('Chess')
+                if hintPending:
+                    hintPending = False
+                    if info.move is not None:
+                        print('Best move: ' + info.move.getLastMovement())
+                        if abs(info.score) >= ChessAI.mateScore:
+                            print('Mate ' + ('for' if info.score > 0 else 'against') + ' the side to move')
+                    continue
+                for i in range(len(validMoves)):
+                    if info.move == validMoves[i]:
+                        AIMove = validMoves[i]
+                        break
+        if AIMove is not None:
+            gs.makeMove(AIMove)
             moveList.append(AIMove.getLastMovement()) #adds last move to the moveList to be understood by stockfish api
             ChessAI.setStockfishPosition(moveList) #sends the movelist to Stockfish
             rightClicks = []
@@ -228,128 +253,180 @@ def main():
         if moveMade:
             if animate and gs.moveLog:
                 animateMove(gs.moveLog[-1], screen, gs.board, clock)
-            validMoves = gs.getValidMoves()
+            validMoves = gs.getValidMoves() #reuses the moves generated for the status of the new position
             moveMade = False
             animate = False
 
-        drawGameState(screen, gs, validMoves, sqSelected, gs.moveLog, rightClicks, showLegalMoves)
-
-        if gs.checkmate or gs.stalemate:
+        status = gs.gameStatus() #cached, only generates moves the first time a position is asked about
+        endText = None
+        if status.gameOver:
             gameOver = True
-            drawEndGameText(screen, 'Draw by stalemate' if gs.stalemate else 'Black wins by checkmate' if gs.whiteToMove else 'White wins by checkmate')
+            if status.checkmate:
+                endText = 'Black wins by checkmate' if gs.whiteToMove else 'White wins by checkmate'
+            else:
+                endText = 'Draw by ' + status.reason
 
+        dirty = drawGameState(screen, gs, validMoves, sqSelected, rightClicks, showLegalMoves, endText)
+        if dirty:
+            p.display.update(dirty)
         clock.tick(max_fps)
-        p.display.flip()
-
-def drawGameState(screen, gs, validMoves, sqSelected, moveLog, rightClicks, showLegalMoves=False):
-    drawBoard(screen) #draw squares on the board
-    highlightSquares(screen, gs, validMoves, sqSelected, moveLog, rightClicks, showLegalMoves)
-    drawPieces(screen, gs.board) #draw pieces on top of those squares
+        if not dirty and not aiWorker.busy:
+            p.event.post(p.event.wait()) #nothing to draw or think about, sleep until the next event
+    aiWorker.cancel()
+    ChessAI.stopParallelSearch() #the helper processes and the shared hash table
 
-def drawBoard(screen):
-    global colors
+def loadSurfaces():
+    #everything the renderer blits is made once here instead of every frame
+    global boardSurface, endGameFont
     colors = [p.Color("bisque3"), p.Color("burlywood4")]
+    boardSurface = p.Surface((width, height)) #the empty board, squares are copied from it
     for r in range(dimension):
         for c in range(dimension):
-            color = colors[((r+c) % 2)]
-            p.draw.rect(screen, color, p.Rect(c*sq_size, r*sq_size, sq_size, sq_size))
+            p.draw.rect(boardSurface, colors[((r+c) % 2)], p.Rect(c*sq_size, r*sq_size, sq_size, sq_size))
+    #recent move and selected square
+    rec = p.Surface((sq_size, sq_size))
+    rec.set_alpha(100) #transparency value: 0 is transparent 255 is opaque
+    rec.fill(p.Color('goldenrod'))
+    highlights['square'] = rec
+    #advance squares
+    adv = p.Surface((sq_size, sq_size)) #create a new black surface to draw circle on
+    adv.set_colorkey('black') #everything that is 'black' is now completely transparent
+    p.draw.circle(adv, 'gray25', (radius,radius), cir_a) #draw circle
+    adv.set_alpha(65)
+    highlights['advance'] = adv
+    #capture squares
+    cap = p.Surface((sq_size, sq_size))
+    cap.set_colorkey('black')
+    p.draw.circle(cap, 'gray25', (radius,radius), radius, cir_c)
+    cap.set_alpha(65)
+    highlights['capture'] = cap
+    endGameFont = p.font.Font('Chess/images/coolvetica.ttf', radius)
+
+def forgetBoard():
+    #makes the next drawGameState draw every square again, for when something else drew over the board
+    global drawnText
+    drawnSquares[:] = [None] * (dimension * dimension)
+    drawnText = None
 
-def highlightSquares(screen, gs, validMoves, sqSelected, moveLog, rightClicks, showLegalMoves=False):
-    #highlight recent move
-    if moveLog:
-        r1 = moveLog[-1].startRow
-        r2 = moveLog[-1].endRow
-        c1 = moveLog[-1].startCol
-        c2 = moveLog[-1].endCol
-        rec = p.Surface((sq_size, sq_size))
-        rec.set_alpha(100) #transparency value: 0 is transparent 255 is opaque
-        rec.fill(p.Color('goldenrod'))
-        screen.blit(rec, (c1*sq_size, r1*sq_size))
-        screen.blit(rec, (c2*sq_size, r2*sq_size))
+def squareRect(r, c):
+    return p.Rect(c*sq_size, r*sq_size, sq_size, sq_size)
 
-    #Left click highlights
+def boardScene(gs, validMoves, sqSelected, rightClicks, showLegalMoves=False):
+    #what every square should show: (piece, recent move, selected, move marker, right clicked)
+    board = gs.board
+    recent = ()
+    if gs.history: #squares of the recent move, read from the packed move so the move log isn't rebuilt every frame
+        move = gs.history[-1][0]
+        recent = (divmod(move & 63, 8), divmod(move >> 6 & 63, 8))
+    selected = None
+    markers = {}
     if sqSelected != ():
         r, c = sqSelected
-        if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
-            #highlight selected square
-            s = p.Surface((sq_size, sq_size))
-            s.set_alpha(100) #transparency value: 0 is transparent 255 is opaque
-            s.fill(p.Color('goldenrod'))
-            screen.blit(s, (c*sq_size, r*sq_size))
-            #show valid moves
+        if board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
+            selected = sqSelected
             if showLegalMoves:
-                #advance squares
-                adv = p.Surface((sq_size, sq_size)) #create a new black surface to draw circle on
-                adv.set_colorkey('black') #everything that is 'black' is now completely transparent
-                p.draw.circle(adv, 'gray25', (radius,radius), cir_a) #draw circle
-                adv.set_alpha(65)
-                #capture squares
-                cap = p.Surface((sq_size, sq_size))
-                cap.set_colorkey('black')
-                p.draw.circle(cap, 'gray25', (radius,radius), radius, cir_c)
-                cap.set_alpha(65)
-
-                #blit all legal moves of the selected piece
                 for move in validMoves:
                     if move.startRow == r and move.startCol == c:
-                        if move.pieceCaptured != '--':
-                            screen.blit(cap, (move.endCol*sq_size, move.endRow*sq_size))
-                        else:
-                            screen.blit(adv, (move.endCol*sq_size, move.endRow*sq_size))
+                        markers[(move.endRow, move.endCol)] = 'capture' if move.pieceCaptured != '--' else 'advance'
+    return [(board[r][c], (r, c) in recent, (r, c) == selected, markers.get((r, c)), (r, c) in rightClicks)
+            for r in range(dimension) for c in range(dimension)]
 
-    #right click highlights
-    if rightClicks:
-        for square in rightClicks:
-            r, c = square
-            planColors = [p.Color("salmon"), p.Color((250, 111, 96, 255))] #salmon and darkishsalmon?
-            bcolor = planColors[((r+c) % 2)]
-            p.draw.rect(screen, bcolor, p.Rect(c*sq_size, r*sq_size, sq_size, sq_size))
+def drawSquare(screen, r, c, square):
+    piece, recent, selected, marker, planned = square
+    rect = squareRect(r, c)
+    screen.blit(boardSurface, rect, rect)
+    if recent:
+        screen.blit(highlights['square'], rect)
+    if selected:
+        screen.blit(highlights['square'], rect)
+    if marker is not None:
+        screen.blit(highlights[marker], rect)
+    if planned:
+        planColors = [p.Color("salmon"), p.Color((250, 111, 96, 255))] #salmon and darkishsalmon?
+        p.draw.rect(screen, planColors[((r+c) % 2)], rect)
+    if piece != "--":
+        screen.blit(images[piece], rect)
+    return rect
 
-def drawPieces(screen, board):
-    for r in range(dimension):
-        for c in range(dimension):
-            piece = board[r][c]
-            if piece != "--":
-                screen.blit(images[piece], p.Rect(c*sq_size, r*sq_size, sq_size, sq_size))
+def drawGameState(screen, gs, validMoves, sqSelected, rightClicks, showLegalMoves=False, text=None):
+    #only draws the squares that look different from the last frame, returns the rects to pass to display.update
+    global drawnText
+    scene = boardScene(gs, validMoves, sqSelected, rightClicks, showLegalMoves)
+    dirty = []
+    for sq in range(dimension * dimension):
+        if scene[sq] != drawnSquares[sq]:
+            dirty.append(drawSquare(screen, sq // dimension, sq % dimension, scene[sq]))
+            drawnSquares[sq] = scene[sq]
+    #the end game text is see-through, so the squares under it are drawn again before it is
+    area = None
+    if text != drawnText: #shown, changed or taken away
+        area = textRect(text if text is not None else drawnText)
+        if text is not None and drawnText is not None:
+            area = area.union(textRect(drawnText))
+    elif text is not None and textRect(text).collidelist(dirty) != -1: #a square under the text was drawn over it
+        area = textRect(text)
+    if area is not None:
+        for sq in range(dimension * dimension):
+            r, c = sq // dimension, sq % dimension
+            if squareRect(r, c).colliderect(area):
+                dirty.append(drawSquare(screen, r, c, scene[sq]))
+        if text is not None:
+            drawEndGameText(screen, text)
+        dirty.append(area)
+    drawnText = text
+    return dirty
 
 def animateMove(move, screen, board, clock):
-    coords = [] # list of coords
+    #each frame only the squares under the moving piece's last and new rectangles are drawn and updated
     dR = move.endRow - move.startRow
     dC = move.endCol - move.startCol
     #framesPerSquare = 5
     #frameCount = (abs(dR) + abs(dC)) * framesPerSquare #uncomment these two lines for uniform piece travel speed (animation time of moving Ra1 to Ra8 will take 7 times longer than Ra1 to Ra2)
     frameCount = 8 #uniform animation speed (animation time of moving Ra1 to Ra8 will take the same amount of time as Ra1 to Ra2)
+    captureRow = move.endRow
+    if move.enPassant: #enpassant moves have a different animation
+        captureRow = move.endRow + 1 if move.pieceCaptured[0] == 'b' else move.endRow - 1
+    last = squareRect(move.startRow, move.startCol)
     for frame in range(frameCount + 1):
         r, c = (move.startRow + dR*frame/frameCount, move.startCol + dC*frame/frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        #erase the piece moved from its ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = p.Rect(move.endCol*sq_size, move.endRow*sq_size, sq_size, sq_size)
-        p.draw.rect(screen, color, endSquare)
-        #draw captured piece onto rectangle
-        if move.pieceCaptured != '--':
-            if move.enPassant: #enpassant moves have a different animation
-                enPassantRow = move.endRow + 1 if move.pieceCaptured[0] == 'b' else move.endRow - 1
-                endSquare = p.Rect(move.endCol*sq_size, enPassantRow*sq_size, sq_size, sq_size)
-            screen.blit(images[move.pieceCaptured], endSquare)
+        pieceRect = p.Rect(int(c*sq_size), int(r*sq_size), sq_size, sq_size)
+        area = last.union(pieceRect)
+        for row in range(area.top // sq_size, min((area.bottom - 1) // sq_size + 1, dimension)):
+            for col in range(area.left // sq_size, min((area.right - 1) // sq_size + 1, dimension)):
+                rect = squareRect(row, col)
+                screen.blit(boardSurface, rect, rect)
+                piece = board[row][col]
+                if (row, col) == (move.endRow, move.endCol): #erase the piece moved from its ending square
+                    piece = '--'
+                if (row, col) == (captureRow, move.endCol) and move.pieceCaptured != '--': #draw captured piece onto its square
+                    piece = move.pieceCaptured
+                if piece != '--':
+                    screen.blit(images[piece], rect)
         #draw moving piece
-        screen.blit(images[move.pieceMoved], p.Rect(c*sq_size, r*sq_size, sq_size, sq_size))
-        p.display.flip()
+        screen.blit(images[move.pieceMoved], pieceRect)
+        p.display.update(area)
+        last = pieceRect
         clock.tick(60)
+    forgetBoard() #the squares were drawn without their highlights
+
+def textRect(text):
+    #the part of the screen drawEndGameText covers
+    textWidth, textHeight = endGameFont.size(text)
+    rect = p.Rect(0, 0, textWidth+radius, textHeight+radius)
+    rect.center = (width//2, height//2)
+    return rect.clip(p.Rect(0, 0, width, height))
 
 def drawEndGameText(screen, text):
-    font = p.font.Font('Chess/images/coolvetica.ttf', radius)
-    textObject = font.render(text, 0, p.Color('black'))
-    textLocation = textObject.get_rect(center=(width/2, height/2))
+    textObject = endGameFont.render(text, 0, p.Color('black'))
+    textLocation = textObject.get_rect(center=(width//2, height//2))
     textBackground = p.Surface((textObject.get_rect().width+radius, textObject.get_rect().height+radius))
     textBackground.fill(p.Color('steelblue4')) #comment out if desired color is black (goods ones are steelblue4, olivedrab4, navyblue, darkolivegreen)
     textBackground.set_alpha(120)
-    screen.blit(textBackground, textBackground.get_rect(center=(width/2, height/2)))
+    screen.blit(textBackground, textBackground.get_rect(center=(width//2, height//2)))
     textObject.set_alpha(180)
     screen.blit(textObject, textLocation)
     textObject.set_alpha(255)
-    textObject = font.render(text, 0, p.Color('white'))
+    textObject = endGameFont.render(text, 0, p.Color('white'))
     screen.blit(textObject, textLocation.move(0,-3))
 
 if __name__ == "__main__":
@@ -0,0 +1,249 @@
+import argparse
+import math
+import os
+import random
+import shlex
+import time
+from multiprocessing import Pool
+import ChessEngine, ChessAI, ChessUCI
+
+#plays games between two players without the pygame window, to check that a change to the engine makes it play better
+#and not just faster. every opening is played twice with the colors swapped so neither player gets the better side of it
+#openings are moves in long algebraic notation played from the start position before the players take over
+openings = [
+    "e2e4 e7e5 g1f3 b8c6 f1b5", #ruy lopez
+    "e2e4 e7e5 g1f3 b8c6 f1c4 f8c5", #italian
+    "e2e4 c7c5 g1f3 d7d6 d2d4 c5d4 f3d4", #sicilian
+    "e2e4 e7e6 d2d4 d7d5", #french
+    "e2e4 c7c6 d2d4 d7d5", #caro-kann
+    "e2e4 d7d5 e4d5 d8d5", #scandinavian
+    "d2d4 d7d5 c2c4 e7e6", #queen's gambit declined
+    "d2d4 d7d5 c2c4 d5c4", #queen's gambit accepted
+    "d2d4 g8f6 c2c4 g7g6 b1c3 f8g7", #king's indian
+    "d2d4 g8f6 c2c4 e7e6 b1c3 f8b4", #nimzo-indian
+    "c2c4 e7e5", #english
+    "g1f3 d7d5 g2g3", #reti
+]
+maxPlies = 400 #games still going after this many plies are adjudicated as draws
+
+class RandomPlayer():
+    def move(self, gs, validMoves, moveList):
+        return ChessAI.findRandomMove(validMoves)
+
+    def close(self):
+        pass
+
+
+class NegamaxPlayer():
+    #ChessAI's search to a fixed depth (the same move every time for a given position and seed), or for a time per move
+    #each player keeps its own hash table and move ordering, so two of them in one process don't help each other. with
+    #several search workers the hash table is the parallel search's shared one, which both players then use
+    def __init__(self, depth=None, moveTime=None, workers=1):
+        if depth is None and moveTime is None:
+            depth = 3
+        self.limits = ChessAI.SearchLimits(moveTime=moveTime if moveTime is not None else float('inf'), maxDepth=depth, workers=workers)
+        self.transpositionTable = ChessAI.TranspositionTable(ChessAI.ttSizeMB) if workers <= 1 else None
+        self.moveOrderer = ChessAI.MoveOrderer(ChessAI.maxPly)
+
+    def move(self, gs, validMoves, moveList):
+        if self.transpositionTable is not None:
+            ChessAI.transpositionTable = self.transpositionTable
+        ChessAI.moveOrderer = self.moveOrderer
+        return ChessAI.findBestMove(gs, validMoves, self.limits).move
+
+    def close(self):
+        if self.transpositionTable is None:
+            ChessAI.stopParallelSearch()
+
+
+class UCIPlayer():
+    #an external engine searching to a depth or for a time per move
+    def __init__(self, depth=None, moveTime=None, command=None):
+        if depth is None and moveTime is None:
+            depth = 10
+        self.depth = depth
+        self.moveTime = moveTime
+        if command and not os.path.isfile(command): #a command line with arguments
+            command = shlex.split(command)
+        self.manager = ChessUCI.EngineManager(command)
+
+    def move(self, gs, validMoves, moveList):
+        try:
+            result = self.manager.analyse(moveList, depth=self.depth, movetime=self.moveTime).result()
+        except ChessUCI.EngineError as error:
+            print(self.name + ': ' + str(error))
+            return None
+        for move in validMoves:
+            if move.getLastMovement() == result.bestMove:
+                return move
+        return None #no move or an illegal one
+
+    def close(self):
+        self.manager.close()
+
+
+def makePlayer(spec, searchWorkers=1):
+    #random, negamax[:depth[:seconds]] or uci[:depth[:seconds[:engine command]]], an empty field means no limit of that kind
+    #e.g. negamax:4, negamax::0.5, uci:12, uci::0.1:/usr/games/stockfish
+    fields = spec.split(':', 3)
+    kind = fields[0]
+    depth = int(fields[1]) if len(fields) > 1 and fields[1] else None
+    moveTime = float(fields[2]) if len(fields) > 2 and fields[2] else None
+    if kind == 'random':
+        player = RandomPlayer()
+    elif kind == 'negamax':
+        player = NegamaxPlayer(depth, moveTime, searchWorkers)
+    elif kind == 'uci':
+        player = UCIPlayer(depth, moveTime, fields[3] if len(fields) > 3 and fields[3] else None)
+    else:
+        raise ValueError('unknown player ' + spec + ' (use random, negamax[:depth[:seconds]] or uci[:depth[:seconds[:command]]])')
+    player.name = spec #what the results and the PGN call it
+    return player
+
+def playGame(task):
+    #plays one game, in a pool process when there are several workers
+    #returns a dict with the PGN tags and the moves in SAN
+    round_, whiteSpec, blackSpec, opening, seed, plyLimit, bookPath, searchWorkers, tablebasePath = task
+    random.seed(seed)
+    ChessAI.bookPath = bookPath #negamax players open it the first time they move
+    ChessAI.tablebasePath = tablebasePath #and the endgame tables the first time they search
+    players = (makePlayer(whiteSpec, searchWorkers), makePlayer(blackSpec, searchWorkers))
+    gs = ChessEngine.GameState()
+    moveList = [] #long algebraic, for UCI engines
+    sanMoves = []
+    result, termination = '*', ''
+    openingMoves = opening.split()
+    start = time.perf_counter()
+    try:
+        while True:
+            status = gs.gameStatus()
+            if status.gameOver:
+                result, termination = status.result, status.reason
+                break
+            if len(gs.history) >= plyLimit:
+                result, termination = '1/2-1/2', 'move limit'
+                break
+            validMoves = gs.getValidMoves()
+            move = None
+            if len(gs.history) < len(openingMoves):
+                for validMove in validMoves:
+                    if validMove.getLastMovement() == openingMoves[len(gs.history)]:
+                        move = validMove
+                if move is None:
+                    raise ValueError('opening move ' + openingMoves[len(gs.history)] + ' is illegal: ' + opening)
+            else:
+                move = players[0 if gs.whiteToMove else 1].move(gs, validMoves, moveList)
+                if move is None: #the player failed to move, it loses the game
+                    result = '0-1' if gs.whiteToMove else '1-0'
+                    termination = ('white' if gs.whiteToMove else 'black') + ' forfeits'
+                    break
+            sanMoves.append(gs.toSAN(move))
+            gs.makeMove(move)
+            moveList.append(move.getLastMovement())
+    finally:
+        for player in players:
+            player.close()
+    return {'round': round_, 'white': players[0].name, 'black': players[1].name, 'result': result, 'termination': termination,
+            'opening': opening, 'moves': sanMoves, 'elapsed': time.perf_counter() - start}
+
+def gamePGN(game, event='ChessMatch', date=None):
+    tags = {'Event': event, 'Site': '?', 'Date': date or time.strftime('%Y.%m.%d'), 'Round': str(game['round']),
+            'White': game['white'], 'Black': game['black'], 'PlyCount': str(len(game['moves'])), 'Termination': game['termination']}
+    return ChessEngine.PGNGame(tags, game['moves'], game['result']).toPGN()
+
+def scoreToElo(score):
+    #Elo difference that gives the expected score (0 to 1)
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return -400 * math.log10(1 / score - 1)
+
+def eloDifference(wins, losses, draws):
+    #(Elo difference, error) of a result, the error is the 95% confidence margin from the spread of the game scores
+    games = wins + losses + draws
+    if games == 0:
+        return 0.0, math.inf
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    low = scoreToElo(score - margin)
+    high = scoreToElo(score + margin)
+    if math.isinf(low) or math.isinf(high): #no error bars on a clean sweep
+        return scoreToElo(score), math.inf
+    return scoreToElo(score), (high - low) / 2
+
+def runMatch(playerA, playerB, games=10, workers=1, openingList=None, seed=0, plyLimit=maxPlies, pgnPath=None, verbose=True,
+                bookPath=None, searchWorkers=1, tablebasePath=None):
+    #plays games between the player specs, A has white in the even rounds. returns (wins, losses, draws) for A
+    #searchWorkers above 1 gives the negamax players a parallel search, only with workers=1 (pool processes can't start their own)
+    openingList = openingList or openings
+    tasks = []
+    for i in range(games):
+        opening = openingList[(i // 2) % len(openingList)]
+        white, black = (playerA, playerB) if i % 2 == 0 else (playerB, playerA)
+        tasks.append((i + 1, white, black, opening, seed + i, plyLimit, bookPath, searchWorkers, tablebasePath))
+    wins = losses = draws = 0
+    results = []
+    if workers > 1:
+        pool = Pool(workers)
+        games = pool.imap_unordered(playGame, tasks)
+    else:
+        pool = None
+        games = map(playGame, tasks)
+    try:
+        for game in games:
+            results.append(game)
+            aWhite = game['round'] % 2 == 1
+            if game['result'] == '1/2-1/2':
+                draws += 1
+            elif (game['result'] == '1-0') == aWhite:
+                wins += 1
+            else:
+                losses += 1
+            if verbose:
+                print('Game ' + str(game['round']) + ': ' + game['white'] + ' - ' + game['black'] + ' ' + game['result'] + ' (' +
+                        game['termination'] + ', ' + str(len(game['moves'])) + ' plies, ' + str(round(game['elapsed'], 1)) + 's)')
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    if pgnPath is not None:
+        with open(pgnPath, 'w') as pgn:
+            pgn.write('\n'.join(gamePGN(game) for game in sorted(results, key=lambda game: game['round'])))
+    return wins, losses, draws
+
+def main():
+    parser = argparse.ArgumentParser(description='Play games between two players without the window and estimate the Elo difference')
+    parser.add_argument('playerA', help='random, negamax[:depth[:seconds]] or uci[:depth[:seconds[:command]]]')
+    parser.add_argument('playerB')
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=1, help='games played at the same time, one process each')
+    parser.add_argument('--openings', help='file with one opening per line, moves in long algebraic notation')
+    parser.add_argument('--max-plies', type=int, default=maxPlies, help='adjudicate longer games as draws')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pgn', help='write the games to this file')
+    parser.add_argument('--search-workers', type=int, default=1, help='processes every negamax search uses (needs --workers 1)')
+    parser.add_argument('--book', help='opening book the negamax players play from after the opening (ChessBook.py builds one)')
+    parser.add_argument('--tablebases', help='directory of endgame tables the negamax players search with (ChessTablebase.py builds them)')
+    args = parser.parse_args()
+    if args.workers > 1 and args.search_workers > 1:
+        parser.error('--search-workers needs --workers 1, games played in pool processes cannot start search processes')
+
+    openingList = None
+    if args.openings:
+        with open(args.openings) as lines:
+            openingList = [line.split('#')[0].strip() for line in lines if line.split('#')[0].strip()]
+    start = time.perf_counter()
+    wins, losses, draws = runMatch(args.playerA, args.playerB, args.games, args.workers, openingList, args.seed, args.max_plies, args.pgn,
+                                    bookPath=args.book, searchWorkers=args.search_workers, tablebasePath=args.tablebases)
+    games = wins + losses + draws
+    elo, error = eloDifference(wins, losses, draws)
+    print('\nScore of ' + args.playerA + ' vs ' + args.playerB + ': ' + str(wins) + ' - ' + str(losses) + ' - ' + str(draws) +
+            ' [' + str(round((wins + draws / 2) / games, 3) if games else 0) + '] ' + str(games) + ' games in ' +
+            str(round(time.perf_counter() - start, 1)) + 's')
+    print('Elo difference: ' + str(round(elo, 1)) + ' +/- ' + str(round(error, 1)))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
\ No newline at end of file
@@ -0,0 +1,120 @@
+import argparse
+import time
+import ChessEngine
+
+#perft counts the leaf nodes of the legal move tree to a fixed depth. the counts for these positions are known,
+#so any difference means move generation, makeMove or undoMove is broken
+#(name, fen, [nodes at depth 1, depth 2, ...])
+perftSuite = [
+    ("start position", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862, 4085603]),
+    ("rook endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+    ("promotions", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467, 422333]),
+    ("promotions mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1", [6, 264, 9467, 422333]),
+    ("checks and pins", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487]),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", [46, 2079, 89890, 3894594]),
+    ("illegal en passant 1", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1", [18, 92, 1670, 10138, 185429, 1134888]),
+    ("illegal en passant 2", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1", [13, 102, 1266, 10276, 135655, 1015133]),
+    ("en passant gives check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", [15, 126, 1928, 13931, 206379, 1440467]),
+    ("short castle gives check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1", [15, 66, 1198, 6399, 120330, 661072]),
+    ("long castle gives check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", [16, 71, 1286, 7418, 141077, 803711]),
+    ("castling rights", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", [26, 1141, 27826, 1274206]),
+    ("castling prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", [44, 1494, 50509, 1720476]),
+    ("promote out of check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1", [11, 133, 1442, 19174, 266199, 3821001]),
+    ("discovered check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1", [29, 165, 5160, 31961, 1004658]),
+    ("promote to give check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1", [9, 40, 472, 2661, 38983, 217342]),
+    ("underpromote to check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1", [6, 27, 273, 1329, 18135, 92683]),
+    ("self stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1", [2, 6, 13, 63, 382, 2217]),
+    ("stalemate and checkmate 1", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1", [10, 25, 268, 926, 10857, 43261, 567584]),
+    ("stalemate and checkmate 2", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1", [37, 183, 6559, 23527]),
+]
+
+def perft(gs, depth, bulk=True, pool=None, ply=0):
+    #number of leaf nodes of the legal move tree. with bulk counting the last ply is counted from the length of the
+    #move list instead of making and taking back every move
+    if pool is None:
+        pool = ChessEngine.MovePool(depth + 1)
+    if depth == 0:
+        return 1
+    moves = gs.generateMoves(pool.get(ply))
+    if bulk and depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1, bulk, pool, ply + 1)
+        gs.undoMove()
+    return nodes
+
+def divide(gs, depth, bulk=True):
+    #perft split by root move, the usual way to find which move a wrong count comes from
+    pool = ChessEngine.MovePool(depth + 1)
+    counts = []
+    for move in gs.generateMoves([]):
+        name = gs.buildMove(move).getLastMovement()
+        gs.makeMove(move)
+        counts.append((name, perft(gs, depth - 1, bulk, pool, 1)))
+        gs.undoMove()
+    return counts
+
+def timedPerft(gs, depth, bulk=True):
+    #returns (nodes, seconds, nodes per second)
+    start = time.perf_counter()
+    nodes = perft(gs, depth, bulk)
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed, int(nodes / elapsed) if elapsed > 0 else 0
+
+def runSuite(maxNodes=1000000, bulk=True, verbose=True):
+    #checks every suite position up to the deepest depth whose known count is at most maxNodes
+    #returns True if every count matched
+    passed = True
+    totalNodes = 0
+    totalTime = 0.0
+    for name, fen, counts in perftSuite:
+        for depth in range(1, len(counts) + 1):
+            if counts[depth - 1] > maxNodes:
+                break
+            gs = ChessEngine.GameState.fromFEN(fen)
+            nodes, elapsed, nps = timedPerft(gs, depth, bulk)
+            totalNodes += nodes
+            totalTime += elapsed
+            ok = nodes == counts[depth - 1]
+            passed = passed and ok
+            if verbose or not ok:
+                print(('ok   ' if ok else 'FAIL ') + name + ' depth ' + str(depth) + ': ' + str(nodes) +
+                        ('' if ok else ' (expected ' + str(counts[depth - 1]) + ')') + ', ' + str(nps) + ' nps')
+    print('Total: ' + str(totalNodes) + ' nodes in ' + str(round(totalTime, 2)) + 's, ' +
+            str(int(totalNodes / totalTime) if totalTime > 0 else 0) + ' nps')
+    print('All counts correct' if passed else 'SOME COUNTS ARE WRONG')
+    return passed
+
+def main():
+    parser = argparse.ArgumentParser(description='Perft: count the legal move tree to check and time move generation')
+    parser.add_argument('depth', type=int, nargs='?', default=4)
+    parser.add_argument('--fen', default=perftSuite[0][1], help='position to count (default: start position)')
+    parser.add_argument('--divide', action='store_true', help='print the count for every root move')
+    parser.add_argument('--suite', action='store_true', help='check the bundled positions with known counts')
+    parser.add_argument('--max-nodes', type=int, default=1000000, help='deepest suite depth to run, by known node count')
+    parser.add_argument('--no-bulk', action='store_true', help='make and take back the moves at the last ply too')
+    args = parser.parse_args()
+    bulk = not args.no_bulk
+
+    if args.suite:
+        return 0 if runSuite(args.max_nodes, bulk) else 1
+    gs = ChessEngine.GameState.fromFEN(args.fen)
+    if args.divide:
+        start = time.perf_counter()
+        counts = divide(gs, args.depth, bulk)
+        elapsed = time.perf_counter() - start
+        for name, nodes in counts:
+            print(name + ': ' + str(nodes))
+        nodes = sum(nodes for name, nodes in counts)
+        print('\nMoves: ' + str(len(counts)))
+    else:
+        nodes, elapsed, nps = timedPerft(gs, args.depth, bulk)
+    print('Nodes: ' + str(nodes))
+    print('Time: ' + str(round(elapsed, 3)) + 's (' + str(int(nodes / elapsed) if elapsed > 0 else 0) + ' nps)')
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
\ No newline at end of file
@@ -0,0 +1,493 @@
+import argparse
+import itertools
+import mmap
+import os
+import time
+import ChessEngine
+from ChessEngine import pawn, knight, bishop, rook, queen, king, pawnAttacks, pieceAttacks, line
+
+#endgame tables: the exact result of every position of an ending with a few pieces, worked out backwards from the mates
+#(retrograde analysis) by generateTable and looked up with Tablebases.probe. one file per material, e.g. KQvKR.tb, with
+#one byte per position: 0 is a draw, d + 1 means the side to move mates (d odd) or is mated (d even) in d plies with best
+#play, 255 an illegal position. white to move comes first, then black to move
+#a table's pieces are the white king, the black king, then white's other pieces and black's in the order of valueOrder.
+#the white king is kept on files a-d by mirroring the board, so the index is
+#((king square on files a-d) * 64 + black king) * 64 + next piece ... for each side to move
+#positions with castling rights are never looked up. en passant is ignored, which only matters when both sides have
+#pawns, so KPvKP is not built
+pieceLetters = 'PNBRQK'
+valueOrder = (queen, rook, bishop, knight, pawn)
+drawValue = 0
+unresolved = 254 #only while generating
+invalid = 255
+maxPieces = 4
+
+def sideKey(types):
+    #which side is stronger: more pieces, then the more valuable ones. the stronger side is white in the table
+    return len(types), sorted((ChessEngine.exchangeValues[kind] for kind in types), reverse=True)
+
+def tableName(whiteTypes, blackTypes):
+    return 'K' + ''.join(pieceLetters[kind] for kind in whiteTypes) + 'vK' + ''.join(pieceLetters[kind] for kind in blackTypes)
+
+def parseName(name):
+    #'KQvKR' -> ([queen], [rook])
+    white, black = name.upper().split('V')
+    if white[:1] != 'K' or black[:1] != 'K':
+        raise ValueError(name + ' is not a table name like KQvKR')
+    return [sortTypes(pieceLetters.index(letter) for letter in white[1:]), sortTypes(pieceLetters.index(letter) for letter in black[1:])]
+
+def sortTypes(types):
+    return sorted(types, key=valueOrder.index)
+
+def canonicalName(whiteTypes, blackTypes):
+    #(name, colors swapped) of the table that holds positions with this material
+    whiteTypes = sortTypes(whiteTypes)
+    blackTypes = sortTypes(blackTypes)
+    if sideKey(whiteTypes) < sideKey(blackTypes):
+        return tableName(blackTypes, whiteTypes), True
+    return tableName(whiteTypes, blackTypes), False
+
+def tablePieces(name):
+    #piece indices in table order
+    whiteTypes, blackTypes = parseName(name)
+    return [king, 6 + king] + whiteTypes + [6 + kind for kind in blackTypes]
+
+def tableSize(pieceCount):
+    #positions per side to move
+    return 32 * 64 ** (pieceCount - 1)
+
+def positionIndex(squares, blackToMove, size):
+    if squares[0] & 7 > 3: #mirror the board so the white king is on files a-d
+        squares = [sq ^ 7 for sq in squares]
+    index = (squares[0] >> 3) * 4 + (squares[0] & 7)
+    for sq in squares[1:]:
+        index = index * 64 + sq
+    return index + size if blackToMove else index
+
+def positionSquares(index, pieceCount, size):
+    #(squares, black to move) of an index
+    blackToMove = index >= size
+    if blackToMove:
+        index -= size
+    squares = [0] * pieceCount
+    for i in range(pieceCount - 1, 0, -1):
+        index, squares[i] = divmod(index, 64)
+    squares[0] = (index >> 2) * 8 + (index & 3)
+    return squares, blackToMove
+
+def dependencies(name):
+    #tables a capture or a promotion leads to, KvK (always a draw) left out
+    whiteTypes, blackTypes = parseName(name)
+    names = set()
+    for ours, theirs, white in ((whiteTypes, blackTypes, True), (blackTypes, whiteTypes, False)):
+        for i, kind in enumerate(ours):
+            rest = ours[:i] + ours[i + 1:]
+            changes = [rest] #captured
+            if kind == pawn:
+                changes += [rest + [promotion] for promotion in (queen, rook, bishop, knight)]
+            for changed in changes:
+                if changed or theirs:
+                    names.add(canonicalName(changed, theirs)[0] if white else canonicalName(theirs, changed)[0])
+    return sorted(names)
+
+def allTables(pieces=maxPieces):
+    #names of every table up to this many pieces, in an order where each table's dependencies come before it
+    names = set()
+    for count in range(1, pieces - 1):
+        for types in itertools.combinations_with_replacement(valueOrder, count):
+            for split in range(count + 1):
+                for whiteTypes in set(itertools.combinations(types, split)):
+                    blackTypes = list(types)
+                    for kind in whiteTypes:
+                        blackTypes.remove(kind)
+                    names.add(canonicalName(list(whiteTypes), blackTypes)[0])
+    names.discard('KPvKP')
+    return sorted(names, key=lambda name: (len(name), name.count('P'), name))
+
+
+class Tablebases():
+    #the tables in a directory, each memory mapped the first time a position of its material is looked up
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {} #name -> (mmap, size) or None when there is no such file
+        self.layouts = {} #pieces of a position -> (table, colors swapped, order of the squares in the table's index)
+        self.pieces = 0 #most pieces of any table in the directory
+        if os.path.isdir(directory):
+            for fileName in os.listdir(directory):
+                if fileName.endswith('.tb'):
+                    try:
+                        self.pieces = max(self.pieces, len(tablePieces(fileName[:-3])))
+                    except ValueError: #not one of our tables
+                        pass
+
+    def table(self, name):
+        if name not in self.tables:
+            path = os.path.join(self.directory, name + '.tb')
+            self.tables[name] = None
+            if os.path.isfile(path):
+                with open(path, 'rb') as tableFile:
+                    count = len(tablePieces(name))
+                    size = tableSize(count)
+                    if os.fstat(tableFile.fileno()).st_size == 2 * size:
+                        self.tables[name] = (mmap.mmap(tableFile.fileno(), 0, access=mmap.ACCESS_READ), size)
+        return self.tables[name]
+
+    def probeValue(self, pieces, squares, blackToMove):
+        #table byte of a position given as parallel lists of piece indices (kings included) and squares,
+        #from the point of view of the side to move. None if its table isn't there
+        if len(pieces) == 2:
+            return drawValue
+        layout = self.layouts.get(tuple(pieces))
+        if layout is None:
+            layout = self.layout(pieces)
+        table, swap, order = layout
+        if table is None:
+            return None
+        if swap: #black has the white pieces of the table: turn the board around and let the other side move
+            return table[0][positionIndex([squares[j] ^ 56 for j in order], not blackToMove, table[1])]
+        return table[0][positionIndex([squares[j] for j in order], blackToMove, table[1])]
+
+    def layout(self, pieces):
+        whiteTypes = [piece for piece in pieces if piece < 6 and piece != king]
+        blackTypes = [piece - 6 for piece in pieces if piece >= 6 and piece != 6 + king]
+        name, swap = canonicalName(whiteTypes, blackTypes)
+        order = []
+        for piece in tablePieces(name):
+            if swap:
+                piece = piece - 6 if piece >= 6 else piece + 6
+            order.append(next(j for j in range(len(pieces)) if pieces[j] == piece and j not in order))
+        layout = (self.table(name), swap, order)
+        if layout[0] is not None: #a missing table may still be generated
+            self.layouts[tuple(pieces)] = layout
+        return layout
+
+    def probe(self, gs):
+        #(result, plies to mate) for the side to move: (1, n) wins, (-1, n) loses, (0, 0) is a draw. None when the position
+        #has more pieces than the tables, castling rights, or no table
+        if gs.castleRights:
+            return None
+        pieces = []
+        squares = []
+        for piece in range(12):
+            bb = gs.bitboards[piece]
+            while bb:
+                bit = bb & -bb
+                bb ^= bit
+                pieces.append(piece)
+                squares.append(bit.bit_length() - 1)
+        if len(pieces) > self.pieces:
+            return None
+        value = self.probeValue(pieces, squares, not gs.whiteToMove)
+        if value is None or value == invalid:
+            return None
+        return toResult(value)
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table[0].close()
+        self.tables = {}
+
+
+def toResult(value):
+    if value == drawValue:
+        return 0, 0
+    return (1 if (value - 1) % 2 else -1), value - 1
+
+def resultOrder(value):
+    #larger is better for the side to move: the fastest win, then a draw, then the slowest loss
+    if value == drawValue:
+        return 0
+    return 1000 - value if (value - 1) % 2 else value - 1000
+
+def attacked(sq, color, pieces, squares, occupied, captured=-1):
+    #whether a piece of color (other than the one at index captured) attacks sq
+    bit = 1 << sq
+    for j, piece in enumerate(pieces):
+        if j == captured or piece // 6 != color:
+            continue
+        kind = piece % 6
+        if kind == pawn:
+            if pawnAttacks[color][squares[j]] & bit:
+                return True
+        elif pieceAttacks(kind, squares[j], occupied) & bit:
+            return True
+    return False
+
+def tableMoves(pieces, squares, color):
+    #legal moves of color as (piece index, to square, promotion type or 0, index of the captured piece or -1)
+    occupied = 0
+    own = 0
+    sliders = 0 #the enemy bishops, rooks and queens, the only pieces that can pin
+    for j, piece in enumerate(pieces):
+        bit = 1 << squares[j]
+        occupied |= bit
+        if piece // 6 == color:
+            own |= bit
+        elif bishop <= piece % 6 <= queen:
+            sliders |= bit
+    kingSq = squares[pieces.index(6 * color + king)]
+    #squares the enemy attacks with our king off the board, so it can't step back along a slider's line
+    danger = 0
+    for j, piece in enumerate(pieces):
+        if piece // 6 != color:
+            if piece % 6 == pawn:
+                danger |= pawnAttacks[1 - color][squares[j]]
+            else:
+                danger |= pieceAttacks(piece % 6, squares[j], occupied ^ (1 << kingSq))
+    inCheck = danger >> kingSq & 1
+    moves = []
+    for j, piece in enumerate(pieces):
+        if piece // 6 != color:
+            continue
+        sq = squares[j]
+        kind = piece % 6
+        if kind == pawn:
+            step = -8 if color == 0 else 8
+            targets = pawnAttacks[color][sq] & occupied & ~own
+            ahead = sq + step
+            if not occupied >> ahead & 1:
+                targets |= 1 << ahead
+                startRow = 6 if color == 0 else 1
+                if sq >> 3 == startRow and not occupied >> (ahead + step) & 1:
+                    targets |= 1 << (ahead + step)
+        else:
+            targets = pieceAttacks(kind, sq, occupied) & ~own
+            if kind == king:
+                targets &= ~danger
+        #any other piece can only uncover the king when it is in check already or stands on a line from it to a slider
+        exposes = kind != king and (inCheck or line[kingSq][sq] & sliders)
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            to = bit.bit_length() - 1
+            capturedIndex = -1
+            if occupied & bit:
+                capturedIndex = squares.index(to)
+            if exposes:
+                moved = list(squares)
+                moved[j] = to
+                if attacked(kingSq, 1 - color, pieces, moved, (occupied ^ (1 << sq)) | bit, capturedIndex):
+                    continue
+            if kind == pawn and (to >> 3 == 0 or to >> 3 == 7):
+                for promotion in (queen, rook, bishop, knight):
+                    moves.append((j, to, promotion, capturedIndex))
+            else:
+                moves.append((j, to, 0, capturedIndex))
+    return moves
+
+def tableUnmoves(pieces, squares, color):
+    #squares of the positions color could have reached this one from without a capture or a promotion
+    occupied = 0
+    for sq in squares:
+        occupied |= 1 << sq
+    for j, piece in enumerate(pieces):
+        if piece // 6 != color:
+            continue
+        sq = squares[j]
+        kind = piece % 6
+        if kind == pawn:
+            back = 8 if color == 0 else -8
+            origin = sq + back
+            if 1 <= origin >> 3 <= 6 and not occupied >> origin & 1:
+                targets = 1 << origin
+                if sq >> 3 == (4 if color == 0 else 3) and not occupied >> (origin + back) & 1:
+                    targets |= 1 << (origin + back)
+            else:
+                targets = 0
+        else:
+            targets = pieceAttacks(kind, sq, occupied) & ~occupied
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            before = list(squares)
+            before[j] = bit.bit_length() - 1
+            yield before
+
+def legalPosition(pieces, squares, blackToMove):
+    if len(set(squares)) != len(squares):
+        return False
+    for j, piece in enumerate(pieces):
+        if piece % 6 == pawn and (squares[j] >> 3 == 0 or squares[j] >> 3 == 7):
+            return False
+    occupied = 0
+    for sq in squares:
+        occupied |= 1 << sq
+    waiting = 0 if blackToMove else 1 #the side that just moved can't be in check
+    return not attacked(squares[pieces.index(6 * waiting + king)], 1 - waiting, pieces, squares, occupied)
+
+def generateTable(name, directory, tablebases=None, verbose=True):
+    #works out every position of one ending and writes directory/name.tb. the tables captures and promotions lead to have
+    #to be there already (see buildTables). pure Python: the 3 piece tables take seconds, the 4 piece ones many minutes
+    whiteTypes, blackTypes = parseName(name)
+    name = tableName(whiteTypes, blackTypes)
+    if name != canonicalName(whiteTypes, blackTypes)[0]:
+        raise ValueError(name + ' is stored as ' + canonicalName(whiteTypes, blackTypes)[0])
+    if pawn in whiteTypes and pawn in blackTypes:
+        raise ValueError(name + ': en passant is not represented, tables with pawns on both sides are not supported')
+    if tablebases is None:
+        tablebases = Tablebases(directory)
+    pieces = tablePieces(name)
+    count = len(pieces)
+    size = tableSize(count)
+    start = time.perf_counter()
+    values = bytearray([invalid]) * (2 * size)
+    moveCounts = bytearray(2 * size) #moves within the table whose result isn't known yet
+    exits = bytearray([invalid]) * (2 * size) #best result of the captures and promotions for the side to move
+    pending = {} #plies -> positions whose result comes from a capture or promotion at that distance
+    frontier = [] #positions resolved at the current distance
+    for kingSq in range(64):
+        if kingSq & 7 > 3:
+            continue
+        for others in itertools.product(range(64), repeat=count - 1):
+            squares = [kingSq] + list(others)
+            for blackToMove in (False, True):
+                if not legalPosition(pieces, squares, blackToMove):
+                    continue
+                index = positionIndex(squares, blackToMove, size)
+                color = 1 if blackToMove else 0
+                moves = tableMoves(pieces, squares, color)
+                if not moves:
+                    occupied = 0
+                    for sq in squares:
+                        occupied |= 1 << sq
+                    if attacked(squares[pieces.index(6 * color + king)], 1 - color, pieces, squares, occupied):
+                        values[index] = 1 #mated
+                        frontier.append(index)
+                    else:
+                        values[index] = drawValue #stalemate
+                    continue
+                inside = 0
+                best = invalid
+                for j, to, promotion, capturedIndex in moves:
+                    if not promotion and capturedIndex < 0:
+                        inside += 1
+                        continue
+                    childPieces = list(pieces)
+                    childSquares = list(squares)
+                    childSquares[j] = to
+                    if promotion:
+                        childPieces[j] = 6 * color + promotion
+                    if capturedIndex >= 0:
+                        del childPieces[capturedIndex]
+                        del childSquares[capturedIndex]
+                    child = tablebases.probeValue(childPieces, childSquares, not blackToMove)
+                    if child is None:
+                        raise ValueError(name + ' needs the table of ' + canonicalName(
+                                [piece for piece in childPieces if piece < 5], [piece - 6 for piece in childPieces if 6 <= piece < 11])[0])
+                    value = drawValue if child == drawValue else child + 1 #the child's result one ply further, for us
+                    if best == invalid or resultOrder(value) > resultOrder(best):
+                        best = value
+                values[index] = unresolved
+                moveCounts[index] = inside
+                exits[index] = best
+                if best != invalid and best != drawValue and (best - 1) % 2: #a capture or promotion wins
+                    pending.setdefault(best - 1, []).append(index)
+                elif inside == 0 and best != drawValue: #every move is a losing capture or promotion
+                    pending.setdefault(best - 1, []).append(index)
+    if verbose:
+        print(name + ': positions set up in ' + str(round(time.perf_counter() - start, 1)) + 's')
+
+    #positions lost in n plies make the positions before them wins in n + 1, positions won in n plies take a move away
+    #from the positions before them, which are lost once they have no other move left
+    plies = 0
+    while frontier or any(distance > plies for distance in pending):
+        following = []
+        for index in frontier:
+            squares, blackToMove = positionSquares(index, count, size)
+            lost = plies % 2 == 0
+            mover = 0 if blackToMove else 1
+            for before in tableUnmoves(pieces, squares, mover):
+                previous = positionIndex(before, not blackToMove, size)
+                if values[previous] != unresolved:
+                    continue
+                if lost:
+                    values[previous] = plies + 2
+                    following.append(previous)
+                else:
+                    moveCounts[previous] -= 1
+                    if moveCounts[previous] == 0:
+                        best = exits[previous]
+                        if best == invalid or (best != drawValue and (best - 1) % 2 == 0): #no way out but a loss
+                            if best == invalid or best - 1 <= plies + 1:
+                                values[previous] = plies + 2
+                                following.append(previous)
+                            else:
+                                pending.setdefault(best - 1, []).append(previous)
+        plies += 1
+        for index in pending.pop(plies, ()):
+            if values[index] == unresolved:
+                values[index] = plies + 1
+                following.append(index)
+        frontier = following
+        if verbose and frontier:
+            print(name + ': ' + str(len(frontier)) + ' positions at ' + str(plies) + ' plies')
+    for index in range(2 * size):
+        if values[index] == unresolved: #neither side can force mate
+            values[index] = drawValue
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + '.tb')
+    with open(path + '.part', 'wb') as tableFile: #a table cut short doesn't get the real name
+        tableFile.write(values)
+    os.replace(path + '.part', path)
+    if verbose:
+        print(name + ': written to ' + path + ' in ' + str(round(time.perf_counter() - start, 1)) + 's')
+    return path
+
+def buildTables(names, directory, verbose=True):
+    #generates the tables and, first, the ones they depend on, skipping those already in the directory
+    tablebases = Tablebases(directory)
+    built = []
+    def build(name):
+        name = canonicalName(*parseName(name))[0]
+        if tablebases.table(name) is not None:
+            return
+        for dependency in dependencies(name):
+            build(dependency)
+        generateTable(name, directory, tablebases, verbose)
+        tablebases.tables.pop(name, None) #map the new file on the next lookup
+        built.append(name)
+    for name in names:
+        build(name)
+    return built
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate endgame tables and look positions up in them')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='generate tables (and the tables they need)')
+    build.add_argument('tables', nargs='*', help='names like KQvKR (default: every table up to --pieces pieces)')
+    build.add_argument('--pieces', type=int, default=3, help='with no names, build every table with this many pieces or fewer')
+    build.add_argument('--directory', default='tablebases')
+    probe = commands.add_parser('probe', help='print the result of a position and of every move in it')
+    probe.add_argument('fen')
+    probe.add_argument('--directory', default='tablebases')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if args.pieces > maxPieces:
+            parser.error('tables have at most ' + str(maxPieces) + ' pieces')
+        buildTables(args.tables or allTables(args.pieces), args.directory)
+        return 0
+    tablebases = Tablebases(args.directory)
+    gs = ChessEngine.GameState(args.fen)
+    result = tablebases.probe(gs)
+    if result is None:
+        print('Not in the tables')
+        return 1
+    print(describe(result))
+    for move in gs.getValidMoves():
+        san = gs.toSAN(move)
+        gs.makeMove(move)
+        child = tablebases.probe(gs)
+        gs.undoMove()
+        print(san + ': ' + (describe((-child[0], child[1] + 1)) if child else '?'))
+    tablebases.close()
+    return 0
+
+def describe(result):
+    if result[0] == 0:
+        return 'draw'
+    return ('win' if result[0] > 0 else 'loss') + ' in ' + str(result[1]) + ' plies'
+
+if __name__ == "__main__":
+    raise SystemExit(main())
\ No newline at end of file
@@ -0,0 +1,555 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import shutil
+import subprocess
+import sys
+import threading
+from collections import OrderedDict
+import ChessEngine
+
+#talks to UCI chess engines (Stockfish or any other local binary that speaks UCI) as asyncio subprocesses.
+#engines are only started the first time they are needed, kept warm in a pool between games and restarted when they crash
+defaultEngines = ("stockfish", "Chess/stockfish13.exe", "Chess/stockfish", "stockfish13.exe")
+startTimeout = 10.0 #seconds an engine gets to answer uci and isready
+searchMargin = 5.0 #seconds on top of a movetime before an engine that hasn't answered go counts as hung
+searchTimeout = 60.0 #seconds a depth or nodes search gets before it is stopped
+
+class EngineError(Exception):
+    pass
+
+def findEngine(path=None):
+    #command line for the engine: the given path, $STOCKFISH_PATH, or the first stockfish that can be found
+    if isinstance(path, (list, tuple)):
+        return list(path)
+    candidates = [path] if path else [os.environ.get("STOCKFISH_PATH")] + list(defaultEngines)
+    for candidate in candidates:
+        if candidate:
+            found = shutil.which(candidate) or (candidate if os.path.isfile(candidate) else None)
+            if found:
+                return [found]
+    raise EngineError('no UCI engine found, install stockfish or set STOCKFISH_PATH to its path')
+
+def positionCommand(moves=(), fen=None):
+    command = 'position ' + ('fen ' + fen if fen else 'startpos')
+    if moves:
+        command += ' moves ' + ' '.join(moves)
+    return command
+
+def goCommand(movetime=None, depth=None, nodes=None):
+    command = 'go'
+    if depth is not None:
+        command += ' depth ' + str(depth)
+    if nodes is not None:
+        command += ' nodes ' + str(nodes)
+    if movetime is not None:
+        command += ' movetime ' + str(int(movetime * 1000))
+    if command == 'go':
+        command += ' depth 15' #same default as the stockfish package used to have
+    return command
+
+def playUCIMove(gs, uci):
+    #plays a move given in long algebraic notation, returns False if it isn't legal in the position
+    for move in gs.generateMoves([]):
+        if gs.buildMove(move).getLastMovement() == uci:
+            gs.makeMove(move)
+            return True
+    return False
+
+
+class EngineResult():
+    #what the engine said about a position: its move and the last principal variation it reported
+    def __init__(self):
+        self.bestMove = None #long algebraic like e2e4 or e7e8q, None if the engine had no move (mate or stalemate)
+        self.ponder = None
+        self.score = None #centipawns from the point of view of the side to move, None when the score is a mate
+        self.mate = None #moves to mate, negative when the side to move gets mated
+        self.depth = 0
+        self.nodes = 0
+        self.pv = []
+
+    def parseInfo(self, line):
+        tokens = line.split()
+        if 'pv' not in tokens or 'multipv' in tokens and tokens[tokens.index('multipv') + 1] != '1':
+            return
+        i = 1
+        while i < len(tokens):
+            token = tokens[i]
+            if token == 'depth':
+                self.depth = int(tokens[i+1])
+            elif token == 'nodes':
+                self.nodes = int(tokens[i+1])
+            elif token == 'score':
+                if tokens[i+1] == 'cp':
+                    self.score = int(tokens[i+2])
+                    self.mate = None
+                else:
+                    self.mate = int(tokens[i+2])
+                    self.score = None
+                i += 1
+            elif token == 'pv':
+                self.pv = tokens[i+1:]
+                break
+            i += 1
+
+    def __repr__(self):
+        score = 'mate ' + str(self.mate) if self.mate is not None else str(self.score)
+        return 'EngineResult(bestMove=' + str(self.bestMove) + ', score=' + score + ', depth=' + str(self.depth) + ')'
+
+
+def engineKey(key, command, options):
+    #the cache key of a position for one engine set up one way: the zobrist key mixed with a hash of the engine's command
+    #line and options, so a different engine or different settings never get another one's results
+    setup = ' '.join(command) + '\0' + '\0'.join(name + '=' + str(value) for name, value in sorted(options.items()))
+    return key ^ int.from_bytes(hashlib.blake2b(setup.encode(), digest_size=8).digest(), 'big')
+
+
+class AnalysisCache():
+    #engine results by position and engine setup (engineKey) so positions seen before (after an undo, in a repeated
+    #opening) don't go back to the engine. the least recently used results are dropped first. given a path the results also go to a SQLite
+    #file that outlives the program, results only found there are brought back into memory when asked for
+    def __init__(self, size=10000, path=None):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.database = None
+        self.lock = threading.Lock() #the GUI thread and the engine thread can both get here
+        if path:
+            self.database = sqlite3.connect(path, check_same_thread=False)
+            self.database.execute('CREATE TABLE IF NOT EXISTS analysis (key INTEGER PRIMARY KEY, depth INTEGER, bestMove TEXT, '
+                                    'ponder TEXT, score INTEGER, mate INTEGER, nodes INTEGER, pv TEXT)')
+            self.database.commit()
+
+    def get(self, key, depth=0):
+        #the stored result if it was searched at least depth deep, otherwise None
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None and self.database is not None:
+                row = self.database.execute('SELECT depth, bestMove, ponder, score, mate, nodes, pv FROM analysis WHERE key = ?',
+                                            (key - (1 << 63),)).fetchone() #sqlite integers are signed
+                if row is not None:
+                    result = EngineResult()
+                    result.depth, result.bestMove, result.ponder, result.score, result.mate, result.nodes, pv = row
+                    result.pv = pv.split()
+                    self.remember(key, result)
+            if result is None or result.depth < depth:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        #keeps the deeper of the stored and the new result, in memory and in the file (which may know a deeper one that
+        #memory has forgotten)
+        with self.lock:
+            stored = self.entries.get(key)
+            if stored is not None and stored.depth > result.depth:
+                return
+            if self.database is not None:
+                cursor = self.database.execute('INSERT INTO analysis VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET '
+                                                'depth = excluded.depth, bestMove = excluded.bestMove, ponder = excluded.ponder, '
+                                                'score = excluded.score, mate = excluded.mate, nodes = excluded.nodes, pv = excluded.pv '
+                                                'WHERE excluded.depth >= analysis.depth', (key - (1 << 63), result.depth, result.bestMove,
+                                                result.ponder, result.score, result.mate, result.nodes, ' '.join(result.pv)))
+                self.database.commit()
+                if cursor.rowcount == 0: #the file has a deeper result, get() brings that one back
+                    self.entries.pop(key, None)
+                    return
+            self.remember(key, result)
+
+    def remember(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def close(self):
+        if self.database is not None:
+            self.database.close()
+            self.database = None
+
+
+class UCIEngine():
+    #one engine process. all the coroutines have to run on the same event loop
+    def __init__(self, command, options=None, cache=None):
+        self.command = list(command)
+        self.options = dict(options or {}) #UCI options, sent again after a restart
+        self.cache = cache #AnalysisCache shared with the rest of the pool, or None
+        self.process = None
+        self.name = ''
+        self.restarts = 0
+        self.searches = 0
+        #the game the engine was last told about, so the next position only costs what changed. None after a (re)start
+        self.gameFEN = None
+        self.gameMoves = None
+        self.mirror = None #GameState after gameMoves, None if the game's FEN couldn't be set up
+        self.anchor = (0, None) #(moves played, FEN) just after the last irreversible move of the game
+        self.newGamePending = False #the game changed, send ucinewgame before the next position
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        try:
+            self.process = await asyncio.create_subprocess_exec(*self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                                    stderr=subprocess.DEVNULL)
+        except OSError as error:
+            raise EngineError('could not start ' + ' '.join(self.command) + ': ' + str(error))
+        self.gameMoves = None
+        self.newGamePending = False
+        await self.send('uci')
+        for line in await self.readUntil('uciok', startTimeout):
+            if line.startswith('id name '):
+                self.name = line[8:]
+        for name, value in self.options.items():
+            await self.send('setoption name ' + name + ' value ' + str(value))
+        await self.isReady(startTimeout)
+
+    async def stop(self):
+        if self.process is None:
+            return
+        if self.running:
+            try:
+                await self.send('quit')
+                await asyncio.wait_for(self.process.wait(), 1.0)
+            except (OSError, asyncio.TimeoutError):
+                self.process.kill()
+                await self.process.wait()
+        self.process = None
+
+    async def restart(self):
+        if self.process is not None and self.running:
+            self.process.kill()
+            await self.process.wait()
+        self.process = None
+        self.restarts += 1
+        await self.start()
+
+    async def send(self, line):
+        if not self.running:
+            raise EngineError('engine is not running')
+        self.process.stdin.write((line + '\n').encode())
+        await self.process.stdin.drain()
+
+    async def readLine(self, timeout=None):
+        line = await asyncio.wait_for(self.process.stdout.readline(), timeout)
+        if not line:
+            raise EngineError('engine exited')
+        return line.decode(errors='replace').strip()
+
+    async def readUntil(self, prefix, timeout=None):
+        #every line up to and including the first one starting with prefix
+        lines = []
+        while True:
+            line = await self.readLine(timeout)
+            lines.append(line)
+            if line.startswith(prefix):
+                return lines
+
+    async def isReady(self, timeout=startTimeout):
+        await self.send('isready')
+        await self.readUntil('readyok', timeout)
+
+    async def setOption(self, name, value):
+        self.options[name] = value
+        if self.running:
+            await self.send('setoption name ' + name + ' value ' + str(value))
+            await self.isReady()
+
+    async def newGame(self):
+        await self.call(self.sendNewGame)
+        self.gameMoves = None
+
+    async def sendNewGame(self):
+        await self.send('ucinewgame')
+        await self.isReady()
+
+    def sameGame(self, moves, fen=None):
+        #whether moves continue (or take back moves of) the game the engine already knows
+        known = self.gameMoves
+        return known is not None and fen == self.gameFEN and (moves[:len(known)] == known or known[:len(moves)] == moves)
+
+    def updateGame(self, moves, fen=None):
+        #position command for a position, and the engine's game moves on to it
+        #positions before a capture, pawn move or change of castling rights can never come back, so the game is sent as
+        #the FEN just after the last such move plus the moves since. that keeps every position command short while the
+        #engine still sees every move it needs for repetitions and the fifty move rule
+        moves = list(moves)
+        sameGame = self.sameGame(moves, fen)
+        if self.gameMoves is not None and not sameGame:
+            self.newGamePending = True
+        if sameGame and len(moves) >= len(self.gameMoves) and (self.mirror is not None or fen is not None):
+            played = len(self.gameMoves)
+        else: #new game or moves taken back, replay from the start
+            try:
+                self.mirror = ChessEngine.GameState.fromFEN(fen) if fen is not None else ChessEngine.GameState()
+            except ValueError: #the engine still gets the game, just not shortened
+                self.mirror = None
+            self.anchor = (0, None)
+            played = 0
+        gs = self.mirror
+        if gs is not None:
+            for i in range(played, len(moves)):
+                if not playUCIMove(gs, moves[i]):
+                    self.mirror = gs = None
+                    self.anchor = (0, None)
+                    break
+                move, piece, captured, rights, epSquare = gs.history[-1]
+                if piece % 6 == ChessEngine.pawn or captured != ChessEngine.empty or gs.castleRights != rights:
+                    self.anchor = (i + 1, gs.toFEN())
+        self.gameFEN = fen
+        self.gameMoves = moves
+        played, anchorFEN = self.anchor
+        if gs is not None and anchorFEN is not None:
+            return positionCommand(moves[played:], anchorFEN)
+        return positionCommand(moves, fen)
+
+    async def sendPosition(self, moves, fen):
+        command = self.updateGame(moves, fen)
+        if self.newGamePending: #a different game, the engine's hash table is no use for it
+            await self.send('ucinewgame')
+            self.newGamePending = False
+        await self.send(command)
+
+    async def analyse(self, moves=(), fen=None, movetime=None, depth=None, nodes=None):
+        #searches the position reached from fen (or the start position) by the moves in long algebraic notation
+        #a depth search of a position the cache has seen at least that deep is answered without asking the engine
+        key = None
+        if self.cache is not None:
+            self.updateGame(moves, fen)
+            if self.mirror is not None:
+                key = engineKey(self.mirror.zobristKey, self.command, self.options)
+                if depth is not None and movetime is None and nodes is None:
+                    result = self.cache.get(key, depth)
+                    if result is not None:
+                        return result
+        result = await self.call(self.search, moves, fen, movetime, depth, nodes)
+        if key is not None:
+            self.cache.put(key, result)
+        return result
+
+    async def search(self, moves, fen, movetime, depth, nodes):
+        await self.sendPosition(moves, fen)
+        await self.send(goCommand(movetime, depth, nodes))
+        result = EngineResult()
+        lines = []
+        async def read():
+            while not lines or not lines[-1].startswith('bestmove'):
+                lines.append(await self.readLine())
+        try:
+            await asyncio.wait_for(read(), movetime + searchMargin if movetime is not None else searchTimeout)
+        except asyncio.TimeoutError: #stopped, the best move so far is the answer. an engine that ignores stop is killed by call
+            await self.send('stop')
+            await asyncio.wait_for(read(), searchMargin)
+        for line in lines:
+            if line.startswith('info '):
+                result.parseInfo(line)
+        tokens = line.split()
+        if len(tokens) > 1 and tokens[1] not in ('(none)', '0000'):
+            result.bestMove = tokens[1]
+        if len(tokens) > 3 and tokens[2] == 'ponder':
+            result.ponder = tokens[3]
+        self.searches += 1
+        return result
+
+    async def display(self, moves=(), fen=None):
+        #the engine's own picture of a position (the 'd' command Stockfish understands), as a list of lines
+        async def show():
+            await self.sendPosition(moves, fen)
+            await self.send('d')
+            return await self.readUntil('Checkers', startTimeout)
+        return await self.call(show)
+
+    async def call(self, function, *args):
+        #runs function with the engine started, restarting it once if it turns out to have crashed or hung. a second
+        #failure is raised as an EngineError, the only error callers have to handle
+        for attempt in range(2):
+            try:
+                if not self.running:
+                    if self.process is None:
+                        await self.start()
+                    else:
+                        await self.restart()
+                return await function(*args)
+            except (EngineError, OSError, asyncio.TimeoutError) as error:
+                if self.running: #hung rather than crashed, the next call starts a fresh process
+                    self.process.kill()
+                    await self.process.wait()
+                if attempt == 1:
+                    if isinstance(error, EngineError):
+                        raise
+                    if isinstance(error, asyncio.TimeoutError):
+                        raise EngineError(' '.join(self.command) + ' did not answer in time') from error
+                    raise EngineError(' '.join(self.command) + ': ' + str(error)) from error
+
+
+class EnginePool():
+    #a number of engine processes that concurrent games can borrow. engines are started when first borrowed and stay warm
+    #after being handed back, so the next game doesn't wait for the engine to load again
+    def __init__(self, command=None, size=1, options=None, cache=None):
+        self.command = command
+        self.size = size
+        self.options = dict(options or {})
+        self.cache = cache
+        self.idle = []
+        self.engines = []
+        self.slots = None #created on the event loop the pool is used from
+
+    async def acquire(self, moves=(), fen=None):
+        #an idle engine that already knows the game if there is one, so it only needs the new moves
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.size)
+        await self.slots.acquire()
+        if self.idle:
+            engine = self.idle[-1]
+            for candidate in self.idle:
+                if candidate.sameGame(list(moves), fen):
+                    engine = candidate
+                    break
+            self.idle.remove(engine)
+        else:
+            try:
+                engine = UCIEngine(findEngine(self.command), self.options, self.cache)
+            except EngineError:
+                self.slots.release()
+                raise
+            self.engines.append(engine)
+        try:
+            for name, value in self.options.items(): #options changed while the engine was idle
+                if engine.options.get(name) != value:
+                    await engine.call(engine.setOption, name, value)
+        except EngineError: #an engine that can't take the option is dropped, the next acquire starts a new one
+            self.engines.remove(engine)
+            self.slots.release()
+            await engine.stop()
+            raise
+        return engine
+
+    def release(self, engine):
+        self.idle.append(engine)
+        self.slots.release()
+
+    async def analyse(self, moves=(), fen=None, movetime=None, depth=None, nodes=None):
+        engine = await self.acquire(moves, fen)
+        try:
+            return await engine.analyse(moves, fen, movetime, depth, nodes)
+        finally:
+            self.release(engine)
+
+    async def display(self, moves=(), fen=None):
+        engine = await self.acquire(moves, fen)
+        try:
+            return await engine.display(moves, fen)
+        finally:
+            self.release(engine)
+
+    async def setOption(self, name, value):
+        #applied to idle engines the next time they are borrowed
+        self.options[name] = value
+
+    async def close(self):
+        for engine in self.engines:
+            await engine.stop()
+        self.engines = []
+        self.idle = []
+
+
+class EngineManager():
+    #runs an EnginePool on an event loop in a background thread so callers that are not async (the pygame loop) never
+    #block on the engine. every method returns a concurrent.futures.Future, poll done() or wait on result()
+    def __init__(self, command=None, size=1, options=None, cache=None):
+        self.pool = EnginePool(command, size, options, cache)
+        self.loop = None
+        self.thread = None
+
+    def submit(self, coroutine):
+        if self.thread is None:
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name='uci engines', daemon=True)
+            self.thread.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def analyse(self, moves=(), fen=None, movetime=None, depth=None, nodes=None):
+        return self.submit(self.pool.analyse(list(moves), fen, movetime, depth, nodes))
+
+    def display(self, moves=(), fen=None):
+        return self.submit(self.pool.display(list(moves), fen))
+
+    def setOption(self, name, value):
+        return self.submit(self.pool.setOption(name, value))
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.submit(self.pool.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+        self.thread = None
+
+
+def fakeEngineCommand(replies=(), crashAfter=0):
+    #command line for a scripted stand-in engine, so code that drives engines can be tried without a real one
+    command = [sys.executable, os.path.abspath(__file__), '--fake']
+    if crashAfter:
+        command += ['--crash-after', str(crashAfter)]
+    return command + list(replies)
+
+def fakeEngine(replies=(), crashAfter=0):
+    #speaks just enough UCI on stdin/stdout: every go is answered with the next scripted reply, or the first legal move of
+    #the position once the script runs out. with crashAfter the process dies silently during that many'th search
+    replies = list(replies)
+    searches = 0
+    fen = None
+    moves = []
+    def position():
+        gs = ChessEngine.GameState.fromFEN(fen) if fen else ChessEngine.GameState()
+        for uci in moves:
+            playUCIMove(gs, uci)
+        return gs
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+        if command == 'uci':
+            print('id name FakeUCI')
+            print('id author scripted')
+            print('uciok')
+        elif command == 'isready':
+            print('readyok')
+        elif command == 'position':
+            end = tokens.index('moves') if 'moves' in tokens else len(tokens)
+            fen = ' '.join(tokens[2:end]) if tokens[1] == 'fen' else None
+            moves = tokens[end + 1:]
+        elif command == 'go':
+            searches += 1
+            if searches == crashAfter:
+                os._exit(1)
+            if replies:
+                move = replies.pop(0)
+            else:
+                validMoves = position().getValidMoves()
+                move = validMoves[0].getLastMovement() if validMoves else '(none)'
+            print('info depth 1 score cp 0 nodes 1 pv ' + move)
+            print('bestmove ' + move)
+        elif command == 'd':
+            print('Fen: ' + position().toFEN())
+            print('Checkers:')
+        elif command == 'quit':
+            break
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--fake']:
+        arguments = sys.argv[2:]
+        crashAfter = 0
+        if arguments[:1] == ['--crash-after']:
+            crashAfter = int(arguments[1])
+            arguments = arguments[2:]
+        fakeEngine(arguments, crashAfter)
\ No newline at end of file
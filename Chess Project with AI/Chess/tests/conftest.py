@@ -0,0 +1,5 @@
+import os
+import sys
+
+#the modules import each other by name (import ChessEngine), so the tests need the directory they live in on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
\ No newline at end of file
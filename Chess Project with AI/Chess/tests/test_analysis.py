@@ -0,0 +1,105 @@
+import asyncio
+import json
+import sys
+import pytest
+import ChessAnalysis
+import ChessUCI
+
+positions = ['rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+             'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1',
+             'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e6 0 2']
+
+#a UCI engine that dies on every search of the second position and answers e2e4 for the others
+crashOnSecond = [sys.executable, '-u', '-c', '''
+import os, sys
+fen = ''
+for line in sys.stdin:
+    if line.startswith('uci'):
+        print('uciok')
+    elif line.startswith('isready'):
+        print('readyok')
+    elif line.startswith('position'):
+        fen = line
+    elif line.startswith('go'):
+        if '4P3/8/PPPP1PPP/RNBQKBNR b' in fen:
+            os._exit(1)
+        print('bestmove e2e4')
+''']
+
+def writeEPD(path, fens):
+    path.write_text(''.join(fen.rsplit(' ', 2)[0] + ' id "p' + str(i) + '";\n' for i, fen in enumerate(fens)))
+    return str(path)
+
+def readIds(path):
+    return [json.loads(line)['id'] for line in open(path)]
+
+def testParseEPD():
+    fen, operations = ChessAnalysis.parseEPD('4k3/8/8/8/8/8/8/4K2R w K - bm O-O; id "castle test"; acd 3; hmvc 7;')
+    assert fen == '4k3/8/8/8/8/8/8/4K2R w K - 7 1'
+    assert operations == {'bm': ['O-O'], 'id': ['castle test'], 'acd': ['3'], 'hmvc': ['7']}
+    assert ChessAnalysis.positionLimits(operations, 10, None) == (3, None)
+    assert ChessAnalysis.parseEPD(positions[2]) == (positions[2], {})
+    with pytest.raises(ValueError):
+        ChessAnalysis.parseEPD('8/8/8 w')
+
+def testDropPartialLine(tmp_path):
+    path = tmp_path / 'out.jsonl'
+    for content, kept in ((b'{"id": 1}\n{"id": 2}\n{"id"', b'{"id": 1}\n{"id": 2}\n'),
+                          (b'{"id": 1}\n', b'{"id": 1}\n'),
+                          (b'{"id"', b''),
+                          (b'x' * 10000 + b'\n' + b'y' * 10000, b'x' * 10000 + b'\n')): #further back than one read
+        path.write_bytes(content)
+        ChessAnalysis.dropPartialLine(str(path))
+        assert path.read_bytes() == kept
+
+def testFinishedIds(tmp_path):
+    assert ChessAnalysis.finishedIds(str(tmp_path / 'missing.jsonl')) == set()
+    lines = tmp_path / 'out.jsonl'
+    lines.write_text('{"id": "a"}\n{"id": 2}\n{"id": "c')
+    assert ChessAnalysis.finishedIds(str(lines)) == {'a', '2'}
+    rows = tmp_path / 'out.csv'
+    rows.write_text('id,fen\na,x\nb,y\n')
+    assert ChessAnalysis.finishedIds(str(rows)) == {'a', 'b'}
+
+def testResume(tmp_path):
+    inputPath = writeEPD(tmp_path / 'in.epd', positions)
+    outputPath = str(tmp_path / 'out.jsonl')
+    ChessAnalysis.runAnalysis(inputPath, outputPath, backend='builtin', depth=1)
+    first = open(outputPath).readline()
+    with open(outputPath, 'w') as output: #stopped while writing the second record
+        output.write(first + '{"id": "p1", "fe')
+    stats = ChessAnalysis.runAnalysis(inputPath, outputPath, backend='builtin', depth=1, resume=True)
+    assert sum(positions for positions, nodes, seconds in stats.workers.values()) == 2
+    assert readIds(outputPath) == ['p0', 'p1', 'p2']
+
+def testMateDistance():
+    record = ChessAnalysis.analysePosition(('m1', '6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1', 2, None))
+    assert (record['san'], record['mate'], record['score']) == ('Ra8#', 1, None)
+    record = ChessAnalysis.analysePosition(('m0', 'R5k1/5ppp/8/8/8/8/8/6K1 b - - 0 1', 2, None))
+    assert (record['bestmove'], record['mate']) == (None, 0)
+
+def testBoundedQueue():
+    #reading the input waits for the engine: only the queue and the position in hand are read ahead of the results
+    read = []
+    aheadAtWrite = []
+    def tasks():
+        for i in range(20):
+            read.append(i)
+            yield ('p' + str(i), positions[0], 1, None)
+    def write(record):
+        aheadAtWrite.append(len(read) - len(aheadAtWrite))
+    asyncio.run(ChessAnalysis.analyseWithEngines(tasks(), ChessUCI.fakeEngineCommand(), 1, write))
+    assert len(aheadAtWrite) == 20
+    assert max(aheadAtWrite) <= ChessAnalysis.readAhead + 2
+
+def testFailedPositionIsSkipped(capsys):
+    records = []
+    tasks = [('p' + str(i), fen, 1, None) for i, fen in enumerate(positions)]
+    asyncio.run(ChessAnalysis.analyseWithEngines(iter(tasks), crashOnSecond, 1, records.append))
+    assert [record['id'] for record in records] == ['p0', 'p2']
+    assert 'p1: ' in capsys.readouterr().err
+
+def testEngineThatCannotStart():
+    with pytest.raises(ChessUCI.EngineError):
+        asyncio.run(ChessAnalysis.analyseWithEngines(iter([('p0', positions[0], 1, None)]), ['/nonexistent/engine'], 1,
+                                                     lambda record: None))
\ No newline at end of file
@@ -0,0 +1,87 @@
+import random
+import ChessAI
+import ChessBook
+import ChessEngine
+
+games = '''[Result "1-0"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bb5 1-0
+
+[Result "1/2-1/2"]
+
+1. e4 c5 2. Nf3 d6 1/2-1/2
+
+[Result "0-1"]
+
+1. d4 d5 2. c4 e6 0-1
+
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 Nf6 1-0
+
+[Result "1-0"]
+
+1. d4 Nf6 1-0
+'''
+
+def testPolyglotKeys():
+    #the reference keys from the Polyglot book format description
+    expected = [('', 0x463b96181691fc9c), ('e4', 0x823c9b50fd114196), ('e4 d5', 0x0756b94461c50fb0),
+                ('e4 d5 e5', 0x662fafb965db29d4), ('e4 d5 e5 f5', 0x22a48b5a8e47ff78), ('e4 d5 e5 f5 Ke2', 0x652a607ca3f242c1),
+                ('e4 d5 e5 f5 Ke2 Kf7', 0x00fdd303c946bdd9), ('a4 b5 h4 b4 c4', 0x3c8123ea7b067637),
+                ('a4 b5 h4 b4 c4 bxc3 Ra3', 0x5c3f9b829b279560)]
+    for sanMoves, key in expected:
+        gs = ChessEngine.GameState()
+        for san in sanMoves.split():
+            gs.makeMove(gs.parseSAN(san))
+        assert ChessBook.polyglotKey(gs) == key, sanMoves
+
+def testEncodeMove():
+    gs = ChessEngine.GameState('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1')
+    assert ChessBook.encodeMove(gs.parseSAN('O-O')) == 7 | 4 << 6 #the king takes its own rook, e1h1
+    assert ChessBook.encodeMove(gs.parseSAN('O-O-O')) == 0 | 4 << 6
+    gs = ChessEngine.GameState('4k3/P7/8/8/8/8/8/4K3 w - - 0 1')
+    assert ChessBook.encodeMove(gs.parseSAN('a8=N')) == 56 | 48 << 6 | 1 << 12
+
+def buildBook(tmp_path):
+    pgnPath = tmp_path / 'games.pgn'
+    pgnPath.write_text(games)
+    bookPath = str(tmp_path / 'book.bin')
+    ChessBook.buildBook([str(pgnPath)], bookPath, verbose=False)
+    return bookPath
+
+def testLookup(tmp_path):
+    book = ChessBook.OpeningBook(buildBook(tmp_path))
+    try:
+        gs = ChessEngine.GameState()
+        #a win counts 2 and a draw 1: e4 won twice and drew once, d4 won once and lost once
+        assert [(gs.toSAN(move), weight) for move, weight in book.moves(gs)] == [('e4', 5), ('d4', 2)]
+        gs.makeMove(gs.parseSAN('e4'))
+        #e5 only ever lost, so it is left out
+        assert [(gs.toSAN(move), weight) for move, weight in book.moves(gs)] == [('c5', 1)]
+        gs.makeMove(gs.parseSAN('a5'))
+        assert book.moves(gs) == []
+        assert book.pickMove(gs) == 0
+    finally:
+        book.close()
+
+def testWeightedPick(tmp_path):
+    book = ChessBook.OpeningBook(buildBook(tmp_path))
+    try:
+        gs = ChessEngine.GameState()
+        moves = dict(book.moves(gs))
+        rng = random.Random(1)
+        picks = [book.pickMove(gs, rng) for i in range(200)]
+        assert set(picks) == set(moves)
+        assert book.pickMove(gs, best=True) == max(moves, key=moves.get)
+    finally:
+        book.close()
+
+def testSearchPlaysFromTheBook(tmp_path, monkeypatch):
+    monkeypatch.setattr(ChessAI, 'bookPath', buildBook(tmp_path))
+    monkeypatch.setattr(ChessAI, 'openingBook', None)
+    gs = ChessEngine.GameState()
+    result = ChessAI.findBestMove(gs, gs.getValidMoves())
+    assert result.move.getLastMovement() in ('e2e4', 'd2d4')
+    assert result.depth == 0 #no search was needed
+    ChessAI.openingBook.close()
\ No newline at end of file
@@ -0,0 +1,43 @@
+import ChessUCI
+
+def result(depth, bestMove):
+    engineResult = ChessUCI.EngineResult()
+    engineResult.depth = depth
+    engineResult.bestMove = bestMove
+    engineResult.pv = [bestMove]
+    return engineResult
+
+def testDeeperResultWins():
+    cache = ChessUCI.AnalysisCache()
+    cache.put(1, result(12, 'e2e4'))
+    cache.put(1, result(8, 'd2d4'))
+    assert cache.get(1).bestMove == 'e2e4'
+    cache.put(1, result(14, 'c2c4'))
+    assert cache.get(1).bestMove == 'c2c4'
+
+def testDepthRequest():
+    cache = ChessUCI.AnalysisCache()
+    cache.put(1, result(10, 'e2e4'))
+    assert cache.get(1, 10).bestMove == 'e2e4'
+    assert cache.get(1, 11) is None
+
+def testFileKeepsTheDeeperResult(tmp_path):
+    path = str(tmp_path / 'analysis.sqlite')
+    cache = ChessUCI.AnalysisCache(size=1, path=path)
+    cache.put(2 ** 64 - 1, result(20, 'e2e4')) #keys use all 64 bits
+    cache.put(5, result(3, 'a2a3')) #pushes the deep result out of memory
+    cache.put(2 ** 64 - 1, result(6, 'h2h3')) #only the file still knows the deep one
+    assert cache.get(2 ** 64 - 1).bestMove == 'e2e4'
+    cache.close()
+    cache = ChessUCI.AnalysisCache(path=path)
+    assert cache.get(2 ** 64 - 1, 20).bestMove == 'e2e4'
+    assert cache.get(5).bestMove == 'a2a3'
+    cache.close()
+
+def testEngineSetupIsPartOfTheKey():
+    key = 0x123456789abcdef
+    plain = ChessUCI.engineKey(key, ['stockfish'], {})
+    assert ChessUCI.engineKey(key, ['stockfish'], {}) == plain
+    assert ChessUCI.engineKey(key, ['stockfish'], {'Skill Level': 3}) != plain
+    assert ChessUCI.engineKey(key, ['other'], {}) != plain
+    assert ChessUCI.engineKey(key, ['stockfish'], {'Hash': 16, 'Threads': 2}) == ChessUCI.engineKey(key, ['stockfish'], {'Threads': 2, 'Hash': 16})
\ No newline at end of file
@@ -0,0 +1,46 @@
+import ChessEngine
+
+def play(gs, sanMoves):
+    for san in sanMoves.split():
+        gs.makeMove(gs.parseSAN(san))
+    return gs
+
+def testThreefoldRepetition():
+    gs = play(ChessEngine.GameState(), 'Nf3 Nf6 Ng1 Ng8 Nf3 Nf6 Ng1')
+    assert not gs.gameStatus().gameOver
+    assert gs.isDraw() #the search already scores the second occurrence as a draw
+    play(gs, 'Ng8')
+    status = gs.gameStatus()
+    assert status.draw and status.reason == 'threefold repetition' and status.result == '1/2-1/2'
+    gs.undoMove()
+    assert not gs.gameStatus().gameOver
+
+def testInsufficientMaterial():
+    for fen, dead in [('8/8/4k3/8/8/3K4/8/8 w - - 0 1', True),
+                      ('8/8/4k3/8/8/3K1N2/8/8 w - - 0 1', True),
+                      ('8/8/4k1b1/8/8/3K1B2/8/8 w - - 0 1', True), #bishops on the same color
+                      ('8/8/4kb2/8/8/3K1B2/8/8 w - - 0 1', False),
+                      ('8/8/4k3/8/8/3KNN2/8/8 w - - 0 1', False),
+                      ('8/8/4k3/8/8/3K1P2/8/8 w - - 0 1', False)]:
+        gs = ChessEngine.GameState(fen)
+        assert gs.insufficientMaterial() == dead, fen
+        assert (gs.gameStatus().reason == 'insufficient material') == dead, fen
+
+def testFiftyMoveRule():
+    gs = ChessEngine.GameState('8/8/4k3/8/8/3K4/7R/8 w - - 99 80')
+    assert not gs.isDraw()
+    play(gs, 'Rh3')
+    assert gs.isDraw()
+    assert gs.gameStatus().reason == 'fifty-move rule'
+
+def testMateOnTheHundredthPlyWins():
+    gs = ChessEngine.GameState('k7/8/1K6/8/8/8/8/7R w - - 99 80')
+    play(gs, 'Rh8')
+    assert gs.halfmoveClock == 100
+    assert not gs.isDraw()
+    status = gs.gameStatus()
+    assert status.checkmate and not status.draw and status.result == '1-0'
+
+def testStalemate():
+    status = ChessEngine.GameState('k7/2Q5/1K6/8/8/8/8/8 b - - 0 1').gameStatus()
+    assert status.stalemate and status.draw and status.reason == 'stalemate'
\ No newline at end of file
@@ -0,0 +1,15 @@
+import pytest
+import ChessEngine
+
+@pytest.mark.parametrize('fen, san, gain', [
+    ('4k3/8/4p3/3n4/4P3/8/8/4K3 w - - 0 1', 'exd5', 320 - 100), #wins the knight for the pawn
+    ('4k3/8/8/3p4/8/8/8/3RK3 w - - 0 1', 'Rxd5', 100), #nothing recaptures
+    ('4k3/2p5/3p4/8/8/8/8/3QK3 w - - 0 1', 'Qxd6', 100 - 900), #the queen is lost for a pawn
+    ('3rk3/8/8/3p4/8/8/8/3RK3 w - - 0 1', 'Rxd5', 100 - 500), #the rook is lost for a pawn
+    ('3rk3/8/8/3p4/8/8/3R4/3RK3 w - - 0 1', 'Rxd5', 100), #the second rook recaptures through the first (x-ray)
+    ('3rk3/3r4/8/3p4/8/8/3R4/3RK3 w - - 0 1', 'Rxd5', 100 - 500), #and black has a second rook behind the first too
+    ('4k3/8/4p3/3p4/8/5B2/8/4K2Q w - - 0 1', 'Bxd5', 100 - 330 + 100), #the queen behind the bishop wins a pawn back
+])
+def testStaticExchange(fen, san, gain):
+    gs = ChessEngine.GameState(fen)
+    assert gs.staticExchange(gs.parseSAN(san)) == gain
\ No newline at end of file
@@ -0,0 +1,35 @@
+import pytest
+import ChessEngine
+import ChessPerft
+
+def testSuiteRoundTrip():
+    for name, fen, counts in ChessPerft.perftSuite:
+        assert ChessEngine.GameState.fromFEN(fen).toFEN() == fen, name
+
+def testRoundTripAfterMoves():
+    gs = ChessEngine.GameState()
+    for san in ['e4', 'c5', 'e5', 'd5']: #d5 leaves an en passant capture for the e5 pawn
+        gs.makeMove(gs.parseSAN(san))
+    fen = gs.toFEN()
+    assert fen == 'rnbqkbnr/pp2pppp/8/2ppP3/8/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 3'
+    again = ChessEngine.GameState.fromFEN(fen)
+    assert again.toFEN() == fen
+    assert again.zobristKey == gs.zobristKey
+
+@pytest.mark.parametrize('fen', [
+    'P3k3/8/8/8/8/8/8/4K3 w - - 0 1', #pawn on the last rank
+    '4k3/8/8/8/8/8/8/4K2p b - - 0 1', #pawn on the first rank
+    '4k3/8/8/8/8/8/8/8 w - - 0 1', #no white king
+    '4k3/8/8/8/8/8/8/3KK3 w - - 0 1', #two white kings
+    '4k3/4Q3/8/8/8/8/8/4K3 w - - 0 1', #black is in check with white to move
+    '4k3/8/8/8/8/8/8/4K3 x - - 0 1',
+    '4k3/8/8/8/8/8/8/4K3/8 w - - 0 1',
+    '4k3/8/8/8/8/8/8/4K2 w - - 0 1',
+])
+def testIllegalPositionsRejected(fen):
+    with pytest.raises(ValueError):
+        ChessEngine.GameState.fromFEN(fen)
+
+def testCheckOfTheSideToMoveAccepted():
+    gs = ChessEngine.GameState.fromFEN('4k3/4Q3/8/8/8/8/8/4K3 b - - 0 1')
+    assert [gs.toSAN(move) for move in gs.generateMoves([])] == ['Kxe7']
\ No newline at end of file
@@ -0,0 +1,40 @@
+import random
+import ChessEngine
+import ChessPerft
+
+def playRandomGames(check, games=24, plies=60, debugHashing=False):
+    #random games from the perft positions, with check(gs) after every move and every take-back. a castling, en passant
+    #or promotion move is picked half the time there is one, so every kind gets played. returns the move flags played
+    rng = random.Random(1)
+    starts = [fen for name, fen, counts in ChessPerft.perftSuite]
+    played = set()
+    for i in range(games):
+        gs = ChessEngine.GameState.fromFEN(starts[i % len(starts)])
+        gs.debugHashing = debugHashing
+        for ply in range(plies):
+            moves = gs.generateMoves([])
+            if not moves:
+                break
+            special = [move for move in moves if move >> 12 >= ChessEngine.castleMove]
+            move = rng.choice(special if special and rng.random() < 0.5 else moves)
+            played.add(min(move >> 12, 4))
+            gs.makeMove(move)
+            check(gs)
+        while gs.history:
+            gs.undoMove()
+            check(gs)
+    return played
+
+def testIncrementalScores():
+    def sameScores(gs):
+        fresh = ChessEngine.GameState.fromFEN(gs.toFEN())
+        assert (gs.middlegameScore, gs.endgameScore, gs.phase) == (fresh.middlegameScore, fresh.endgameScore, fresh.phase), gs.toFEN()
+    played = playRandomGames(sameScores)
+    assert {ChessEngine.castleMove, ChessEngine.enpassantMove, 4} <= played
+
+def testIncrementalZobristKey():
+    #with debugHashing every makeMove and undoMove recomputes the key and raises if the incremental one differs
+    def sameKey(gs):
+        assert gs.zobristKey == ChessEngine.GameState.fromFEN(gs.toFEN()).zobristKey, gs.toFEN()
+    played = playRandomGames(sameKey, debugHashing=True)
+    assert {ChessEngine.castleMove, ChessEngine.enpassantMove, 4} <= played
\ No newline at end of file
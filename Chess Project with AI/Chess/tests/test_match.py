@@ -0,0 +1,36 @@
+import math
+import pytest
+import ChessEngine
+import ChessMatch
+
+def testEvenScore():
+    assert ChessMatch.scoreToElo(0.5) == 0
+    elo, error = ChessMatch.eloDifference(3, 3, 4)
+    assert elo == 0 and 0 < error < math.inf
+
+def testCleanSweep():
+    assert ChessMatch.eloDifference(10, 0, 0) == (math.inf, math.inf)
+    assert ChessMatch.eloDifference(0, 10, 0) == (-math.inf, math.inf)
+    assert ChessMatch.eloDifference(0, 0, 0) == (0.0, math.inf)
+
+def testMarginIsSymmetric():
+    elo, error = ChessMatch.eloDifference(6, 3, 1)
+    reverse, reverseError = ChessMatch.eloDifference(3, 6, 1)
+    assert reverse == pytest.approx(-elo)
+    assert reverseError == pytest.approx(error)
+    assert ChessMatch.scoreToElo(0.75) == pytest.approx(-ChessMatch.scoreToElo(0.25))
+
+def testColorsAlternate(tmp_path):
+    pgnPath = str(tmp_path / 'games.pgn')
+    wins, losses, draws = ChessMatch.runMatch('negamax:1', 'random', games=2, plyLimit=30, pgnPath=pgnPath, verbose=False)
+    games = list(ChessEngine.readPGN(pgnPath))
+    assert [(game.tags['Round'], game.tags['White'], game.tags['Black']) for game in games] == [('1', 'negamax:1', 'random'),
+                                                                                                ('2', 'random', 'negamax:1')]
+    results = [game.result for game in games]
+    assert wins == (results[0] == '1-0') + (results[1] == '0-1')
+    assert losses == (results[0] == '0-1') + (results[1] == '1-0')
+    assert draws == results.count('1/2-1/2')
+    assert wins + losses + draws == 2
+
+def testRandomPlayers():
+    assert sum(ChessMatch.runMatch('random', 'random', games=2, verbose=False)) == 2
\ No newline at end of file
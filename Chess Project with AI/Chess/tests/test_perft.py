@@ -0,0 +1,26 @@
+import pytest
+import ChessEngine
+import ChessPerft
+
+#the suite's counts up to a size that keeps the run short, ChessPerft.py --suite checks the deeper ones
+cases = [(name, fen, depth, count) for name, fen, counts in ChessPerft.perftSuite
+            for depth, count in enumerate(counts, 1) if count <= 20000]
+
+@pytest.mark.parametrize('name,fen,depth,count', cases, ids=[case[0] + ' ' + str(case[2]) for case in cases])
+def testPerft(name, fen, depth, count):
+    gs = ChessEngine.GameState.fromFEN(fen)
+    assert ChessPerft.perft(gs, depth) == count
+    assert gs.toFEN() == fen #every move was taken back
+
+def testBulkCountingAgrees():
+    gs = ChessEngine.GameState.fromFEN(ChessPerft.perftSuite[1][1])
+    assert ChessPerft.perft(gs, 2, bulk=False) == ChessPerft.perft(gs, 2) == 2039
+
+def testStagedMovesAreTheLegalMoves():
+    #the search's lazy generator hands out every legal move exactly once, whatever the hash move and killers
+    for name, fen, counts in ChessPerft.perftSuite:
+        gs = ChessEngine.GameState.fromFEN(fen)
+        legal = sorted(gs.generateMoves([]))
+        pool = ChessEngine.MovePool(2)
+        staged = list(gs.stagedMoves(legal[0], (legal[-1], 0), None, False, pool.get(0)))
+        assert sorted(staged) == legal, name
\ No newline at end of file
@@ -0,0 +1,46 @@
+import ChessEngine
+
+games = '''[Event "First"]
+[White "A"]
+[Black "B"]
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 ; the Ruy Lopez
+4. Ba4 Nf6 {a comment that runs
+over two lines} 5. O-O (5. Qe2 b5) Be7 1-0
+
+[Event "Second"]
+[Result "1/2-1/2"]
+
+1. d4 d5 2. c4 e6 ; comment at the end of a line
+3. Nc3 1/2-1/2
+'''
+
+expected = [(['e4', 'e5', 'Nf3', 'Nc6', 'Bb5', 'a6', 'Ba4', 'Nf6', 'O-O', 'Be7'], '1-0'),
+            (['d4', 'd5', 'c4', 'e6', 'Nc3'], '1/2-1/2')]
+
+def summary(source):
+    return [(game.moves, game.result) for game in ChessEngine.readPGN(source)]
+
+def testSplitlinesReadsLikeAFile(tmp_path):
+    path = tmp_path / 'games.pgn'
+    path.write_text(games)
+    assert summary(str(path)) == expected
+    assert summary(games.splitlines()) == expected
+    assert summary(games.splitlines(True)) == expected
+
+def testWindowsLineEnds():
+    assert summary(games.replace('\n', '\r\n').splitlines(True)) == expected
+
+def testRoundTrip():
+    game = next(ChessEngine.readPGN(games.splitlines()))
+    again = next(ChessEngine.readPGN(game.toPGN().splitlines()))
+    assert again.moves == game.moves
+    assert again.result == game.result
+    assert again.tags['White'] == 'A'
+
+def testReplay():
+    game = next(ChessEngine.readPGN(games.splitlines()))
+    sanMoves = [gs.toSAN(move) for gs, move in game.replay()] #the position is only valid until the next step
+    assert sanMoves == game.moves
+    assert game.play().toFEN().startswith('r1bqk2r/1pppbppp/p1n2n2/4p3/B3P3/5N2/PPPP1PPP/RNBQ1RK1 w kq')
\ No newline at end of file
@@ -0,0 +1,38 @@
+import random
+import ChessEngine
+
+def testRoundTripInRandomGames():
+    rng = random.Random(7)
+    for game in range(10):
+        gs = ChessEngine.GameState()
+        while not gs.gameStatus().gameOver and len(gs.history) < 150:
+            for move in gs.generateMoves([]):
+                assert gs.parseSAN(gs.toSAN(move)) == move
+            gs.makeMove(rng.choice(gs.generateMoves([])))
+
+def testDisambiguation():
+    gs = ChessEngine.GameState('4k3/8/8/8/8/8/4K3/R6R w - - 0 1')
+    assert gs.toSAN(gs.parseSAN('Rad1')) == 'Rad1'
+    gs = ChessEngine.GameState('4k3/8/8/R7/8/8/8/R3K3 w - - 0 1')
+    assert gs.toSAN(gs.parseSAN('R1a3')) == 'R1a3'
+    gs = ChessEngine.GameState('4k3/8/8/8/8/8/8/R3K2R w K - 0 1')
+    assert gs.toSAN(gs.parseSAN('O-O')) == 'O-O'
+
+def testPinnedRivalNeedsNoDisambiguation():
+    gs = ChessEngine.GameState('4k3/8/8/8/b7/8/2N5/3K1N2 w - - 0 1') #the c2 knight is pinned and cannot go to e3
+    assert gs.toSAN(gs.parseSAN('Ne3')) == 'Ne3'
+
+def testGameRecordSuffixes():
+    gs = ChessEngine.GameState()
+    for san in ['f3', 'e5', 'g4', 'Qh4#']:
+        gs.makeMove(gs.parseSAN(san))
+    game = ChessEngine.PGNGame.fromGameState(gs)
+    assert game.moves == ['f3', 'e5', 'g4', 'Qh4#']
+    assert game.result == '0-1'
+    gs = ChessEngine.GameState('4k3/8/8/8/8/8/8/R3K3 w Q - 0 1')
+    gs.makeMove(gs.parseSAN('O-O-O'))
+    gs.makeMove(gs.parseSAN('Kf7'))
+    gs.makeMove(gs.parseSAN('Rd7'))
+    game = ChessEngine.PGNGame.fromGameState(gs)
+    assert game.moves == ['O-O-O', 'Kf7', 'Rd7+']
+    assert game.tags['FEN'] == '4k3/8/8/8/8/8/8/R3K3 w Q - 0 1'
\ No newline at end of file
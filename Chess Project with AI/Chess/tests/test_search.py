@@ -0,0 +1,92 @@
+import ChessAI
+import ChessEngine
+
+def testSharedTableAge():
+    #two processes' views of one shared table see the same age, so the replacement rule treats their entries alike
+    buffer = bytearray(ChessAI.TranspositionTable.sharedBytes(1))
+    first = ChessAI.TranspositionTable(1, buffer=memoryview(buffer))
+    second = ChessAI.TranspositionTable(1, buffer=memoryview(buffer))
+    first.clear()
+    first.newSearch()
+    assert second.age == 1
+    second.store(12345, 4, ChessAI.exactBound, 17, 0)
+    assert first.probe(12345) == (4, ChessAI.exactBound, 17, 0)
+    first.release()
+    second.release()
+
+def search(fen, depth):
+    gs = ChessEngine.GameState(fen)
+    ChessAI.transpositionTable.clear()
+    return ChessAI.findBestMove(gs, gs.getValidMoves(), ChessAI.SearchLimits(moveTime=float('inf'), maxDepth=depth))
+
+def testMateScoresCountPlies():
+    #the shorter mate scores higher, the hash table must not turn a mate found deeper in the tree into a shorter one
+    mateInOne = search('k7/8/1K6/8/8/8/8/7R w - - 0 1', 3)
+    assert mateInOne.move.getLastMovement() == 'h1h8'
+    assert mateInOne.score == ChessAI.checkmate - 1
+    mateInTwo = search('k7/8/2K5/8/8/8/8/1R6 w - - 0 1', 5)
+    assert mateInTwo.score == ChessAI.checkmate - 3
+
+def testMatedSideScoresTheDistance():
+    result = search('k7/8/2K5/8/8/8/8/1R6 w - - 0 1', 5)
+    gs = ChessEngine.GameState('k7/8/2K5/8/8/8/8/1R6 w - - 0 1')
+    gs.makeMove(result.move)
+    reply = ChessAI.findBestMove(gs, gs.getValidMoves(), ChessAI.SearchLimits(moveTime=float('inf'), maxDepth=5))
+    assert reply.score == -(ChessAI.checkmate - 2)
+
+def testTableScoresAreRelativeToThePosition():
+    for ply in (0, 5, 40):
+        for score in (ChessAI.checkmate - 7 - ply, -(ChessAI.checkmate - 7 - ply), 250, -30, 0):
+            stored = ChessAI.scoreToTable(score, ply)
+            assert ChessAI.scoreFromTable(stored, ply) == score
+        assert ChessAI.scoreToTable(ChessAI.checkmate - 7 - ply, ply) == ChessAI.checkmate - 7
+
+def testDepthReplacement():
+    #a deeper entry of this search stays, one from an older search or a shallower one makes room
+    table = ChessAI.TranspositionTable(1)
+    key, other = 7, 7 + table.size #same slot
+    table.store(key, 6, ChessAI.exactBound, 10, 0)
+    table.store(other, 2, ChessAI.exactBound, 20, 0)
+    assert table.probe(key) == (6, ChessAI.exactBound, 10, 0)
+    assert table.probe(other) is None
+    table.store(other, 8, ChessAI.exactBound, 20, 0)
+    assert table.probe(other) == (8, ChessAI.exactBound, 20, 0)
+    table.newSearch()
+    table.store(key, 1, ChessAI.exactBound, 30, 0)
+    assert table.probe(key) == (1, ChessAI.exactBound, 30, 0)
+
+def testAlwaysReplacement():
+    table = ChessAI.TranspositionTable(1, replacement='always')
+    key, other = 7, 7 + table.size
+    table.store(key, 6, ChessAI.exactBound, 10, 0)
+    table.store(other, 2, ChessAI.exactBound, 20, 0)
+    assert table.probe(key) is None
+    assert table.probe(other) == (2, ChessAI.exactBound, 20, 0)
+
+def testTableStats():
+    table = ChessAI.TranspositionTable(1)
+    key, other = 7, 7 + table.size
+    table.store(key, 3, ChessAI.exactBound, 0, 0)
+    table.store(key, 4, ChessAI.exactBound, 0, 0) #same position, not an overwrite
+    table.store(other, 5, ChessAI.exactBound, 0, 0)
+    table.probe(other)
+    table.probe(key)
+    table.probe(8)
+    stats = table.stats()
+    assert stats['entries'] == table.size and stats['sizeMB'] == 1
+    assert (stats['probes'], stats['hits'], stats['misses'], stats['collisions']) == (3, 1, 2, 1)
+    assert (stats['stores'], stats['overwrites']) == (3, 1)
+    assert stats['hitRate'] == 1 / 3
+    assert stats['hashfull'] == 1 #one of the first 1000 slots
+    table.resetStats()
+    assert table.stats()['probes'] == 0 and table.stats()['hitRate'] == 0.0
+
+def testMateThroughTheTable():
+    #a mate 6 plies below a position stored at ply 4 is still 6 plies below it when the position comes up at ply 8
+    table = ChessAI.TranspositionTable(1)
+    table.store(99, 5, ChessAI.exactBound, ChessAI.scoreToTable(ChessAI.checkmate - 10, 4), 0)
+    depth, bound, score, move = table.probe(99)
+    assert ChessAI.scoreFromTable(score, 8) == ChessAI.checkmate - 14
+    table.store(99, 5, ChessAI.exactBound, ChessAI.scoreToTable(-(ChessAI.checkmate - 10), 4), 0)
+    depth, bound, score, move = table.probe(99)
+    assert ChessAI.scoreFromTable(score, 2) == -(ChessAI.checkmate - 8)
\ No newline at end of file
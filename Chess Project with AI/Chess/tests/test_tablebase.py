@@ -0,0 +1,56 @@
+import pytest
+import ChessEngine
+import ChessTablebase
+
+@pytest.fixture(scope='module')
+def tablebases(tmp_path_factory):
+    #the 3 piece tables take a few seconds to generate
+    directory = str(tmp_path_factory.mktemp('tables'))
+    ChessTablebase.buildTables(['KQvK', 'KRvK'], directory, verbose=False)
+    tables = ChessTablebase.Tablebases(directory)
+    yield tables
+    tables.close()
+
+def probe(tablebases, fen):
+    return tablebases.probe(ChessEngine.GameState(fen))
+
+def testLongestMates(tablebases):
+    #the longest wins with white to move are mate in 10 moves with the queen and in 16 with the rook
+    for name, plies in (('KQvK', 19), ('KRvK', 31)):
+        data, size = tablebases.table(name)
+        whiteToMove = bytes(data[:size])
+        assert max(value - 1 for value in whiteToMove if 0 < value < 255) == plies
+
+def testDistances(tablebases):
+    assert probe(tablebases, 'k7/8/1K6/8/8/8/8/7R w - - 0 1') == (1, 1)
+    assert probe(tablebases, 'k7/8/2K5/8/8/8/8/1R6 w - - 0 1') == (1, 3)
+    assert probe(tablebases, 'k6R/8/1K6/8/8/8/8/8 b - - 0 1') == (-1, 0) #already mated
+    assert probe(tablebases, 'k7/2Q5/1K6/8/8/8/8/8 b - - 0 1') == (0, 0) #stalemate
+    assert probe(tablebases, 'K7/8/1k6/8/8/8/8/7r b - - 0 1') == (1, 1) #the color of the strong side doesn't matter
+    assert probe(tablebases, '8/8/8/8/8/8/1q6/K1k5 w - - 0 1') == (-1, 0)
+
+def testDrawWhenTheRookFalls(tablebases):
+    assert probe(tablebases, '7K/8/8/8/8/1k6/2R5/8 b - - 0 1') == (0, 0)
+
+def testOutsideTheTables(tablebases):
+    assert probe(tablebases, ChessEngine.GameState().toFEN()) is None
+    assert probe(tablebases, '4k3/8/8/8/8/8/8/R3K3 w Q - 0 1') is None #castling rights aren't in the tables
+
+def testMovesAgreeWithTheGame(tablebases):
+    #every move of a won position leads to a position lost in fewer plies, at least one in exactly one ply less
+    gs = ChessEngine.GameState('8/8/8/4k3/8/8/8/R3K3 w - - 0 1')
+    outcome, plies = tablebases.probe(gs)
+    assert outcome == 1
+    replies = []
+    for move in gs.generateMoves([]):
+        gs.makeMove(move)
+        replies.append(tablebases.probe(gs))
+        gs.undoMove()
+    assert min(-result[0] * (1000 - result[1]) for result in replies) >= -1000
+    assert (-1, plies - 1) in replies
+
+def testPiecesFromTheTableNames(tmp_path):
+    for fileName in ('KQvK.tb', 'KRPvKR.tb', 'notes.tb', 'KvK.tb.bak'):
+        (tmp_path / fileName).write_bytes(b'')
+    assert ChessTablebase.Tablebases(str(tmp_path)).pieces == 5
+    assert ChessTablebase.Tablebases(str(tmp_path / 'missing')).pieces == 0
\ No newline at end of file
@@ -0,0 +1,202 @@
+import asyncio
+import sys
+import time
+import pytest
+import ChessAI
+import ChessEngine
+import ChessUCI
+
+#answers uci and isready like an engine, then never finishes a search
+silentSearch = [sys.executable, '-u', '-c', '''
+import sys
+for line in sys.stdin:
+    if line.startswith('uci'):
+        print('uciok')
+    elif line.startswith('isready'):
+        print('readyok')
+''']
+
+#searches until told to stop, then answers with its best move so far
+stopToAnswer = [sys.executable, '-u', '-c', '''
+import sys
+for line in sys.stdin:
+    if line.startswith('uci'):
+        print('uciok')
+    elif line.startswith('isready'):
+        print('readyok')
+    elif line.startswith('go'):
+        print('info depth 5 score cp 20 nodes 1000 pv e2e4')
+    elif line.startswith('stop'):
+        print('bestmove e2e4')
+''']
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+async def analyseWith(command, searches, **limits):
+    engine = ChessUCI.UCIEngine(command)
+    try:
+        results = [await engine.analyse(moves, **limits) for moves in searches]
+        return results, engine.restarts
+    finally:
+        await engine.stop()
+
+def testScriptedReplies():
+    results, restarts = run(analyseWith(ChessUCI.fakeEngineCommand(['g1f3', 'b1c3']), [[], ['e2e4']], depth=1))
+    assert [result.bestMove for result in results] == ['g1f3', 'b1c3']
+    assert restarts == 0
+
+def testCrashIsRestartedOnce():
+    #every second search kills the process, the engine is started again and the search repeated
+    results, restarts = run(analyseWith(ChessUCI.fakeEngineCommand(crashAfter=2), [[], ['e2e4'], ['e2e4', 'e7e5']], depth=1))
+    assert [result.bestMove is not None for result in results] == [True, True, True]
+    assert restarts == 2 #the restarted process crashes on its second search too
+
+def testEngineThatAlwaysCrashes():
+    with pytest.raises(ChessUCI.EngineError):
+        run(analyseWith(ChessUCI.fakeEngineCommand(crashAfter=1), [[]], depth=1))
+
+def testMissingEngine():
+    with pytest.raises(ChessUCI.EngineError):
+        run(analyseWith(['/nonexistent/engine'], [[]], depth=1))
+
+def testEngineThatDoesNotStart(monkeypatch):
+    monkeypatch.setattr(ChessUCI, 'startTimeout', 0.3)
+    start = time.perf_counter()
+    with pytest.raises(ChessUCI.EngineError):
+        run(analyseWith([sys.executable, '-c', 'import time; time.sleep(30)'], [[]], depth=1))
+    assert time.perf_counter() - start < 10
+
+def testSearchTimeout(monkeypatch):
+    monkeypatch.setattr(ChessUCI, 'searchMargin', 0.2)
+    with pytest.raises(ChessUCI.EngineError):
+        run(analyseWith(silentSearch, [[]], movetime=0.05))
+
+def testDepthSearchTimeout(monkeypatch):
+    #a depth search gets searchTimeout, then stop, then searchMargin to answer before the engine is killed
+    monkeypatch.setattr(ChessUCI, 'searchTimeout', 0.2)
+    monkeypatch.setattr(ChessUCI, 'searchMargin', 0.2)
+    start = time.perf_counter()
+    with pytest.raises(ChessUCI.EngineError):
+        run(analyseWith(silentSearch, [[]], depth=30))
+    assert time.perf_counter() - start < 10
+
+def testStoppedSearchKeepsTheBestMove(monkeypatch):
+    monkeypatch.setattr(ChessUCI, 'searchTimeout', 0.2)
+    results, restarts = run(analyseWith(stopToAnswer, [[]], nodes=10**9))
+    assert (results[0].bestMove, results[0].depth, restarts) == ('e2e4', 5, 0)
+
+def testBrokenOptionGivesBackTheSlot(monkeypatch):
+    async def failing(self, name, value):
+        raise ChessUCI.EngineError('option rejected')
+    async def borrow():
+        pool = ChessUCI.EnginePool(ChessUCI.fakeEngineCommand(), size=1)
+        try:
+            pool.release(await pool.acquire())
+            await pool.setOption('Hash', 32)
+            with monkeypatch.context() as patch:
+                patch.setattr(ChessUCI.UCIEngine, 'setOption', failing)
+                with pytest.raises(ChessUCI.EngineError):
+                    await pool.acquire()
+            assert pool.engines == [] and pool.idle == []
+            engine = await asyncio.wait_for(pool.acquire(), 5) #the slot is free again
+            assert engine.options == {'Hash': 32}
+            pool.release(engine)
+        finally:
+            await pool.close()
+    run(borrow())
+
+def testWorkerFallsBackToTheBuiltInSearch(monkeypatch):
+    #whatever goes wrong with stockfish, the AI still moves, and says why
+    monkeypatch.setattr(ChessUCI, 'startTimeout', 0.3)
+    monkeypatch.setattr(ChessAI, 'bookPath', None)
+    for command in (silentSearch[:3] + ['import time; time.sleep(30)'], ChessUCI.fakeEngineCommand(crashAfter=1)):
+        manager = ChessUCI.EngineManager(command)
+        monkeypatch.setattr(ChessAI, 'stockfishManager', manager)
+        worker = ChessAI.SearchWorker()
+        worker.start(ChessEngine.GameState(), [], ChessAI.SearchLimits(maxDepth=1))
+        messages = []
+        deadline = time.perf_counter() + 30
+        while worker.busy and time.perf_counter() < deadline:
+            messages += [message for message in worker.poll() if message[0] != 'progress']
+            time.sleep(0.02)
+        manager.close()
+        assert [message[0] for message in messages] == ['error', 'done']
+        assert messages[1][1].move is not None
+
+def fenAfter(moves, fen=None):
+    gs = ChessEngine.GameState.fromFEN(fen) if fen else ChessEngine.GameState()
+    for uci in moves:
+        assert ChessUCI.playUCIMove(gs, uci)
+    return gs.toFEN()
+
+def testPositionCommands():
+    #the engine is sent the FEN after the last pawn move, capture or castling rights change plus the moves since,
+    #ucinewgame only when the game changes, and its own picture of the board always matches the game
+    castling = 'r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1'
+    steps = [([], None, ['position startpos']),
+             (['g1f3'], None, ['position startpos moves g1f3']),
+             (['g1f3', 'g8f6', 'e2e4'], None, ['position fen ' + fenAfter(['g1f3', 'g8f6', 'e2e4'])]),
+             (['g1f3', 'g8f6', 'e2e4', 'b8c6'], None, ['position fen ' + fenAfter(['g1f3', 'g8f6', 'e2e4']) + ' moves b8c6']),
+             (['g1f3', 'g8f6'], None, ['position startpos moves g1f3 g8f6']), #taken back, same game
+             (['g1f3', 'g8f6', 'b1c3'], None, ['position startpos moves g1f3 g8f6 b1c3']),
+             (['b1c3'], None, ['ucinewgame', 'position startpos moves b1c3']), #a new game
+             (['e1g1', 'e8d8'], castling, ['ucinewgame', 'position fen ' + fenAfter(['e1g1', 'e8d8'], castling)]),
+             (['e1g1', 'e8d8', 'f1f2'], castling, ['position fen ' + fenAfter(['e1g1', 'e8d8'], castling) + ' moves f1f2'])]
+    async def play():
+        engine = ChessUCI.UCIEngine(ChessUCI.fakeEngineCommand())
+        sent = []
+        send = engine.send
+        async def record(line):
+            sent.append(line)
+            await send(line)
+        engine.send = record
+        try:
+            for moves, fen, commands in steps:
+                lines = await engine.display(moves, fen)
+                assert [line for line in sent if line.startswith(('position', 'ucinewgame'))] == commands
+                assert 'Fen: ' + fenAfter(moves, fen) in lines
+                assert not engine.newGamePending
+                sent.clear()
+        finally:
+            await engine.stop()
+    run(play())
+
+def testGameSentAgainAfterARestart():
+    #a restarted engine knows nothing, the game is replayed from the start to send it the position again
+    async def play():
+        engine = ChessUCI.UCIEngine(ChessUCI.fakeEngineCommand(crashAfter=2))
+        try:
+            await engine.analyse(['g1f3'], depth=1)
+            assert engine.anchor == (0, None)
+            await engine.analyse(['g1f3', 'g8f6', 'e2e4'], depth=1)
+            assert engine.restarts == 1
+            assert engine.anchor == (3, fenAfter(['g1f3', 'g8f6', 'e2e4']))
+            assert 'Fen: ' + fenAfter(['g1f3', 'g8f6', 'e2e4']) in await engine.display(['g1f3', 'g8f6', 'e2e4'])
+        finally:
+            await engine.stop()
+    run(play())
+
+def testFindStockfishMove(monkeypatch):
+    monkeypatch.setattr(ChessAI, 'bookPath', None)
+    gs = ChessEngine.GameState()
+    for command, expected in ((ChessUCI.fakeEngineCommand(['g1f3']), 'g1f3'), (['/nonexistent/engine'], None)):
+        manager = ChessUCI.EngineManager(command)
+        monkeypatch.setattr(ChessAI, 'stockfishManager', manager)
+        try:
+            result = ChessAI.findStockfishMove(gs, gs.getValidMoves(), [], ChessAI.SearchLimits(maxDepth=1))
+        finally:
+            manager.close()
+        assert result.move is not None #the built-in search's move when stockfish can't be used
+        if expected is not None:
+            assert result.move.getLastMovement() == expected
+
+def testStockfishMateScores():
+    gs = ChessEngine.GameState()
+    engineResult = ChessUCI.EngineResult()
+    engineResult.bestMove = 'e2e4'
+    for mate, score in ((1, ChessAI.checkmate - 1), (3, ChessAI.checkmate - 5), (-2, -(ChessAI.checkmate - 4))):
+        engineResult.mate = mate
+        assert ChessAI.stockfishResult(engineResult, gs.getValidMoves()).score == score
+    engineResult.bestMove = 'e2e5'
+    assert ChessAI.stockfishResult(engineResult, gs.getValidMoves()).move is None
\ No newline at end of file